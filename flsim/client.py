@@ -1,23 +1,239 @@
 # flsim/client.py
 import logging
+from collections import OrderedDict
+import numpy as np
 import torch
 import random
 import os
+from utils.selection import UtilityIndex
+from utils.profiling import profiler  # pylint: disable=no-name-in-module
+from utils.spans import spans  # pylint: disable=no-name-in-module
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, in stable descending order.
+
+    Same result as sorting all indices by score and slicing, with ties
+    going to the lower index, but in O(n) plus O(k log k).
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    kth = np.partition(scores, n - k)[n - k]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    index = np.concatenate([above, ties])
+    return index[np.argsort(-scores[index], kind='stable')]
+
+
+class ClientTable(object):
+    """Per-client scalars of the whole population, one array per field.
+
+    Clients read and write their own row through properties, while
+    selection policies score the columns at once. Utility-based policies
+    keep a UtilityIndex that is only refreshed for the rows whose loss or
+    delay changed since the last selection.
+    """
+
+    POLICIES = ('short_latency_first', 'high_loss_first',
+                'short_latency_high_loss_first', 'loss_proportional')
+    # Columns that selection utilities depend on
+    UTILITY_FIELDS = ('loss', 'est_delay')
+
+    def __init__(self, num_clients, labels=None, explore=None, epsilon=0.1,
+                 choices=None):
+        self.loss = np.full(num_clients, 10.0)  # Large, new clients are sampled first
+        self.est_delay = np.zeros(num_clients)
+        self.speed_mean = np.full(num_clients, np.nan)
+        self.speed_std = np.full(num_clients, np.nan)
+        # Index into labels, -1 without a preference
+        self.pref = np.full(num_clients, -1, dtype=np.int64)
+        self.last_round = np.full(num_clients, -1, dtype=np.int64)
+        self.participation = np.zeros(num_clients, dtype=np.int64)
+
+        self.labels = list(labels or [])
+        self.round = 0
+
+        # Exploration mixed into utility-based selection
+        self.explore = explore
+        self.epsilon = epsilon
+        self.choices = choices
+
+        # Utility index of the last policy, with rows changed since
+        self.utilities = None
+        self.policy = None
+        self.dirty = set()
+
+    def __len__(self):
+        return len(self.loss)
+
+    def set(self, field, row, value):
+        getattr(self, field)[row] = value
+        if field in self.UTILITY_FIELDS:
+            self.dirty.add(row)
+
+    def set_links(self, config, rng):
+        # Draw link speeds for all clients, as Client.set_link does
+        self.speed_mean[:] = rng.uniform(config.link.min, config.link.max, len(self))
+        self.speed_std[:] = config.link.std
+        self.est_delay[:] = config.model.size / self.speed_mean
+        self.utilities = None
+
+    def pref_labels(self):
+        return [self.labels[i] if i >= 0 else None for i in self.pref.tolist()]
+
+    def label_index(self, label):
+        if label not in self.labels:
+            self.labels.append(label)
+        return self.labels.index(label)
+
+    def mark_selected(self, index):
+        # Count a selection round for the given rows
+        self.round += 1
+        self.last_round[index] = self.round
+        self.participation[index] += 1
+
+    # ------- Selection policies -------
+    def utility(self, select_type, rows=slice(None)):
+        """Selection utility of rows, higher is picked first."""
+        if select_type == 'short_latency_first':
+            return -self.est_delay[rows]
+        elif select_type == 'short_latency_high_loss_first':
+            # Jointly consider latency and loss. Same order as scaling both
+            # by the max loss, but independent of the other clients
+            gamma = 0.2  # 0.2 for mnist
+            return self.loss[rows] - gamma * self.est_delay[rows]
+        else:  # high_loss_first, loss_proportional
+            return self.loss[rows]
+
+    def utility_index(self, select_type):
+        # Rebuild for a new policy, otherwise refresh the changed rows
+        if self.utilities is None or self.policy != select_type:
+            self.utilities = UtilityIndex(self.utility(select_type))
+            self.policy = select_type
+        else:
+            for row in self.dirty:
+                self.utilities.update(row, self.utility(select_type, row))
+        self.dirty = set()
+        return self.utilities
+
+    def select(self, select_type, k):
+        """Row indices of the k clients picked by a selection policy."""
+        k = min(k, len(self))
+        if select_type not in self.POLICIES:  # Select clients randomly
+            index = random.sample(range(len(self)), k)
+
+        elif self.explore == 'power_of_choice':
+            # Best k of a uniformly drawn candidate set
+            d = min(max(self.choices or 2 * k, k), len(self))
+            candidates = np.array(random.sample(range(len(self)), d), dtype=np.int64)
+            index = candidates[top_k(self.utility(select_type, candidates), k)]
+
+        elif select_type == 'loss_proportional':
+            index = self.utility_index(select_type).sample(k)
+
+        else:
+            utility_index = self.utility_index(select_type)
+            explore = 0
+            if self.explore == 'epsilon':  # Each slot explores with epsilon
+                explore = sum(random.random() < self.epsilon for _ in range(k))
+            index = utility_index.top_k(k - explore)
+
+            # Fill the exploring slots uniformly from the other clients
+            chosen = set(index)
+            while len(index) < k:
+                row = random.randrange(len(self))
+                if row not in chosen:
+                    chosen.add(row)
+                    index.append(row)
+
+        index = np.asarray(index, dtype=np.int64)
+        logging.debug('%s: loss %s est_delay %s',
+                      select_type, self.loss[index], self.est_delay[index])
+        self.mark_selected(index)
+        return index
+
+
+class ClientPopulation(object):
+    """Clients of a ClientTable, built only when first accessed.
+
+    A client is its table row plus what materialize derives for it from
+    the population seed. At most resident clients are kept, least
+    recently used first out; their scalars stay in the table.
+    """
+
+    def __init__(self, table, materialize, resident):
+        self.table = table
+        self.materialize = materialize
+        self.resident = resident
+        self.clients = OrderedDict()
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, client_id):
+        client = self.clients.pop(client_id, None)
+        if client is None:
+            client = Client(client_id, self.table)
+            self.materialize(client)
+        self.clients[client_id] = client
+
+        while len(self.clients) > self.resident:
+            self.clients.popitem(last=False)
+        return client
+
+    def __iter__(self):
+        for client_id in range(len(self)):
+            yield self[client_id]
+
+
+def _column(name):
+    # Client attribute stored in its row of a ClientTable column
+    def get(self):
+        return getattr(self.table, name)[self.index].item()
+
+    def set(self, value):
+        self.table.set(name, self.index, value)
+
+    return property(get, set)
 
 
 class Client(object):
     """Simulated federated learning client."""
 
-    def __init__(self, client_id):
+    loss = _column('loss')
+    est_delay = _column('est_delay')
+    speed_mean = _column('speed_mean')
+    speed_std = _column('speed_std')
+    last_round = _column('last_round')
+    participation = _column('participation')
+
+    def __init__(self, client_id, table=None):
         self.client_id = client_id
-        # Initialize a large loss so new/idle clients are sampled first
-        self.loss = 10.0
+        # Scalars live in the population table, or a private one-row table
+        if table is None:
+            table, client_id = ClientTable(1), 0
+        self.table = table
+        self.index = client_id
+        # The loss starts large in a new table row, so new/idle clients are
+        # sampled first; a rebuilt client keeps the loss of its row
         # DP config placeholder; may be set by the server each round
         self.dp = None
 
     def __repr__(self):
         return f'Client #{self.client_id}'
 
+    @property
+    def pref(self):
+        index = self.table.pref[self.index]
+        return self.table.labels[index] if index >= 0 else None
+
+    @pref.setter
+    def pref(self, label):
+        self.table.pref[self.index] = -1 if label is None else self.table.label_index(label)
+
     # ------- Non-IID knobs -------
     def set_bias(self, pref, bias):
         self.pref = pref
@@ -61,13 +277,16 @@ class Client(object):
         # Gaussian link speed (KBytes/s) bounds
         self.speed_min = config.link.min
         self.speed_max = config.link.max
-        self.speed_mean = random.uniform(self.speed_min, self.speed_max)
         self.speed_std = config.link.std
 
         # Model size (KB)
         self.model_size = config.model.size
-        # Estimated delay for scheduling
-        self.est_delay = self.model_size / self.speed_mean
+
+        # Keep a speed the population already drew for this client
+        if np.isnan(self.speed_mean):
+            self.speed_mean = random.uniform(self.speed_min, self.speed_max)
+            # Estimated delay for scheduling
+            self.est_delay = self.model_size / self.speed_mean
 
     def set_delay(self):
         # Draw a speed for this run and clamp to bounds
@@ -95,6 +314,10 @@ class Client(object):
         self.model.load_state_dict(torch.load(path, map_location='cpu'))
         self.model.eval()
 
+        # Keep the downloaded weights to compress the update against
+        if getattr(self, 'compressor', None):
+            self.base_weights = fl_model.extract_weights(self.model)
+
         # Optimizer
         self.optimizer = fl_model.get_optimizer(self.model)
 
@@ -120,6 +343,10 @@ class Client(object):
         self.model.eval()
         logging.info('Load global model: %s', path)
 
+        # Keep the downloaded weights to compress the update against
+        if getattr(self, 'compressor', None):
+            self.base_weights = fl_model.extract_weights(self.model)
+
         # Optimizer
         self.optimizer = fl_model.get_optimizer(self.model)
 
@@ -144,30 +371,38 @@ class Client(object):
         logging.info('Training on client #%d, mean delay %ss',
                      self.client_id, self.delay)
 
-        trainloader = fl_model.get_trainloader(self.trainset, self.batch_size)
-        dp_cfg = getattr(self, "dp", None)
-        self.loss = fl_model.train(
-            self.model,
-            trainloader,
-            self.optimizer,
-            self.epochs,
-            reg=reg,
-            dp=dp_cfg
-        )
+        with spans.span('train', client=self.client_id), \
+                profiler.capture('train', self.client_id):
+            trainloader = fl_model.get_trainloader(self.trainset, self.batch_size)
+            dp_cfg = getattr(self, "dp", None)
+            self.loss = fl_model.train(
+                self.model,
+                trainloader,
+                self.optimizer,
+                self.epochs,
+                reg=reg,
+                dp=dp_cfg
+            )
 
         # Extract model weights
         weights = fl_model.extract_weights(self.model)
 
         # Build report
         self.report = Report(self)
-        self.report.weights = weights
+        if getattr(self, 'compressor', None):  # Upload a compressed update
+            self.report.update = self.compressor.compress(self, weights)
+            self.report.weights = None
+            del self.base_weights
+        else:
+            self.report.weights = weights
         self.report.loss = self.loss
         self.report.delay = self.delay
 
         # Optional test
         if self.do_test:
             testloader = fl_model.get_testloader(self.testset, 1000)
-            self.report.accuracy = fl_model.test(self.model, testloader)
+            with profiler.capture('test', self.client_id):
+                self.report.accuracy = fl_model.test(self.model, testloader)
 
     def test(self):
         raise NotImplementedError
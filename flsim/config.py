@@ -18,8 +18,12 @@ class Config(object):
 
         # -- Clients --
         fields = ['total', 'per_round', 'label_distribution',
-                  'do_test', 'test_partition', 'selection']
-        defaults = (0, 0, 'uniform', False, None, 'random')
+                  'do_test', 'test_partition', 'selection',
+                  'explore', 'epsilon', 'choices',
+                  'lazy', 'resident', 'seed']
+        defaults = (0, 0, 'uniform', False, None, 'random',
+                    None, 0.1, None,
+                    False, None, 0)
         params = [config['clients'].get(field, defaults[i])
                   for i, field in enumerate(fields)]
         self.clients = namedtuple('clients', fields)(*params)
@@ -57,8 +61,8 @@ class Config(object):
         self.model = namedtuple('model', fields)(*params)
 
         # -- Paths --
-        fields = ['data', 'model', 'reports', 'plot']
-        defaults = ('./data', './models', None, './plots')
+        fields = ['data', 'model', 'reports', 'plot', 'records', 'spans']
+        defaults = ('./data', './models', None, './plots', None, None)
         params = [config['paths'].get(field, defaults[i])
                   for i, field in enumerate(fields)]
         # Set specific model path
@@ -70,12 +74,70 @@ class Config(object):
         self.server = config['server']
 
         # -- Async --
-        fields = ['alpha', 'staleness_func']
-        defaults = (0.9, 'constant')
+        fields = ['alpha', 'staleness_func',
+                  'buffer_size', 'buffer_deadline', 'buffer_mode']
+        defaults = (0.9, 'constant', 1, None, 'sequential')
         params = [config['async'].get(field, defaults[i])
                   for i, field in enumerate(fields)]
         self.sync = namedtuple('sync', fields)(*params)
 
+        # -- Evaluation --
+        fields = ['every', 'interval', 'batch_size', 'subsample',
+                  'confidence', 'seed', 'background', 'lag']
+        defaults = (1, None, 1024, None, 0.95, 0, False, 1)
+        params = [config.get('evaluation', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.evaluation = namedtuple('evaluation', fields)(*params)
+
+        # -- Update compression --
+        fields = ['method', 'ratio', 'error_feedback', 'block']
+        defaults = ('none', 0.01, True, 2048)
+        params = [config.get('compression', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.compression = namedtuple('compression', fields)(*params)
+
+        # -- Update trace --
+        fields = ['path', 'dtype']
+        defaults = (None, 'float32')
+        params = [config.get('trace', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.trace = namedtuple('trace', fields)(*params)
+
+        # -- Report store (paths.reports) --
+        fields = ['dtype', 'delta']
+        defaults = ('float32', False)
+        params = [config.get('reports', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.reports = namedtuple('reports', fields)(*params)
+
+        # -- Client profile store --
+        fields = ['store', 'sketch_dim', 'path', 'cache']
+        defaults = ('float32', 256, None, None)
+        params = [config.get('profile', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.profile = namedtuple('profile', fields)(*params)
+
+        # -- Metrics endpoint --
+        fields = ['port', 'host']
+        defaults = (None, '127.0.0.1')
+        params = [config.get('metrics', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.metrics = namedtuple('metrics', fields)(*params)
+
+        # -- Memory accounting --
+        fields = ['track', 'interval', 'rss_threshold', 'top']
+        defaults = (False, 1.0, None, 20)
+        params = [config.get('memory', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.memory = namedtuple('memory', fields)(*params)
+
+        # -- Operator profiling --
+        fields = ['path', 'rounds', 'clients', 'fraction', 'seed', 'with_stack', 'row_limit']
+        defaults = (None, None, None, 1.0, 0, True, 25)
+        params = [config.get('profiler', {}).get(field, defaults[i])
+                  for i, field in enumerate(fields)]
+        self.profiler = namedtuple('profiler', fields)(*params)
+
         # -- Link Speed --
         fields = ['min', 'max', 'std']
         defaults = (200, 5000, 100)
@@ -84,8 +146,8 @@ class Config(object):
         self.link = namedtuple('link_speed', fields)(*params)
 
         # -- Network Settings --
-        fields = ['type', 'wifi', "ethernet"]
-        defaults = ("wifi", None, None)
+        fields = ['type', 'wifi', "ethernet", 'thz', 'ns3', 'stub']
+        defaults = ("wifi", None, None, None, None, None)
         params = [config['network'].get(field, defaults[i])
                   for i, field in enumerate(fields)]
         self.network = namedtuple('network', fields)(*params)
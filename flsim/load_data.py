@@ -70,19 +70,28 @@ class Loader(object):
             # Extract replenished data
             return self.extract(label, n)
 
-    def get_partition(self, partition_size):
+    def sample(self, label, n, rng):
+        # Draw data without using it up, for procedurally generated clients
+        unused, used = self.trainset[label], self.used[label]
+        return [unused[i] if i < len(unused) else used[i - len(unused)]
+                for i in rng.sample(range(len(unused) + len(used)), n)]
+
+    def take(self, label, n, rng=None):
+        return self.extract(label, n) if rng is None else self.sample(label, n, rng)
+
+    def get_partition(self, partition_size, rng=None):
         # Get an partition uniform across all labels
 
         # Use uniform distribution
-        dist = dists.uniform(partition_size, len(self.labels))
+        dist = dists.uniform(partition_size, len(self.labels), rng)
         print(dist)
 
         partition = []  # Extract data according to distribution
         for i, label in enumerate(self.labels):
-            partition.extend(self.extract(label, dist[i]))
+            partition.extend(self.take(label, dist[i], rng))
 
         # Shuffle data partition
-        random.shuffle(partition)
+        (rng or random).shuffle(partition)
 
         return partition
 
@@ -94,7 +103,7 @@ class Loader(object):
 class BiasLoader(Loader):
     """Load and pass 'preference bias' data partitions."""
 
-    def get_partition(self, partition_size, pref):
+    def get_partition(self, partition_size, pref, rng=None):
         # Get a non-uniform partition with a preference bias
 
         # Extract bias configuration from config
@@ -111,20 +120,20 @@ class BiasLoader(Loader):
         if secondary:
             # Distribute to random secondary label
             dist = [0] * len_minor_labels
-            dist[random.randint(0, len_minor_labels - 1)] = minority
+            dist[(rng or random).randint(0, len_minor_labels - 1)] = minority
         else:
             # Distribute among all minority labels
-            dist = dists.uniform(minority, len_minor_labels)
+            dist = dists.uniform(minority, len_minor_labels, rng)
 
         # Add majority data to distribution
         dist.insert(self.labels.index(pref), majority)
 
         partition = []  # Extract data according to distribution
         for i, label in enumerate(self.labels):
-            partition.extend(self.extract(label, dist[i]))
+            partition.extend(self.take(label, dist[i], rng))
 
         # Shuffle data partition
-        random.shuffle(partition)
+        (rng or random).shuffle(partition)
 
         return partition
 
@@ -6,6 +6,7 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torchvision import datasets, transforms
 import numpy as np
+from utils.spans import spans  # pylint: disable=no-name-in-module
 
 # Training settings
 lr = 0.01
@@ -107,7 +108,7 @@ def train(model, trainloader, optimizer, epochs, reg=None):
         old_weights = torch.from_numpy(old_weights)
 
     for epoch in range(1, epochs + 1):
-        for batch_id, data in enumerate(trainloader):
+        for batch_id, data in enumerate(spans.iterate(trainloader, 'train.data', 'train.step')):
             # get the inputs; data is a list of [inputs, labels]
             inputs, labels = data
             inputs, labels = inputs.to(device), labels.to(device)
@@ -10,6 +10,7 @@ from torchvision import datasets, transforms
 import numpy as np
 
 import load_data
+from utils.spans import spans  # pylint: disable=no-name-in-module
 
 
 # ----- Training settings -----
@@ -102,10 +103,11 @@ def _dp_log_eps(privacy_engine, dp_cfg, where: str):
     """
     try:
         delta = float(dp_cfg.get("delta", 1e-5))
-        if hasattr(privacy_engine, "accountant"):
-            eps = privacy_engine.accountant.get_epsilon(delta)
-        else:
-            eps = privacy_engine.get_epsilon(delta)
+        with spans.span('train.dp'):
+            if hasattr(privacy_engine, "accountant"):
+                eps = privacy_engine.accountant.get_epsilon(delta)
+            else:
+                eps = privacy_engine.get_epsilon(delta)
         logging.info(
             f"[DP] {where}: ε≈{eps:.2f}, δ={delta}, "
             f"σ={dp_cfg.get('noise_multiplier', 0.8)}, C={dp_cfg.get('max_grad_norm', 1.0)}"
@@ -134,13 +136,14 @@ def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] =
             accountant = dp.get("accountant", "rdp")
 
             privacy_engine = PrivacyEngine(accountant=accountant, secure_mode=secure_mode)
-            model, optimizer, trainloader = privacy_engine.make_private(
-                module=model,
-                optimizer=optimizer,
-                data_loader=trainloader,
-                noise_multiplier=noise_multiplier,
-                max_grad_norm=max_grad_norm,
-            )
+            with spans.span('train.dp'):
+                model, optimizer, trainloader = privacy_engine.make_private(
+                    module=model,
+                    optimizer=optimizer,
+                    data_loader=trainloader,
+                    noise_multiplier=noise_multiplier,
+                    max_grad_norm=max_grad_norm,
+                )
             logging.info(f"[DP] Enabled: sigma={noise_multiplier}, C={max_grad_norm}, accountant={accountant}")
         except Exception as e:
             logging.warning(f"[DP] Failed to enable DP-SGD ({e}). Continuing without DP.")
@@ -154,7 +157,7 @@ def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] =
 
     # --- Training loop ---
     for epoch in range(1, epochs + 1):
-        for batch_id, (image, label) in enumerate(trainloader):
+        for batch_id, (image, label) in enumerate(spans.iterate(trainloader, 'train.data', 'train.step')):
             image, label = image.to(device), label.to(device)
             optimizer.zero_grad()
             output = model(image)
@@ -15,6 +15,7 @@ import torch.optim as optim
 from torch.utils.data import TensorDataset, DataLoader, random_split
 
 import load_data  # base class from this repo
+from utils.spans import spans  # pylint: disable=no-name-in-module
 
 # -------------------- Data loader knobs (adjust as needed) --------------------
 CSV_GLOB = "nbaiot/*.csv"    # resolved relative to config.paths.data
@@ -284,13 +285,14 @@ def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] =
             accountant = dp.get("accountant", "rdp")
 
             privacy_engine = PrivacyEngine(accountant=accountant, secure_mode=secure_mode)
-            model, optimizer, trainloader = privacy_engine.make_private(
-                module=model,
-                optimizer=optimizer,
-                data_loader=trainloader,
-                noise_multiplier=noise_multiplier,
-                max_grad_norm=max_grad_norm,
-            )
+            with spans.span('train.dp'):
+                model, optimizer, trainloader = privacy_engine.make_private(
+                    module=model,
+                    optimizer=optimizer,
+                    data_loader=trainloader,
+                    noise_multiplier=noise_multiplier,
+                    max_grad_norm=max_grad_norm,
+                )
             logging.info(f"[DP] Enabled: sigma={noise_multiplier}, C={max_grad_norm}, accountant={accountant}")
         except Exception as e:
             logging.warning(f"[DP] Failed to enable DP-SGD ({e}). Continuing without DP.")
@@ -302,7 +304,7 @@ def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] =
         old_weights = torch.from_numpy(old_weights)
 
     for epoch in range(1, epochs + 1):
-        for batch_id, (xb, yb) in enumerate(trainloader):
+        for batch_id, (xb, yb) in enumerate(spans.iterate(trainloader, 'train.data', 'train.step')):
             xb, yb = xb.to(device), yb.to(device)
             optimizer.zero_grad()
             logits = model(xb)
@@ -326,9 +328,10 @@ def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] =
                 if privacy_engine is not None:
                     try:
                         delta = float(dp.get("delta", 1e-5))
-                        eps = (privacy_engine.accountant.get_epsilon(delta)
-                               if hasattr(privacy_engine, "accountant")
-                               else privacy_engine.get_epsilon(delta))
+                        with spans.span('train.dp'):
+                            eps = (privacy_engine.accountant.get_epsilon(delta)
+                                   if hasattr(privacy_engine, "accountant")
+                                   else privacy_engine.get_epsilon(delta))
                         logging.info(f"[DP] early-exit: ε≈{eps:.2f}, δ={delta}, "
                                      f"σ={dp.get('noise_multiplier', 0.8)}, C={dp.get('max_grad_norm', 1.0)}")
                     except Exception as e:
@@ -339,9 +342,10 @@ def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] =
         if privacy_engine is not None:
             try:
                 delta = float(dp.get("delta", 1e-5))
-                eps = (privacy_engine.accountant.get_epsilon(delta)
-                       if hasattr(privacy_engine, "accountant")
-                       else privacy_engine.get_epsilon(delta))
+                with spans.span('train.dp'):
+                    eps = (privacy_engine.accountant.get_epsilon(delta)
+                           if hasattr(privacy_engine, "accountant")
+                           else privacy_engine.get_epsilon(delta))
                 logging.info(f"[DP] epoch {epoch}: ε≈{eps:.2f}, δ={delta}, "
                              f"σ={dp.get('noise_multiplier', 0.8)}, C={dp.get('max_grad_norm', 1.0)}")
             except Exception as e:
@@ -351,9 +355,10 @@ def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] =
     if privacy_engine is not None:
         try:
             delta = float(dp.get("delta", 1e-5))
-            eps = (privacy_engine.accountant.get_epsilon(delta)
-                   if hasattr(privacy_engine, "accountant")
-                   else privacy_engine.get_epsilon(delta))
+            with spans.span('train.dp'):
+                eps = (privacy_engine.accountant.get_epsilon(delta)
+                       if hasattr(privacy_engine, "accountant")
+                       else privacy_engine.get_epsilon(delta))
             logging.info(f"[DP] final: ε≈{eps:.2f}, δ={delta}, "
                          f"σ={dp.get('noise_multiplier', 0.8)}, C={dp.get('max_grad_norm', 1.0)}")
         except Exception as e:
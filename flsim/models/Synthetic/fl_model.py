@@ -0,0 +1,158 @@
+# flsim/models/Synthetic/fl_model.py
+import logging
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+import numpy as np
+
+import load_data
+from utils.spans import spans  # pylint: disable=no-name-in-module
+
+
+# ----- Synthetic data knobs -----
+TRAIN_SIZE = 12000
+TEST_SIZE = 2000
+NUM_LABELS = 10
+NOISE = 1.0  # Std of the pixel noise around each label prototype
+SEED = 0
+
+# ----- Training settings -----
+lr = 0.01
+momentum = 0.9
+log_interval = 10
+rou = 1
+loss_thres = 0.01
+
+# ----- Device -----
+use_cuda = torch.cuda.is_available()
+device = torch.device('cuda' if use_cuda else 'cpu')
+
+
+class Generator(load_data.Generator):
+    """Generator for a synthetic MNIST-shaped dataset.
+
+    Every label has a random 1x28x28 prototype and its samples are the
+    prototype plus Gaussian noise, so nothing is downloaded and the MNIST
+    network learns it in a few rounds.
+    """
+
+    def read(self, path):
+        gen = torch.Generator().manual_seed(SEED)
+        prototypes = torch.randn(NUM_LABELS, 1, 28, 28, generator=gen)
+
+        def draw(n):
+            labels = torch.randint(NUM_LABELS, (n,), generator=gen)
+            images = prototypes[labels] + NOISE * torch.randn(n, 1, 28, 28, generator=gen)
+            return list(zip(images, labels.tolist()))
+
+        self.trainset = draw(TRAIN_SIZE)
+        self.testset = draw(TEST_SIZE)
+        self.labels = [str(label) for label in range(NUM_LABELS)]
+
+
+class Net(nn.Module):
+    def __init__(self):
+        super(Net, self).__init__()
+        self.conv1 = nn.Conv2d(1, 20, 5, 1)
+        self.conv2 = nn.Conv2d(20, 50, 5, 1)
+        self.fc1 = nn.Linear(4 * 4 * 50, 500)
+        self.fc2 = nn.Linear(500, NUM_LABELS)
+
+    def forward(self, x):
+        x = F.relu(self.conv1(x))
+        x = F.max_pool2d(x, 2, 2)
+        x = F.relu(self.conv2(x))
+        x = F.max_pool2d(x, 2, 2)
+        x = x.view(-1, 4 * 4 * 50)
+        x = F.relu(self.fc1(x))
+        x = self.fc2(x)
+        return F.log_softmax(x, dim=1)
+
+
+def get_optimizer(model):
+    return optim.SGD(model.parameters(), lr=lr, momentum=momentum)
+
+
+def get_trainloader(trainset, batch_size):
+    return torch.utils.data.DataLoader(trainset, batch_size=batch_size, shuffle=True)
+
+
+def get_testloader(testset, batch_size):
+    return torch.utils.data.DataLoader(testset, batch_size=batch_size, shuffle=True)
+
+
+def extract_weights(model):
+    weights = []
+    for name, p in model.named_parameters():
+        if p.requires_grad:
+            weights.append((name, p.detach().clone().to('cpu')))
+    return weights
+
+
+def load_weights(model, weights):
+    updated_state_dict = {name: w for name, w in weights}
+    model.load_state_dict(updated_state_dict, strict=False)
+
+
+def flatten_weights(weights):
+    vecs = []
+    for _, w in weights:
+        vecs.append(w.detach().view(-1).cpu().numpy())
+    return np.concatenate(vecs)
+
+
+def train(model, trainloader, optimizer, epochs, reg=None, dp: Optional[dict] = None):
+    if dp and dp.get("enable", False):
+        logging.warning('[DP] Not supported by the synthetic model, training without DP.')
+
+    model.to(device)
+    model.train()
+    criterion = nn.CrossEntropyLoss().to(device)
+
+    if reg is not None:
+        old_weights = torch.from_numpy(flatten_weights(extract_weights(model))).to(device)
+        mse_loss = nn.MSELoss(reduction='sum').to(device)
+
+    for epoch in range(1, epochs + 1):
+        for batch_id, (image, label) in enumerate(spans.iterate(trainloader, 'train.data', 'train.step')):
+            image, label = image.to(device), label.to(device)
+            optimizer.zero_grad()
+            output = model(image)
+            loss = criterion(output, label)
+
+            if reg is not None:
+                new_weights = torch.from_numpy(flatten_weights(extract_weights(model))).to(device)
+                loss = loss + rou / 2 * mse_loss(new_weights, old_weights)
+
+            loss.backward()
+            optimizer.step()
+
+            if batch_id % log_interval == 0:
+                logging.debug('Epoch: [{}/{}]\tLoss: {:.6f}'.format(epoch, epochs, loss.item()))
+
+            # Early stop if the model is already in good shape
+            if loss.item() < loss_thres:
+                return loss.item()
+
+    logging.info('loss: {}'.format(loss.item()))
+    return loss.item()
+
+
+def test(model, testloader):
+    model.to(device)
+    model.eval()
+    correct = 0
+    total = len(testloader.dataset)
+    with torch.no_grad():
+        for image, label in testloader:
+            image, label = image.to(device), label.to(device)
+            output = model(image)
+            pred = output.argmax(dim=1, keepdim=True)
+            correct += pred.eq(label.view_as(pred)).sum().item()
+
+    accuracy = correct / total
+    logging.debug('Accuracy: {:.2f}%'.format(100 * accuracy))
+    return accuracy
@@ -1,13 +1,29 @@
 # flsim/network.py — ns-3 THz runner (sync + async with timeout & robust parsing)
 import json
+import logging
+import math
+import os
+import shlex
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
 import time
 from typing import Any, Dict, List, Optional
 
+import numpy as np
+
+from utils.spans import spans  # pylint: disable=no-name-in-module
+
 PATH = '../ns3-fl-network'
 PROGRAM = 'scratch/thz-macro-central'
 
 
+def _fmt(value) -> str:
+    return 'n/a' if value is None else '{:.3g}'.format(value)
+
+
 def _get(root: Any, path: List[str], default=None):
     cur = root
     for k in path:
@@ -20,6 +36,139 @@ def _get(root: Any, path: List[str], default=None):
     return cur
 
 
+# Starts a run and reaps it with os.wait4, writing its rusage as JSON to
+# the fd in argv[1]. On exec, Linux folds the RSS high-water mark of the
+# process that spawned a program into the program's ru_maxrss, so runs
+# are spawned from this small process rather than from the server. On
+# SIGTERM it forwards the signal and kills the run kill_after seconds
+# later; SIGINT from a terminal reaches the run directly.
+_LAUNCHER = r"""
+import json, os, signal, sys
+fd, kill_after, cmd = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3:]
+pid, stopping = None, False
+
+def send(sig):
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+def stop(*_):
+    global stopping
+    stopping = True
+    if pid is not None:
+        send(signal.SIGTERM)
+        signal.alarm(kill_after)
+
+signal.signal(signal.SIGTERM, stop)
+signal.signal(signal.SIGALRM, lambda *_: send(signal.SIGKILL))
+signal.signal(signal.SIGINT, signal.SIG_IGN)
+pid = os.posix_spawnp(cmd[0], cmd, os.environ, setsigdef=[signal.SIGINT, signal.SIGTERM])
+if stopping:
+    stop()
+_, status, usage = os.wait4(pid, 0)
+signal.alarm(0)
+with os.fdopen(fd, 'w') as f:
+    json.dump({'cpu': usage.ru_utime + usage.ru_stime,
+               'peak_rss_mb': usage.ru_maxrss / 1024}, f)  # KiB on Linux
+code = os.waitstatus_to_exitcode(status)
+if code < 0:  # Killed by a signal, end alike
+    signal.signal(-code, signal.SIG_DFL)
+    os.kill(os.getpid(), -code)
+sys.exit(code)
+"""
+
+
+class _Run(object):
+    """One ns-3 run with its own resource usage.
+
+    The run is reaped with os.wait4 by _LAUNCHER, so its CPU time and
+    peak RSS cover the run and the children it waited for (such as the
+    simulator under the ns3 wrapper) and nothing else. The launcher
+    itself is reaped here with os.wait4 as well, setting proc.returncode
+    from the status as Popen.wait would. Output goes to temporary files,
+    so no pipe has to be drained while wait4 blocks.
+    """
+
+    KILL_AFTER = 2  # seconds from SIGTERM to SIGKILL
+
+    def __init__(self, cmd, cwd):
+        self.stdout, self.stderr = tempfile.TemporaryFile('w+'), tempfile.TemporaryFile('w+')
+        self.rusage = tempfile.TemporaryFile('w+')
+        fd = self.rusage.fileno()
+        self.proc = subprocess.Popen(
+            [sys.executable, '-I', '-S', '-c', _LAUNCHER, str(fd), str(self.KILL_AFTER)]
+            + list(cmd), cwd=cwd, stdout=self.stdout, stderr=self.stderr, pass_fds=(fd,))
+        self.usage = None
+        self.timed_out = False
+
+    @property
+    def returncode(self):
+        return self.proc.returncode
+
+    def _reap(self, options):
+        pid, status, usage = os.wait4(self.proc.pid, options)
+        if pid == 0:  # still running
+            return None
+        self.proc.returncode = os.waitstatus_to_exitcode(status)
+        self.rusage.seek(0)
+        try:
+            self.usage = json.loads(self.rusage.read())
+        except ValueError:  # Launcher killed before the run ended
+            self.usage = None
+        self.rusage.close()
+        return self.proc.returncode
+
+    def _signal(self, sig):
+        if self.proc.returncode is None:
+            try:
+                os.kill(self.proc.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _expire(self):
+        self.timed_out = True
+        self._signal(signal.SIGTERM)
+
+    def poll(self):
+        # reap the run if it has exited, None while it runs
+        if self.proc.returncode is None:
+            self._reap(os.WNOHANG)
+        return self.proc.returncode
+
+    def wait(self, timeout=None):
+        """Reap the run, terminating it after timeout seconds and killing it
+        if it ignores SIGTERM. Returns whether it timed out."""
+        timers = []
+        if timeout is not None:
+            # The launcher kills the run KILL_AFTER seconds past SIGTERM
+            timers = [threading.Timer(timeout, self._expire),
+                      threading.Timer(timeout + 2 * self.KILL_AFTER, self._signal,
+                                      (signal.SIGKILL,))]
+        for timer in timers:
+            timer.start()
+        try:
+            if self.proc.returncode is None:
+                self._reap(0)
+        finally:
+            for timer in timers:
+                timer.cancel()
+        return self.timed_out
+
+    def stop(self):
+        # terminate a run past its deadline, then hard kill
+        return self.wait(0)
+
+    def output(self):
+        # stdout and stderr of the reaped run
+        out = []
+        for f in [self.stdout, self.stderr]:
+            f.seek(0)
+            out.append(f.read())
+            f.close()
+        return tuple(out)
+
+
 class Network(object):
     def __init__(self, config):
         self.config = config
@@ -43,24 +192,53 @@ class Network(object):
         # model bytes per upload
         self._model_bytes = int(_get(self.config, ['model', 'size'], 1600))
 
+        # program to run: ns-3, or any stand-in taking the same flags
+        # (override via config.network.ns3.*)
+        ns3 = _get(self.config, ['network', 'ns3'], {}) or {}
+        command = ns3.get('command')
+        self._command = shlex.split(command) if isinstance(command, str) else command
+        self._cwd = ns3.get('path', PATH if not self._command else None)
+        self._program = ns3.get('program', PROGRAM)
+        self._timeout = ns3.get('timeout')  # wall seconds per run
+        build = ns3.get('build', './ns3 build' if not self._command else None)
+
         # build ns-3 once
-        proc = subprocess.run(
-            './ns3 build', shell=True, cwd=PATH,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        if proc.returncode != 0:
-            raise RuntimeError(f'ns-3 build failed:\n{proc.stderr}')
+        if build:
+            with spans.span('network.build'):
+                proc = subprocess.run(
+                    build, shell=True, cwd=self._cwd,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+                )
+            if proc.returncode != 0:
+                raise RuntimeError(f'ns-3 build failed:\n{proc.stderr}')
 
         # async state
-        self._proc: Optional[subprocess.Popen] = None
+        self._proc: Optional[_Run] = None
         self._async_ids: List[int] = []
         self._async_queue: List[Dict[int, Dict[str, float]]] = []
         self._deadline: Optional[float] = None  # wall-clock timeout for async job
 
+        # telemetry of the ns-3 runs (see _record_run)
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.run_totals = {'runs': 0, 'timeouts': 0, 'wall': 0.0, 'cpu': 0.0,
+                           'sim_time': 0.0, 'peak_rss_mb': 0.0, 'stdout_bytes': 0}
+
+    # ------------------------------------------------------------------
+    # upload size for the next ns-3 runs (e.g. compressed updates)
+    def set_model_bytes(self, model_bytes):
+        self._model_bytes = max(1, int(model_bytes))
+
     # ------------------------------------------------------------------
     # compatibility no-ops (old TCP control plane)
     def connect(self): return
-    def disconnect(self): return
+
+    def disconnect(self):
+        totals = self.run_totals
+        if totals['runs']:
+            logging.info('ns-3: {} runs ({} timed out), wall {:.1f} s, cpu {:.1f} s, '
+                         'simulated {:.1f} s, peak RSS {:.0f} MB'.format(
+                             totals['runs'], totals['timeouts'], totals['wall'], totals['cpu'],
+                             totals['sim_time'], totals['peak_rss_mb']))
 
     # accept list of client objects or raw ids
     def parse_clients(self, clients):
@@ -68,12 +246,17 @@ class Network(object):
             return [c.client_id for c in clients]
         return list(map(int, clients))
 
+    # bitmap over all clients or list of ids
+    def _active_ids(self, array):
+        if len(array) == self.num_clients and all(x in (0, 1) for x in array):
+            return [i for i, flag in enumerate(array) if flag]
+        return self.parse_clients(array)
+
     # ------------------------------------------------------------------
     # core ns-3 launchers
     def _cmd(self, *, total_clients: int, active_count: int, model_bytes: int) -> List[str]:
         t = self._thz_cfg
-        return [
-            './ns3', 'run', PROGRAM, '--',
+        return list(self._command or ['./ns3', 'run', self._program, '--']) + [
             f'--nodeNum={total_clients}',
             f'--clients={active_count}',
             f'--modelBytes={model_bytes}',
@@ -89,6 +272,46 @@ class Network(object):
             f'--useWhiteList={t["useWhiteList"]}',
         ]
 
+    def _record_run(self, run: _Run, wall: float, stdout: str, active_count: int,
+                    data: Dict[str, Any], timed_out: bool = False) -> Dict[str, Any]:
+        # Resources and speed of one finished ns-3 run
+        usage = run.usage
+        sim_time = max((self._extract_times(e, 0.0) for e in data.get('clientResults', [])),
+                       default=0.0) or self._thz_cfg['sim_time']
+        events = data.get('events', data.get('eventCount'))
+        run = {
+            'clients': active_count,
+            'wall': wall,
+            'cpu': usage['cpu'] if usage else None,
+            'peak_rss_mb': usage['peak_rss_mb'] if usage else None,
+            'sim_time': sim_time,
+            'sim_per_wall': sim_time / wall if wall > 0 else None,
+            'stdout_bytes': len(stdout.encode()) if stdout else 0,
+            'events_per_s': float(events) / wall if events is not None and wall > 0 else None,
+            'timeout': timed_out,
+            'returncode': run.returncode,
+        }
+        self.last_run = run
+
+        totals = self.run_totals
+        totals['runs'] += 1
+        totals['timeouts'] += int(timed_out)
+        totals['wall'] += wall
+        totals['cpu'] += run['cpu'] or 0.0
+        totals['sim_time'] += sim_time
+        totals['peak_rss_mb'] = max(totals['peak_rss_mb'], run['peak_rss_mb'] or 0.0)
+        totals['stdout_bytes'] += run['stdout_bytes']
+
+        for name in ['wall', 'cpu', 'peak_rss_mb', 'sim_per_wall', 'stdout_bytes', 'events_per_s']:
+            spans.metric('ns3.' + name, run[name])
+        spans.metric('ns3.timeout', int(timed_out))
+        logging.info('ns-3 run: {} clients, wall {:.2f} s, cpu {} s, peak RSS {} MB, '
+                     'sim/wall {}, stdout {} B{}'.format(
+                         active_count, wall, _fmt(run['cpu']), _fmt(run['peak_rss_mb']),
+                         _fmt(run['sim_per_wall']), run['stdout_bytes'],
+                         ', timed out' if timed_out else ''))
+        return run
+
     @staticmethod
     def _parse_last_json(stdout: str) -> Dict[str, Any]:
         last = None
@@ -115,12 +338,7 @@ class Network(object):
     # ------------------------------------------------------------------
     # SYNC API
     def sendRequest(self, *, requestType: int, array: list):
-        # bitmap or list of ids
-        if len(array) == self.num_clients and all(x in (0, 1) for x in array):
-            active_ids = [i for i, flag in enumerate(array) if flag]
-        else:
-            active_ids = self.parse_clients(array)
-
+        active_ids = self._active_ids(array)
         if not active_ids:
             return {}
 
@@ -129,25 +347,42 @@ class Network(object):
             active_count=len(active_ids),
             model_bytes=self._model_bytes,
         )
-        proc = subprocess.run(cmd, cwd=PATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if proc.returncode != 0:
-            raise RuntimeError(f'ns-3 run failed:\nSTDERR:\n{proc.stderr}\nSTDOUT:\n{proc.stdout}')
-        data = self._parse_last_json(proc.stdout)
-
-        # map local ids 0..N-1 -> real ids
-        id_map = {local: active_ids[local] for local in range(len(active_ids))}
-        out = {}
-        for e in data.get('clientResults', []):
-            local = int(e.get('id', -1))
-            if local not in id_map:
-                continue
-            rx_bytes = float(e.get('rxBytes', 0.0))
-            done_at  = self._extract_times(e, self._thz_cfg['sim_time'])
-            thr = (rx_bytes / done_at) if done_at and done_at > 0 else 0.0
-            out[id_map[local]] = {
-                'roundTime': done_at,
-                'throughput': thr,
-            }
+        with spans.span('network.spawn'):
+            run = _Run(cmd, self._cwd)
+        started = time.perf_counter()
+        with spans.span('network.sim'):
+            timed_out = run.wait(self._timeout)
+        wall = time.perf_counter() - started
+        stdout, stderr = run.output()
+        if run.returncode != 0 and not timed_out:
+            raise RuntimeError(f'ns-3 run failed:\nSTDERR:\n{stderr}\nSTDOUT:\n{stdout}')
+
+        with spans.span('network.parse'):
+            try:
+                data = self._parse_last_json(stdout)
+            except Exception:
+                if not timed_out:
+                    raise
+                data = {'clientResults': []}
+
+            # map local ids 0..N-1 -> real ids
+            id_map = {local: active_ids[local] for local in range(len(active_ids))}
+            out = {}
+            for e in data.get('clientResults', []):
+                local = int(e.get('id', -1))
+                if local not in id_map:
+                    continue
+                rx_bytes = float(e.get('rxBytes', 0.0))
+                done_at  = self._extract_times(e, self._thz_cfg['sim_time'])
+                thr = (rx_bytes / done_at) if done_at and done_at > 0 else 0.0
+                out[id_map[local]] = {
+                    'roundTime': done_at,
+                    'throughput': thr,
+                }
+            # clients without a result (e.g. cut off by the timeout) drop out
+            for client_id in active_ids:
+                out.setdefault(client_id, {'roundTime': -1.0, 'throughput': 0.0})
+        self._record_run(run, wall, stdout, len(active_ids), data, timed_out=timed_out)
         return out
 
     # ------------------------------------------------------------------
@@ -156,12 +391,7 @@ class Network(object):
         if self._proc is not None:
             raise RuntimeError('Async request already in progress.')
 
-        # bitmap or list
-        if len(array) == self.num_clients and all(x in (0, 1) for x in array):
-            active_ids = [i for i, flag in enumerate(array) if flag]
-        else:
-            active_ids = self.parse_clients(array)
-
+        active_ids = self._active_ids(array)
         self._async_ids = active_ids
         self._async_queue = []  # will be filled once process ends
         self._deadline = None
@@ -177,12 +407,13 @@ class Network(object):
             active_count=len(active_ids),
             model_bytes=self._model_bytes,
         )
-        self._proc = subprocess.Popen(
-            cmd, cwd=PATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
+        with spans.span('network.spawn'):
+            self._proc = _Run(cmd, self._cwd)
+        self._started = time.perf_counter()
         # Allow plenty of margin over sim_time; never block forever
         sim_t = self._thz_cfg['sim_time']
-        self._deadline = time.time() + max(10.0, 4.0 * sim_t)
+        timeout = self._timeout if self._timeout is not None else max(10.0, 4.0 * sim_t)
+        self._deadline = time.time() + timeout
 
     def readAsyncResponse(self):
         """
@@ -192,8 +423,6 @@ class Network(object):
         - when all delivered, returns 'end'
         - if deadline exceeded, kill process and synthesize results
         """
-        import subprocess
-
         # nothing ever started
         if self._proc is None and not self._async_queue:
             return 'end'
@@ -203,20 +432,12 @@ class Network(object):
             # timeout guard
             if self._deadline is not None and time.time() > self._deadline:
                 try:
-                    self._proc.terminate()
-                except Exception:
-                    pass
-                # try graceful, then hard kill
-                try:
-                    stdout, stderr = self._proc.communicate(timeout=2)
-                except subprocess.TimeoutExpired:
-                    try:
-                        self._proc.kill()
-                    except Exception:
-                        pass
-                    stdout, stderr = self._proc.communicate()
+                    self._proc.stop()
+                    stdout, stderr = self._proc.output()
                 finally:
-                    self._proc = None
+                    proc, self._proc = self._proc, None
+                parse_start = time.perf_counter()
+                spans.add('network.sim', self._started, parse_start, timeout=True)
 
                 # Try to parse output; if none, synthesize "sim finished" entries
                 data = {}
@@ -246,14 +467,19 @@ class Network(object):
                             'throughput': thr,
                         }
                     })
+                spans.add('network.parse', parse_start, time.perf_counter())
+                self._record_run(proc, parse_start - self._started, stdout,
+                                 len(self._async_ids), data, timed_out=True)
                 # fall through to serve queue
             else:
                 return {}
 
         # finished: if queue not built yet, parse and build single-client chunks
         if self._proc is not None and self._proc.poll() is not None:
-            stdout, stderr = self._proc.communicate()
-            self._proc = None
+            stdout, stderr = self._proc.output()
+            proc, self._proc = self._proc, None
+            parse_start = time.perf_counter()
+            spans.add('network.sim', self._started, parse_start)
 
             data = self._parse_last_json(stdout)
             # map local -> real ids
@@ -276,6 +502,9 @@ class Network(object):
                         'throughput': thr,
                     }
                 })
+            spans.add('network.parse', parse_start, time.perf_counter())
+            self._record_run(proc, parse_start - self._started, stdout,
+                             len(self._async_ids), data)
 
         # serve one and pop
         if self._async_queue:
@@ -375,6 +604,123 @@ class Network(object):
     #     return 'end'
 
 
+class StubNetwork(Network):
+    """In-process stand-in for the ns-3 runner, to benchmark the server loop.
+
+    Client results are drawn instead of simulated, behind the same sync
+    and async API and run totals as Network. Settings in
+    config.network.stub (network.type 'stub'):
+      - round_time: distribution of roundTime/endTime in seconds
+      - throughput: distribution of throughput, modelBytes / roundTime if None
+      - dropout: probability that a client drops out of a run
+      - latency: wall seconds each run takes
+      - seed: seed of the draws
+    A distribution is {'dist': ..., 'mean': ..., 'std': ...} with dist one
+    of constant, uniform, normal (clipped at 0), lognormal, exponential.
+    """
+
+    DEFAULTS = {
+        'round_time': {'dist': 'lognormal', 'mean': 1.0, 'std': 0.3},
+        'throughput': None,
+        'dropout': 0.0,
+        'latency': 0.0,
+        'seed': 0,
+    }
+
+    def __init__(self, config):
+        self.config = config
+        self.num_clients = int(_get(self.config, ['clients', 'total'], 1))
+        self._stub = dict(self.DEFAULTS, **(_get(self.config, ['network', 'stub'], None) or {}))
+        self._rng = np.random.default_rng(self._stub['seed'])
+        self._model_bytes = int(_get(self.config, ['model', 'size'], 1600))
+
+        self._async_ids: List[int] = []
+        self._async_queue: List[Dict[int, Dict[str, float]]] = []
+        self._busy = False
+
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.run_totals = {'runs': 0, 'timeouts': 0, 'wall': 0.0, 'cpu': 0.0,
+                           'sim_time': 0.0, 'peak_rss_mb': 0.0, 'stdout_bytes': 0}
+        logging.info('Stub network: {}'.format(self._stub))
+
+    def _draw(self, spec, n):
+        dist = spec.get('dist', 'constant')
+        mean, std = float(spec.get('mean', 1.0)), float(spec.get('std', 0.0))
+        if dist == 'constant':
+            return np.full(n, mean)
+        elif dist == 'uniform':
+            half = std * math.sqrt(3)
+            return self._rng.uniform(mean - half, mean + half, n)
+        elif dist == 'normal':
+            return np.maximum(self._rng.normal(mean, std, n), 0.0)
+        elif dist == 'lognormal':
+            sigma2 = math.log(1 + (std / mean) ** 2)
+            return self._rng.lognormal(math.log(mean) - sigma2 / 2, math.sqrt(sigma2), n)
+        elif dist == 'exponential':
+            return self._rng.exponential(mean, n)
+        raise ValueError('Unknown stub distribution: {}'.format(dist))
+
+    def _run(self, active_ids):
+        # One drawn run: (id, roundTime, throughput), roundTime -1 if dropped
+        started = time.perf_counter()
+        with spans.span('network.sim'):
+            if self._stub['latency']:
+                time.sleep(self._stub['latency'])
+            n = len(active_ids)
+            round_times = self._draw(self._stub['round_time'], n)
+            if self._stub['throughput'] is not None:
+                throughputs = self._draw(self._stub['throughput'], n)
+            else:
+                throughputs = self._model_bytes / np.maximum(round_times, 1e-9)
+            dropped = self._rng.random(n) < self._stub['dropout']
+        wall = time.perf_counter() - started
+
+        sim_time = float(round_times[~dropped].max()) if (~dropped).any() else 0.0
+        self.last_run = {'clients': n, 'wall': wall, 'cpu': None, 'peak_rss_mb': None,
+                         'sim_time': sim_time, 'sim_per_wall': sim_time / wall if wall > 0 else None,
+                         'stdout_bytes': 0, 'events_per_s': None, 'timeout': False,
+                         'returncode': 0}
+        totals = self.run_totals
+        totals['runs'] += 1
+        totals['wall'] += wall
+        totals['sim_time'] += sim_time
+        spans.metric('ns3.wall', wall)
+
+        return [(client_id, -1.0 if drop else float(t), 0.0 if drop else float(thr))
+                for client_id, t, thr, drop in zip(active_ids, round_times, throughputs, dropped)]
+
+    # SYNC API
+    def sendRequest(self, *, requestType: int, array: list):
+        active_ids = self._active_ids(array)
+        if not active_ids:
+            return {}
+        return {client_id: {'roundTime': t, 'throughput': thr}
+                for client_id, t, thr in self._run(active_ids)}
+
+    # ASYNC API, results served one client at a time; dropped clients never report
+    def sendAsyncRequest(self, *, requestType: int, array: list):
+        if self._busy:
+            raise RuntimeError('Async request already in progress.')
+        self._async_ids = self._active_ids(array)
+        self._async_queue = [{client_id: {'startTime': 0.0, 'endTime': t, 'throughput': thr}}
+                             for client_id, t, thr in self._run(self._async_ids) if t >= 0] \
+            if self._async_ids else []
+        self._busy = True
+
+    def readAsyncResponse(self):
+        if self._async_queue:
+            return self._async_queue.pop(0)
+        self._busy = False
+        return 'end'
+
+
+def make_network(config):
+    """Network backend of a run: the ns-3 runner, or the stub for network.type 'stub'."""
+    if _get(config, ['network', 'type'], None) == 'stub':
+        return StubNetwork(config)
+    return Network(config)
+
+
 # # flsim/network.py — ns-3 THz runner (sync + async)
 # import json
 # import subprocess
@@ -0,0 +1,416 @@
+import argparse
+import contextlib
+import gc
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+from collections import OrderedDict
+
+# Run from the repository root or the scripts directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+import client  # noqa: E402
+import config  # noqa: E402
+import load_data  # noqa: E402
+import server  # noqa: E402
+from network import Network  # noqa: E402
+from utils.kcenter import GreedyKCenter  # noqa: E402
+
+
+# Set logging
+logging.basicConfig(
+    format='[%(levelname)s][%(asctime)s]: %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
+
+# Set up parser
+parser = argparse.ArgumentParser(
+    description='Benchmark aggregation, selection, partitioning and the ns-3 runner '
+                'on synthetic data.')
+parser.add_argument('-m', '--models', type=str, nargs='+',
+                    default=['MNIST', 'CIFAR-10', 'NB-AIoT'],
+                    help='Models whose Net shapes the synthetic weights.')
+parser.add_argument('-n', '--clients', type=int, nargs='+',
+                    default=[10, 100, 1000, 10000, 100000],
+                    help='Client counts (reports per aggregation, population otherwise).')
+parser.add_argument('-k', '--per_round', type=int, default=20,
+                    help='Clients selected per round and k-center centers.')
+parser.add_argument('-r', '--repeat', type=int, default=3,
+                    help='Timed runs per case.')
+parser.add_argument('--only', type=str, default=None,
+                    help='Regex, run only the cases whose name matches.')
+parser.add_argument('--memory', type=int, default=4096,
+                    help='Skip aggregation cases whose updates exceed this (MB).')
+parser.add_argument('--sketch_dim', type=int, default=256,
+                    help='Profile dimension of the k-center points.')
+parser.add_argument('--dataset_size', type=int, default=60000,
+                    help='Items of the synthetic trainset.')
+parser.add_argument('--partition_size', type=int, default=600,
+                    help='Items per client partition.')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Seed of the synthetic data.')
+parser.add_argument('--flood', type=int, nargs='+', default=[1, 10, 50],
+                    help='MB of ns-3 log output parsed per run by the network cases.')
+parser.add_argument('-o', '--output', type=str, default='benchmark.json',
+                    help='Output JSON results.')
+parser.add_argument('-b', '--baseline', type=str, default=None,
+                    help='Stored JSON results to compare against.')
+parser.add_argument('--tolerance', type=float, default=0.2,
+                    help='Slowdown over the baseline fastest run reported as a regression.')
+parser.add_argument('--strict', action='store_true',
+                    help='Exit with status 1 on any regression.')
+
+args = parser.parse_args()
+
+# Input features of the N-BaIoT traffic statistics
+NBAIOT_FEATURES = 115
+
+
+class Report(object):
+    """Synthetic client report."""
+
+    def __init__(self, client_id, num_samples, weights):
+        self.client_id = client_id
+        self.num_samples = num_samples
+        self.weights = weights
+
+
+class Generator(load_data.Generator):
+    """Synthetic dataset of (index, label) items, grouped by label."""
+
+    def read(self, path):
+        rng = random.Random(args.seed)
+        self.labels = [str(label) for label in range(10)]
+        self.trainset = [(i, rng.randrange(len(self.labels)))
+                         for i in range(args.dataset_size)]
+        self.testset = []
+
+
+def load_model(name):
+    """Load models/<name>/fl_model.py as the fl_model the server imports."""
+    path = os.path.join(ROOT, 'models', name, 'fl_model.py')
+    spec = importlib.util.spec_from_file_location('fl_model', path)
+    fl_model = importlib.util.module_from_spec(spec)
+    sys.modules['fl_model'] = fl_model
+    try:
+        spec.loader.exec_module(fl_model)
+    except ImportError as e:
+        del sys.modules['fl_model']
+        logging.warning('Skipping {}: {}'.format(name, e))
+        return None
+    if hasattr(fl_model, '_INPUT_DIM'):  # Input size is read from the data
+        fl_model._INPUT_DIM = NBAIOT_FEATURES
+    return fl_model
+
+
+def make_config(total, loader='basic', ns3=None):
+    # Config of an unbooted server, as read from a file
+    fl_config = config.Config.__new__(config.Config)
+    fl_config.config = {
+        'clients': {'total': total, 'per_round': min(args.per_round, total)},
+        'data': {
+            'partition': {'size': args.partition_size},
+            'IID': loader == 'basic',
+            'bias': {'primary': 0.8, 'secondary': False} if loader == 'bias' else None,
+            'shard': {'per_client': 2} if loader == 'shard' else None,
+        },
+        'federated_learning': {},
+        'model': {},
+        'paths': {},
+        'server': 'basic',
+        'async': {'alpha': 0.9, 'staleness_func': 'polynomial'},
+        'link_speed': {},
+        'network': {'ns3': ns3},
+        'plot_interval': 1,
+    }
+    fl_config.extract()
+    return fl_config
+
+
+@contextlib.contextmanager
+def quiet():
+    # Keep logging and prints of the measured code out of the output
+    logging.disable(logging.WARNING)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            yield
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+def measure(setup, run):
+    """Seconds of each timed run(setup()), with gc paused as in timeit."""
+    times = []
+    for _ in range(args.repeat):
+        state = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            with quiet():
+                start = time.perf_counter()
+                run(state)
+                times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        del state
+    return times
+
+
+class Suite(object):
+    """Named benchmark cases and their timings."""
+
+    def __init__(self):
+        self.results = OrderedDict()
+        self.only = re.compile(args.only) if args.only else None
+
+    def wanted(self, name):
+        return self.only is None or self.only.search(name) is not None
+
+    def case(self, name, setup, run, **params):
+        if not self.wanted(name):
+            return
+        times = measure(setup, run)
+        self.results[name] = OrderedDict([
+            ('min', min(times)),
+            ('median', statistics.median(times)),
+            ('mean', statistics.mean(times)),
+            ('runs', times),
+            ('params', params),
+        ])
+        logging.info('{:<56} median {:>10.4f} s  min {:>10.4f} s'.format(
+            name, statistics.median(times), min(times)))
+
+    def skip(self, name, reason):
+        if self.wanted(name):
+            self.results[name] = OrderedDict([('skipped', reason)])
+            logging.info('{:<56} skipped: {}'.format(name, reason))
+
+
+def bench_aggregation(suite, name, fl_model):
+    model = fl_model.Net()
+    weights = fl_model.extract_weights(model)
+    numel = sum(weight.numel() for _, weight in weights)
+
+    # Reports cycle through a few perturbed copies of the global weights,
+    # the aggregations still compute one update per report
+    torch.manual_seed(args.seed)
+    pool = [[(key, weight + 0.01 * torch.randn_like(weight)) for key, weight in weights]
+            for _ in range(8)]
+
+    def servers():
+        for policy, cls in [('federated_averaging', server.Server),
+                            ('magnetude_fed_avg', server.MagAvgServer),
+                            ('federated_async', server.AsyncServer)]:
+            fl_server = cls(make_config(1))
+            fl_server.model = model
+            if policy == 'federated_async':
+                fl_server.setup_aggregation()
+            yield policy, fl_server
+
+    for n in args.clients:
+        reports = [Report(i, 100 + i % 50, pool[i % len(pool)]) for i in range(n)]
+        for policy, fl_server in servers():
+            case = 'aggregation/{}/{}/{}'.format(policy, name, n)
+            if n * numel * 4 > args.memory * 2**20:
+                suite.skip(case, 'updates exceed {} MB'.format(args.memory))
+                continue
+            if policy == 'federated_async':
+                run = lambda reports, s=fl_server: s.federated_async(reports, 3)
+            else:
+                run = getattr(fl_server, policy)
+            suite.case(case, lambda: reports, run, reports=n, numel=numel)
+
+        case = 'flatten_weights/{}/{}'.format(name, n)
+        if n * numel * 4 > args.memory * 2**20:
+            suite.skip(case, 'vectors exceed {} MB'.format(args.memory))
+        else:
+            suite.case(case, lambda: reports,
+                       lambda reports: [server.Server.flatten_weights(report.weights)
+                                        for report in reports],
+                       reports=n, numel=numel)
+
+
+def bench_selection(suite):
+    rng = np.random.default_rng(args.seed)
+    rounds = 10
+
+    for n in args.clients:
+        k = min(args.per_round, n)
+        for policy in client.ClientTable.POLICIES + ('random',):
+            def setup():
+                table = client.ClientTable(n)
+                table.loss[:] = rng.uniform(0, 3, n)
+                table.est_delay[:] = rng.exponential(1.0, n)
+                return table
+
+            def run(table):
+                # Selected clients report a new loss before the next round
+                for _ in range(rounds):
+                    index = table.select(policy, k)
+                    for row in index.tolist():
+                        table.set('loss', row, random.uniform(0, 3))
+
+            suite.case('selection/{}/{}'.format(policy, n), setup, run,
+                       clients=n, per_round=k, rounds=rounds)
+
+
+def bench_kcenter(suite):
+    rng = np.random.default_rng(args.seed)
+    for n in args.clients:
+        k = min(args.per_round, n)
+        suite.case('kcenter/{}'.format(n),
+                   lambda: rng.standard_normal((n, args.sketch_dim), dtype=np.float32),
+                   lambda points: GreedyKCenter().fit(points, k),
+                   clients=n, dim=args.sketch_dim, k=k)
+
+
+def bench_partition(suite):
+    generator = Generator()
+    generator.generate(None)
+
+    def loader(cls, fl_config):
+        # Fresh copy of the grouped trainset, loaders use it up
+        generator.trainset = {label: list(items) for label, items in trainset.items()}
+        return cls(fl_config, generator)
+
+    trainset = generator.trainset
+    for n in args.clients:
+        fl_config = make_config(n, 'basic')
+        suite.case('partition/basic/{}'.format(n),
+                   lambda: loader(load_data.Loader, fl_config),
+                   lambda l: [l.get_partition(args.partition_size) for _ in range(n)],
+                   clients=n, partition_size=args.partition_size)
+
+        # Lazy populations sample partitions without using the data up
+        suite.case('partition/basic_lazy/{}'.format(n),
+                   lambda: loader(load_data.Loader, fl_config),
+                   lambda l: [l.get_partition(args.partition_size, random.Random(i))
+                              for i in range(n)],
+                   clients=n, partition_size=args.partition_size)
+
+        fl_config = make_config(n, 'bias')
+        suite.case('partition/bias/{}'.format(n),
+                   lambda: loader(load_data.BiasLoader, fl_config),
+                   lambda l: [l.get_partition(args.partition_size, l.labels[i % len(l.labels)])
+                              for i in range(n)],
+                   clients=n, partition_size=args.partition_size)
+
+        fl_config = make_config(n, 'shard')
+
+        def shards(l):
+            l.create_shards()
+            for _ in range(n):
+                l.get_partition()
+
+        suite.case('partition/shard/{}'.format(n),
+                   lambda: loader(load_data.ShardLoader, fl_config), shards,
+                   clients=n, per_client=2)
+
+
+def bench_network(suite):
+    # The runner against the ns-3 stand-in: spawn, parse and timeout costs,
+    # on a link fast enough for every client to report
+    standin = [sys.executable, os.path.join(ROOT, 'scripts', 'ns3_standin.py'),
+               '--seed={}'.format(args.seed), '--rateMbps=1e6']
+
+    def network(total, *flags, timeout=None):
+        return Network(make_config(total, ns3={'command': standin + list(flags),
+                                               'timeout': timeout}))
+
+    def poll(network, n):
+        network.sendAsyncRequest(requestType=1, array=list(range(n)))
+        while network.readAsyncResponse() != 'end':
+            pass
+
+    for n in args.clients:
+        # A sync run of n clients, each with a result line entry
+        suite.case('network/run/{}'.format(n), lambda: network(n),
+                   lambda net: net.sendRequest(requestType=1, array=list(range(n))), clients=n)
+        suite.case('network/async/{}'.format(n), lambda: network(n),
+                   lambda net: poll(net, n), clients=n)
+
+    for mb in args.flood:
+        suite.case('network/flood/{}MB'.format(mb),
+                   lambda: network(10, '--flood={}'.format(mb * 2**20)),
+                   lambda net: net.sendRequest(requestType=1, array=list(range(10))),
+                   stdout_bytes=mb * 2**20)
+
+    # Past the deadline: terminate, then kill after the grace period
+    suite.case('network/timeout', lambda: network(10, '--hang', '--ignoreTerm', timeout=0.5),
+               lambda net: net.sendRequest(requestType=1, array=list(range(10))), timeout=0.5)
+
+
+def compare(results, baseline):
+    """Log the change of each fastest run against the baseline, return regressions."""
+    regressions = []
+    lines = ['Against baseline {} (tolerance {:.0%}):'.format(args.baseline, args.tolerance)]
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if 'min' not in result or not base or 'min' not in base:
+            continue
+        # The fastest run is the least disturbed by the rest of the machine
+        change = result['min'] / base['min'] - 1 if base['min'] else 0
+        flag = ''
+        if change > args.tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -args.tolerance:
+            flag = '  faster'
+        lines.append('  {:<56}{:>10.4f} s -> {:>10.4f} s  {:>+7.1%}{}'.format(
+            name, base['min'], result['min'], change, flag))
+    logging.info('\n'.join(lines))
+    return regressions
+
+
+def main():
+    """Time server hot paths on synthetic data, no ns-3 or datasets needed."""
+
+    suite = Suite()
+    st = time.time()
+
+    for name in args.models:
+        fl_model = load_model(name)
+        if fl_model is not None:
+            bench_aggregation(suite, name, fl_model)
+    bench_selection(suite)
+    bench_kcenter(suite)
+    bench_partition(suite)
+    bench_network(suite)
+
+    output = OrderedDict([
+        ('meta', OrderedDict([
+            ('time', time.strftime('%Y-%m-%d %H:%M:%S')),
+            ('python', platform.python_version()),
+            ('torch', torch.__version__),
+            ('numpy', np.__version__),
+            ('machine', platform.platform()),
+            ('cpus', os.cpu_count()),
+            ('threads', torch.get_num_threads()),
+            ('args', vars(args)),
+        ])),
+        ('results', suite.results),
+    ])
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    logging.info('Saved {} results in {:.1f} s: {}'.format(
+        len(suite.results), time.time() - st, args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(suite.results, json.load(f))
+        if regressions:
+            logging.warning('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+            if args.strict:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+# Run from the repository root or the scripts directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+import config  # noqa: E402
+import server  # noqa: E402
+from utils.spans import spans  # noqa: E402  # pylint: disable=no-name-in-module
+
+
+# Set up parser
+parser = argparse.ArgumentParser(
+    description='End-to-end round latency of the sync and async servers, '
+                'on synthetic data and a stub network.')
+parser.add_argument('-s', '--servers', type=str, nargs='+', default=['sync', 'async'],
+                    choices=['sync', 'async'], help='Servers to run.')
+parser.add_argument('-k', '--per_round', type=int, nargs='+', default=[5, 10, 20],
+                    help='Clients per round, one run each.')
+parser.add_argument('-n', '--clients', type=int, default=100,
+                    help='Total clients.')
+parser.add_argument('-r', '--rounds', type=int, default=10,
+                    help='Rounds per run, unless the target is reached first.')
+parser.add_argument('-t', '--target', type=float, default=0.9,
+                    help='Target accuracy, 0 to always run all rounds.')
+parser.add_argument('--partition_size', type=int, default=100,
+                    help='Samples per client.')
+parser.add_argument('--epochs', type=int, default=1,
+                    help='Local epochs per client update.')
+parser.add_argument('--batch_size', type=int, default=32,
+                    help='Local batch size.')
+parser.add_argument('--round_time', type=str, default='lognormal:1.0:0.3',
+                    help='Stub roundTime distribution, dist:mean:std.')
+parser.add_argument('--throughput', type=str, default=None,
+                    help='Stub throughput distribution, dist:mean:std '
+                         '(default modelBytes / roundTime).')
+parser.add_argument('--dropout', type=float, default=0.0,
+                    help='Stub probability of a client dropping out.')
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='Stub wall seconds per network run.')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Seed of the clients, data and stub network.')
+parser.add_argument('-l', '--log', type=str, default='WARNING',
+                    help='Log level of the servers.')
+parser.add_argument('-o', '--output', type=str, default='benchmark_rounds.json',
+                    help='Output JSON results.')
+parser.add_argument('-b', '--baseline', type=str, default=None,
+                    help='Stored JSON results to compare against.')
+parser.add_argument('--tolerance', type=float, default=0.2,
+                    help='Relative change against the baseline reported as a regression.')
+parser.add_argument('--strict', action='store_true',
+                    help='Exit with status 1 on any regression.')
+
+args = parser.parse_args()
+
+# Set logging, the benchmark itself reports at INFO
+logging.basicConfig(
+    format='[%(levelname)s][%(asctime)s]: %(message)s',
+    level=getattr(logging, args.log.upper()), datefmt='%H:%M:%S')
+log = logging.getLogger('benchmark')
+log.setLevel(logging.INFO)
+
+# Spans summed per run
+PHASES = ['selection', 'configuration', 'train', 'aggregation', 'aggregation.buffer',
+          'evaluation', 'save_model', 'network.sim']
+
+# Metric -> True when higher is better
+METRICS = OrderedDict([
+    ('rounds_per_s', True),
+    ('updates_per_s', True),
+    ('time_to_target', False),
+])
+
+
+def distribution(spec):
+    # dist:mean:std -> stub distribution
+    dist, mean, std = (spec.split(':') + ['1.0', '0.0'])[:3]
+    return {'dist': dist, 'mean': float(mean), 'std': float(std)}
+
+
+def workspace(path):
+    # Model, data and plot directories of one run, outside the source tree
+    model = os.path.join(path, 'models', 'Synthetic')
+    os.makedirs(model)
+    os.symlink(os.path.join(ROOT, 'models', 'Synthetic', 'fl_model.py'),
+               os.path.join(model, 'fl_model.py'))
+    return {'model': os.path.join(path, 'models'), 'data': os.path.join(path, 'data'),
+            'plot': os.path.join(path, 'plots')}
+
+
+def make_config(server_type, per_round, path):
+    # Config of a stub-network run in the path workspace, as read from a file
+    fl_config = config.Config.__new__(config.Config)
+    fl_config.config = {
+        'clients': {'total': args.clients, 'per_round': per_round,
+                    'selection': 'random', 'seed': args.seed},
+        'data': {'loading': 'static', 'partition': {'size': args.partition_size}, 'IID': True},
+        'federated_learning': {'rounds': args.rounds, 'target_accuracy': args.target or None,
+                               'task': 'train', 'epochs': args.epochs,
+                               'batch_size': args.batch_size},
+        'model': {'name': 'Synthetic'},
+        'paths': workspace(path),
+        'server': server_type,
+        'async': {'alpha': 0.9, 'staleness_func': 'polynomial'},
+        'link_speed': {},
+        'network': {'type': 'stub', 'stub': {
+            'round_time': distribution(args.round_time),
+            'throughput': distribution(args.throughput) if args.throughput else None,
+            'dropout': args.dropout,
+            'latency': args.latency,
+            'seed': args.seed,
+        }},
+        'plot_interval': float('inf'),  # Profile plots are not part of the loop
+    }
+    fl_config.extract()
+    return fl_config
+
+
+def timed(cls):
+    class Timed(cls):
+        """Server that time-stamps the end of every round."""
+
+        def boot(self):
+            super().boot()
+            self.started = None
+            self.timeline = []  # (wall, T, accuracy, clients trained)
+
+        def selection(self, *args):
+            # Rounds are timed from the first selection on
+            if self.started is None:
+                self.started = time.perf_counter()
+            return super().selection(*args)
+
+        def end_round(self, round, T_old=None, T_new=None):
+            super().end_round(round, T_old, T_new)
+            self.timeline.append((time.perf_counter() - self.started, T_new,
+                                  self.records.get_latest_acc(), self.clients_trained))
+
+    return Timed
+
+
+def run(server_type, per_round):
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    phases = OrderedDict((name, 0.0) for name in PHASES)
+    observers = []
+    for name in PHASES:
+        def add(duration, name=name):
+            phases[name] += duration
+        spans.observe(name, add)
+        observers.append((name, add))
+
+    cls = {'sync': server.SyncServer, 'async': server.AsyncServer}[server_type]
+    # Model snapshots and data stay in a directory removed after the run
+    with tempfile.TemporaryDirectory(prefix='benchmark_rounds_') as path:
+        fl_server = timed(cls)(make_config(server_type, per_round, path))
+        try:
+            fl_server.boot()
+            fl_server.run()
+        finally:
+            for name, add in observers:
+                spans.unobserve(name, add)
+            if getattr(fl_server, 'records', None):
+                fl_server.records.close()
+
+    timeline = fl_server.timeline
+    wall, T, accuracy, updates = timeline[-1] if timeline else (0.0, 0.0, None, 0)
+    reached = [entry for entry in timeline
+               if args.target and entry[2] is not None and entry[2] >= args.target]
+    return OrderedDict([
+        ('server', server_type),
+        ('per_round', per_round),
+        ('rounds', len(timeline)),
+        ('updates', updates),
+        ('wall', wall),
+        ('rounds_per_s', len(timeline) / wall if wall else None),
+        ('updates_per_s', updates / wall if wall else None),
+        ('time_to_target', reached[0][0] if reached else None),
+        ('sim_time_to_target', reached[0][1] if reached else None),
+        ('sim_time', T),
+        ('accuracy', accuracy),
+        ('phases', phases),
+    ])
+
+
+def compare(results, baseline):
+    """Log the change of each metric against the baseline, return regressions."""
+    regressions = []
+    lines = ['Against baseline {} (tolerance {:.0%}):'.format(args.baseline, args.tolerance)]
+    for name, result in results.items():
+        base = baseline['results'].get(name, {})
+        for metric, higher in METRICS.items():
+            if not result.get(metric) or not base.get(metric):
+                continue
+            change = result[metric] / base[metric] - 1
+            worse = -change if higher else change
+            flag = ''
+            if worse > args.tolerance:
+                flag = '  REGRESSION'
+                regressions.append('{} {}'.format(name, metric))
+            elif worse < -args.tolerance:
+                flag = '  better'
+            lines.append('  {:<20}{:<16}{:>10.3f} -> {:>10.3f}  {:>+7.1%}{}'.format(
+                name, metric, base[metric], result[metric], change, flag))
+    log.info('\n'.join(lines))
+    return regressions
+
+
+def main():
+    """Time whole rounds of the servers, with ns-3 replaced by a stub."""
+
+    results = OrderedDict()
+    for server_type in args.servers:
+        for per_round in args.per_round:
+            name = '{}/{}'.format(server_type, per_round)
+            result = results[name] = run(server_type, per_round)
+            log.info('{:<12} {:>3} rounds, {:>6.2f} rounds/s, {:>7.2f} updates/s, '
+                     'target {}, accuracy {}'.format(
+                         name, result['rounds'], result['rounds_per_s'] or 0,
+                         result['updates_per_s'] or 0,
+                         'n/a' if result['time_to_target'] is None else
+                         '{:.2f} s'.format(result['time_to_target']),
+                         'n/a' if result['accuracy'] is None else
+                         '{:.2f}%'.format(100 * result['accuracy'])))
+            log.info('  phases: ' + ', '.join(
+                '{} {:.2f} s'.format(phase, total) for phase, total in result['phases'].items()))
+
+    output = OrderedDict([
+        ('meta', OrderedDict([
+            ('time', time.strftime('%Y-%m-%d %H:%M:%S')),
+            ('python', platform.python_version()),
+            ('torch', torch.__version__),
+            ('machine', platform.platform()),
+            ('cpus', os.cpu_count()),
+            ('threads', torch.get_num_threads()),
+            ('args', vars(args)),
+        ])),
+        ('results', results),
+    ])
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    log.info('Saved results: {}'.format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            log.warning('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+            if args.strict:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Stand-in for the ns-3 THz program, for testing and benchmarking Network.
+
+Takes the flags Network passes to scratch/thz-macro-central and prints the
+same final clientResults JSON line, with upload times drawn instead of
+simulated: the clients share a link of --rateMbps, so each upload takes
+about modelBytes * clients / rate, scaled by lognormal --noise. Clients
+whose upload misses --simTime, or that are lost with --lossRate, have no
+result. For the runner itself it can take --wallTime seconds, hold
+--allocMb megabytes, print --flood bytes of log lines before the result,
+exit with --exitCode, or --hang without a result (ignoring SIGTERM with
+--ignoreTerm).
+
+Run it in place of ns-3 with network.ns3.command, e.g.
+    "ns3": {"command": "python scripts/ns3_standin.py --wallTime=0.5"}
+"""
+import argparse
+import json
+import math
+import random
+import signal
+import sys
+import time
+
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+# Flags of the ns-3 program
+parser.add_argument('--nodeNum', type=int, default=1)
+parser.add_argument('--clients', type=int, default=1)
+parser.add_argument('--modelBytes', type=int, default=1600)
+parser.add_argument('--pktSize', type=int, default=600)
+parser.add_argument('--simTime', type=float, default=0.8)
+parser.add_argument('--intervalUs', type=int, default=20)
+parser.add_argument('--way', type=int, default=3)
+parser.add_argument('--radius', type=float, default=0.5)
+parser.add_argument('--beamwidth', type=float, default=40)
+parser.add_argument('--gain', type=float, default=30)
+parser.add_argument('--apAngle', type=float, default=0)
+parser.add_argument('--staAngle', type=float, default=180)
+parser.add_argument('--useWhiteList', type=int, default=0)
+# Stand-in behaviour
+parser.add_argument('--rateMbps', type=float, default=100.0,
+                    help='Link rate shared by the clients.')
+parser.add_argument('--noise', type=float, default=0.1,
+                    help='Lognormal sigma of the upload times.')
+parser.add_argument('--lossRate', type=float, default=0.0,
+                    help='Probability that a client has no result.')
+parser.add_argument('--wallTime', type=float, default=0.0,
+                    help='Wall seconds before the result is printed.')
+parser.add_argument('--allocMb', type=int, default=0,
+                    help='Megabytes of memory touched and held until the result.')
+parser.add_argument('--flood', type=int, default=0,
+                    help='Bytes of log lines printed before the result.')
+parser.add_argument('--hang', action='store_true',
+                    help='Never print a result nor exit.')
+parser.add_argument('--ignoreTerm', action='store_true',
+                    help='Ignore SIGTERM, so only a kill stops it.')
+parser.add_argument('--exitCode', type=int, default=0,
+                    help='Exit status after the result.')
+parser.add_argument('--seed', type=int, default=None,
+                    help='Seed of the draws, random by default.')
+
+
+def flood(n):
+    # Whole log lines like NS_LOG output, about n bytes in total
+    line = '+{:.9f}s 0 ThzNetDevice:Send(): [DEBUG] packet queued\n'
+    written, t = 0, 0.0
+    while written < n:
+        text = line.format(t)
+        sys.stdout.write(text)
+        written += len(text)
+        t += 1e-6
+
+
+def main():
+    args, _ = parser.parse_known_args()  # Tolerate flags added to Network later
+    if args.ignoreTerm:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    rng = random.Random(args.seed)
+    held = b'\x01' * (args.allocMb << 20)  # Written, so resident
+
+    flood(args.flood)
+    sys.stdout.flush()
+    if args.hang:
+        while True:
+            time.sleep(3600)
+    if args.wallTime:
+        time.sleep(args.wallTime)
+
+    # Clients share the link, uploads take about the same time each
+    rate = args.rateMbps * 1e6 / 8
+    upload = args.modelBytes * max(args.clients, 1) / rate
+    results = []
+    for i in range(args.clients):
+        done_at = upload * math.exp(args.noise * rng.gauss(0, 1))
+        if done_at > args.simTime or rng.random() < args.lossRate:
+            continue
+        results.append({'id': i, 'rxBytes': args.modelBytes, 'doneAt': done_at})
+
+    packets = args.clients * math.ceil(args.modelBytes / args.pktSize)
+    print(json.dumps({'clientResults': results, 'eventCount': 4 * packets}))
+    sys.stdout.flush()
+    del held
+    sys.exit(args.exitCode)
+
+
+if __name__ == '__main__':
+    main()
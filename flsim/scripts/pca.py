@@ -4,8 +4,9 @@ import config
 import logging
 import os
 import pickle
-from sklearn.decomposition import PCA
 import server
+from server.record import WeightStore
+from utils.pca import StreamingPCA
 
 
 # Set logging
@@ -18,12 +19,16 @@ parser.add_argument('-c', '--config', type=str, default='./template.json',
                     help='Configuration file for server.')
 parser.add_argument('-o', '--output', type=str, default='./output.pkl',
                     help='Output pickle file')
+parser.add_argument('-b', '--basis', type=str, default='./pca_basis.pkl',
+                    help='PCA basis, reused when it exists and saved otherwise')
+parser.add_argument('--batch_size', type=int, default=32,
+                    help='Clients per partial PCA fit')
 
 args = parser.parse_args()
 
 
 def main():
-    """Extract PCA vectors from FL clients."""
+    """Extract PCA projections of FL client weights."""
 
     # Read configuration file
     fl_config = config.Config(args.config)
@@ -32,29 +37,37 @@ def main():
     fl_server = server.KMeansServer(fl_config)
     fl_server.boot()
 
-    # Run client profiling
-    fl_server.profile_clients()
+    clients = fl_server.clients
 
-    # Extract clients, reports, weights
-    clients = [client for client in group for group in [
-        fl_server.clients[profile] for profile in fl_server.clients.keys()]]
-    reports = [client.get_report() for client in clients]
-    weights = [report.weights for report in reports]
-
-    # Flatten weights
-    def flatten_weights(weights):
-        weight_vecs = []
-        for _, weight in weights:
-            weight_vecs.extend(weight.flatten())
-        return weight_vecs
+    # Train clients batch by batch, streaming their flattened weights
+    # into a profile store and fitting the basis unless one was saved
+    pca = StreamingPCA.load_or_create(args.basis, n_components=2,
+                                      batch_size=args.batch_size)
+    fit = not pca.frozen
+    profile = fl_config.profile
+    store = WeightStore(len(clients), profile.store, profile.sketch_dim, profile.path)
 
     logging.info('Flattening weights...')
-    weight_vecs = [flatten_weights(weight) for weight in weights]
+    for start in range(0, len(clients), args.batch_size):
+        batch = range(start, min(start + args.batch_size, len(clients)))
+        weight_vecs = fl_server.model_weights([clients[i] for i in batch])
+        stored = store.write(list(batch), weight_vecs)
+        if fit:
+            pca.partial_fit(stored)
+
+    if fit:
+        pca.freeze()
+        pca.save(args.basis)
 
-    # Perform PCA on weight vectors
+    # Project weight vectors with the basis
     logging.info('Assembling output...')
-    output = [(clients[i].client_id, clients[i].pref, weight) for i, weight in enumerate(weight_vecs)]
-    logging.into('Writing output to binary...')
+    output = []
+    for start in range(0, len(clients), args.batch_size):
+        batch = list(range(start, min(start + args.batch_size, len(clients))))
+        pcs = pca.transform(store.rows(batch)[1])
+        output.extend((clients[i].client_id, clients[i].pref, pc)
+                      for i, pc in zip(batch, pcs))
+    logging.info('Writing output to binary...')
     with open(args.output, 'wb') as f:
         pickle.dump(output, f)
 
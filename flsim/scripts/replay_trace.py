@@ -0,0 +1,143 @@
+import argparse
+import logging
+import math
+import os
+import sys
+import time
+
+# Run from the repository root or the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+import server  # noqa: E402
+from server.record import Record  # noqa: E402
+from server.trace import TraceReader, flatten  # noqa: E402
+
+
+# Set logging
+logging.basicConfig(
+    format='[%(levelname)s][%(asctime)s]: %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
+
+# Set up parser
+parser = argparse.ArgumentParser(
+    description='Replay a recorded update trace under another aggregation policy.')
+parser.add_argument('-c', '--config', type=str, default='./config.json',
+                    help='Federated learning configuration file.')
+parser.add_argument('-t', '--trace', type=str, default=None,
+                    help='Trace directory, defaults to trace.path of the config.')
+parser.add_argument('-s', '--server', type=str, default=None,
+                    choices=['basic', 'sync', 'async', 'magavg', 'accavg'],
+                    help='Aggregation policy, defaults to the config server.')
+parser.add_argument('--alpha', type=float, default=None,
+                    help='Async mixing weight.')
+parser.add_argument('--staleness_func', type=str, default=None,
+                    choices=['constant', 'polynomial', 'hinge'],
+                    help='Async staleness function.')
+parser.add_argument('--buffer_size', type=int, default=None,
+                    help='Async updates per aggregation.')
+parser.add_argument('--no-eval', dest='evaluate', action='store_false',
+                    help='Skip test set evaluation (no dataset needed).')
+parser.add_argument('-o', '--output', type=str, default='replay.csv',
+                    help='Output accuracy record.')
+
+args = parser.parse_args()
+
+
+class Report(object):
+    """Client report rebuilt from a trace entry."""
+
+    def __init__(self, entry, weights):
+        self.client_id = int(entry['client_id'])
+        self.num_samples = int(entry['num_samples'])
+        self.loss = float(entry['loss'])
+        self.delay = float(entry['delay'])
+        if not math.isnan(entry['accuracy']):
+            self.accuracy = float(entry['accuracy'])
+        self.weights = weights
+
+
+def main():
+    """Re-run aggregation over recorded client updates, without training."""
+
+    # Read configuration file
+    fl_config = config.Config(args.config)
+    async_args = {field: getattr(args, field) for field in
+                  ['alpha', 'staleness_func', 'buffer_size']
+                  if getattr(args, field) is not None}
+    fl_config.sync = fl_config.sync._replace(**async_args)
+    policy = args.server or fl_config.server
+
+    trace = TraceReader(args.trace or fl_config.trace.path)
+    logging.info('Trace: {} updates in {} rounds'.format(
+        len(trace), len(trace.rounds())))
+
+    # Set up an unbooted server for its aggregation
+    sys.path.append(fl_config.paths.model)
+    import fl_model  # pylint: disable=import-error
+
+    fl_server = {
+        "basic": server.Server,
+        "sync": server.SyncServer,
+        "async": server.AsyncServer,
+        "magavg": server.MagAvgServer,
+        "accavg": server.AccAvgServer,
+    }[policy](fl_config)
+    fl_server.trace = None
+    fl_server.eval_worker = None
+    fl_server.model = fl_model.Net()
+    fl_model.load_weights(fl_server.model, trace.unflatten(trace.initial))
+    if args.evaluate:
+        fl_server.load_data()
+    records = Record(args.output if args.evaluate else None)
+
+    def rebuild(i):
+        # Apply a recorded update to the current global model
+        entry, update = trace[i]
+        w = flatten(fl_model.extract_weights(fl_server.model))
+        return Report(entry, trace.unflatten(w + update))
+
+    def evaluate(T, record):
+        if args.evaluate:
+            fl_server.evaluate(T, record)
+
+    st = time.time()
+    if policy == 'async':
+        fl_server.setup_aggregation()
+
+        def flush(T):
+            updated_weights, _ = fl_server.buffer.flush()
+            fl_model.load_weights(fl_server.model, updated_weights)
+            evaluate(T, lambda acc: records.async_time_graphs(T, acc, 0.0))
+
+        for _, indices in trace.rounds().items():
+            for i in indices:
+                report = rebuild(i)
+                T = float(trace.meta['time'][i])
+                fl_server.buffer_update([report], report.delay, T)
+                if fl_server.buffer.due(T):
+                    flush(T)
+            if len(fl_server.buffer):
+                flush(T)
+    else:
+        for round, indices in trace.rounds().items():
+            reports = [rebuild(i) for i in indices]
+            updated_weights = fl_server.aggregation(reports)
+            fl_model.load_weights(fl_server.model, updated_weights)
+
+            T = float(max(trace.meta['time'][indices]))
+            T = round if math.isnan(T) else T
+            evaluate(T, lambda acc, T=T, round=round:
+                     records.append_record(T, acc, 0.0, 0, round))
+
+    fl_server.finish()
+    logging.info('Replayed {} updates with {} aggregation in {:.2f} s'.format(
+        len(trace), policy, time.time() - st))
+
+    records.close()
+    if args.evaluate and len(records):
+        logging.info('Final accuracy: {:.2f}%'.format(100 * records.get_latest_acc()))
+        logging.info('Saved record: {}'.format(args.output))
+
+
+if __name__ == "__main__":
+    main()
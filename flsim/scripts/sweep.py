@@ -0,0 +1,406 @@
+import argparse
+import copy
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Run from the repository root or the scripts directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import network  # noqa: E402
+
+
+# Set logging
+logging.basicConfig(
+    format='[%(levelname)s][%(asctime)s]: %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
+
+# Set up parser
+parser = argparse.ArgumentParser(
+    description='Run a grid of run.py trials in parallel, each in its own directory.')
+parser.add_argument('-c', '--config', type=str, required=True,
+                    help='Base configuration file.')
+parser.add_argument('-g', '--grid', type=str, required=True,
+                    help='JSON object of dotted config keys to lists of values, '
+                         'e.g. {"async.alpha": [0.5, 0.9]}.')
+parser.add_argument('-o', '--output', type=str, default='./sweep',
+                    help='Sweep directory: results.jsonl and trials/<hash>/.')
+parser.add_argument('-w', '--workers', type=int, default=None,
+                    help='Trials run at once, defaults to CPUs / threads.')
+parser.add_argument('-t', '--threads', type=int, default=1,
+                    help='Torch/BLAS threads per trial.')
+parser.add_argument('--retry', action='store_true',
+                    help='Also rerun trials recorded as failed.')
+parser.add_argument('--halving', type=float, default=None,
+                    help='Simulated time of the first successive halving rung, '
+                         'off by default.')
+parser.add_argument('--eta', type=float, default=3,
+                    help='Halving rate: rungs are eta times apart and the top '
+                         '1/eta of the trials at a rung go on.')
+parser.add_argument('--poll', type=float, default=5.0,
+                    help='Seconds between reads of the running trials\' records.')
+parser.add_argument('-l', '--log', type=str, default='INFO',
+                    help='Log level of the trials.')
+
+args = parser.parse_args()
+
+
+def set_key(config, key, value):
+    # Set a dotted key, e.g. 'federated_learning.rounds', in a raw config
+    *parents, last = key.split('.')
+    for parent in parents:
+        config = config.setdefault(parent, {})
+    config[last] = value
+
+
+def config_hash(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def expand(base, grid):
+    """(params, config) of every point of the grid over the base config."""
+    keys = list(grid)
+    trials = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        params = dict(zip(keys, values))
+        config = copy.deepcopy(base)
+        for key, value in params.items():
+            set_key(config, key, value)
+        trials.append((params, config))
+    return trials
+
+
+def read_curve(record_path):
+    """Simulated times and accuracies streamed to a trial's record so far."""
+    times, accs = [], []
+    if os.path.exists(record_path):
+        with open(record_path, newline='') as f:
+            for row in csv.DictReader(f):
+                if None in row.values():  # Row still being written
+                    break
+                times.append(float(row['time']))
+                accs.append(float(row['acc']))
+    return times, accs
+
+
+def stop(proc):
+    # Stop run.py with anything it started, such as ns-3
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(proc.pid, sig)
+            proc.wait(timeout=10)
+            return
+        except ProcessLookupError:
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+class ResultStore(object):
+    """Finished trials by config hash, one JSON line each in results.jsonl.
+
+    Only the sweep process appends, one whole line per trial, so a
+    sweep stopped at any point is resumed from the lines written; a
+    later line for the same hash (a retry) replaces an earlier one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        result = json.loads(line)
+                        self.results[result['hash']] = result
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def done(self, trial_hash, retry=False):
+        # Stopped trials stay stopped, the halving decision is kept
+        result = self.results.get(trial_hash)
+        return result is not None and (result['status'] != 'failed' or not retry)
+
+    def add(self, result):
+        with self.lock:
+            self.results[result['hash']] = result
+            self.file.write(json.dumps(result) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Halving(object):
+    """Asynchronous successive halving over the trials' accuracy curves.
+
+    Rung k is at simulated time min_time * eta**k. A trial whose record
+    passes a rung is scored by its best accuracy up to there and goes on
+    only when the score is in the top 1/eta of all scores at that rung so
+    far; otherwise it is stopped and its worker starts the next trial.
+    Scores are kept with the results, so a resumed sweep decides alike.
+    """
+
+    def __init__(self, min_time, eta, poll):
+        self.min_time = min_time
+        self.eta = eta
+        self.poll = poll
+        self.scores = defaultdict(list)  # rung -> scores of the trials there
+        self.lock = threading.Lock()
+
+    def restore(self, results):
+        for result in results:
+            for rung, score in result.get('rungs', {}).items():
+                self.scores[int(rung)].append(score)
+
+    def climb(self, rungs, times, accs):
+        """Score the rungs newly passed by a curve, yield whether each promotes."""
+        while True:
+            rung = len(rungs)
+            boundary = self.min_time * self.eta ** rung
+            passed = [i for i, t in enumerate(times) if t >= boundary]
+            if not passed:
+                return
+            score = rungs[rung] = max(accs[:passed[0] + 1])
+            with self.lock:
+                scores = self.scores[rung]
+                scores.append(score)
+                cutoff = np.percentile(scores, 100 * (1 - 1 / self.eta))
+            yield rung, score >= cutoff
+
+    def follow(self, proc, record_path):
+        """Wait for a trial, stopping it at the first rung it does not pass.
+
+        Returns its rung scores and the rung it was stopped at, if any.
+        """
+        rungs = {}
+        while True:
+            try:
+                proc.wait(timeout=self.poll)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            for rung, promoted in self.climb(rungs, *read_curve(record_path)):
+                if not promoted:
+                    stop(proc)
+                    return rungs, rung
+
+        # Rungs passed since the last read still count for later trials
+        for _ in self.climb(rungs, *read_curve(record_path)):
+            pass
+        return rungs, None
+
+
+class Sweep(object):
+    """Trials in isolated working directories over shared read-only inputs.
+
+    Every trial runs run.py in <output>/trials/<hash>/, where its global
+    model snapshots, records, plots and report files land. The model
+    code is linked in, while the dataset directory and the ns-3 tree are
+    shared by absolute path: datasets are fetched and ns-3 is built once,
+    before any trial starts.
+    """
+
+    def __init__(self, output, halving=None):
+        self.output = os.path.abspath(output)
+        self.trials_path = os.path.join(self.output, 'trials')
+        os.makedirs(self.trials_path, exist_ok=True)
+        self.store = ResultStore(os.path.join(self.output, 'results.jsonl'))
+        self.halving = halving
+        if halving:
+            halving.restore(self.store.results.values())
+        self.procs = {}  # hash -> running trial process
+        self.stopping = False
+
+    # Shared inputs
+    def model_source(self, config):
+        paths = config.get('paths', {})
+        name = config.get('model', {}).get('name', 'MNIST')
+        return os.path.join(os.path.abspath(os.path.join(ROOT, paths.get('model', './models'))),
+                            name)
+
+    def data_path(self, config):
+        return os.path.abspath(os.path.join(ROOT, config.get('paths', {}).get('data', './data')))
+
+    def uses_ns3(self, config):
+        net = config.get('network', {})
+        return net.get('type') != 'stub' and not (net.get('ns3') or {}).get('command')
+
+    def prepare(self, trials):
+        # Fetch each dataset once, so trials never download side by side
+        for source, data in sorted({(self.model_source(config), self.data_path(config))
+                                    for _, config in trials}):
+            logging.info('Preparing data: {} -> {}'.format(source, data))
+            subprocess.run([sys.executable, '-c',
+                            'import sys; sys.path[:0] = [sys.argv[1], sys.argv[2]]; '
+                            'import fl_model; fl_model.Generator().read(sys.argv[3])',
+                            ROOT, source, data], cwd=ROOT, check=True)
+
+        # Build ns-3 once, trials only run it
+        ns3 = [(config.get('network', {}).get('ns3') or {}) for _, config in trials
+               if self.uses_ns3(config)]
+        for path, build in sorted({(os.path.abspath(os.path.join(ROOT, c.get('path', network.PATH))),
+                                    c.get('build', './ns3 build')) for c in ns3}):
+            if build:
+                logging.info('Building ns-3: {}'.format(path))
+                subprocess.run(build, shell=True, cwd=path, check=True)
+
+    def trial_config(self, config, path):
+        # Config as run inside the trial directory
+        config = copy.deepcopy(config)
+        paths = config.setdefault('paths', {})
+        name = config.get('model', {}).get('name', 'MNIST')
+        os.makedirs(os.path.join(path, 'models'), exist_ok=True)
+        link = os.path.join(path, 'models', name)
+        if not os.path.lexists(link):
+            os.makedirs(link)
+            os.symlink(os.path.join(self.model_source(config), 'fl_model.py'),
+                       os.path.join(link, 'fl_model.py'))
+        paths['model'] = './models'
+        paths['data'] = self.data_path(config)
+        # Outputs land in the trial directory, whatever the base config says
+        paths['records'] = 'record.csv'
+        paths['plot'] = './plots'
+        os.makedirs(os.path.join(path, 'plots'), exist_ok=True)
+        for field in ['reports', 'spans']:
+            if paths.get(field):
+                paths[field] = os.path.basename(os.path.normpath(paths[field]))
+
+        if self.uses_ns3(config):
+            ns3 = dict(config['network'].get('ns3') or {})
+            ns3['path'] = os.path.abspath(os.path.join(ROOT, ns3.get('path', network.PATH)))
+            ns3['build'] = None  # Built by the sweep
+            config['network']['ns3'] = ns3
+        return config
+
+    # Trials
+    def run_trial(self, params, config, threads):
+        if self.stopping:
+            return None
+        trial_hash = config_hash(config)
+        path = os.path.join(self.trials_path, trial_hash)
+        if os.path.exists(path):  # Left by an interrupted sweep
+            shutil.rmtree(path)
+        os.makedirs(path)
+        trial_config = self.trial_config(config, path)
+        with open(os.path.join(path, 'config.json'), 'w') as f:
+            json.dump(trial_config, f, indent=2)
+        record_path = os.path.join(path, trial_config['paths']['records'])
+
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        st = time.time()
+        with open(os.path.join(path, 'log.txt'), 'w') as log:
+            proc = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, 'run.py'),
+                 '--config', 'config.json', '--log', args.log],
+                cwd=path, env=env, stdout=log, stderr=subprocess.STDOUT,
+                start_new_session=True)
+            self.procs[trial_hash] = proc
+            rungs, stopped = {}, None
+            if self.halving:
+                rungs, stopped = self.halving.follow(proc, record_path)
+            returncode = proc.wait()
+            del self.procs[trial_hash]
+        if self.stopping:
+            return None
+
+        status = 'done' if returncode == 0 else 'failed'
+        if stopped is not None:
+            status = 'stopped'
+        result = dict(self.summarize(config, record_path),
+                      hash=trial_hash, params=params, path=path, status=status,
+                      returncode=returncode, wall=time.time() - st)
+        if self.halving:
+            result.update(rungs=rungs, stopped_at=stopped)
+        self.store.add(result)
+        logging.info('Trial {} {}{} in {:.0f} s: {}, accuracy {}'.format(
+            trial_hash, status, '' if stopped is None else ' at rung {}'.format(stopped),
+            result['wall'], params,
+            'n/a' if result['accuracy'] is None else '{:.2f}%'.format(100 * result['accuracy'])))
+        return result
+
+    @staticmethod
+    def summarize(config, record_path):
+        times, accs = read_curve(record_path)
+        target = config.get('federated_learning', {}).get('target_accuracy')
+        reached = [t for t, acc in zip(times, accs) if target and acc >= target]
+        return {
+            'records': len(accs),
+            'time': times[-1] if times else None,
+            'accuracy': accs[-1] if accs else None,
+            'best_accuracy': max(accs) if accs else None,
+            'time_to_target': reached[0] if reached else None,
+        }
+
+    def run(self, trials, workers, threads):
+        pending = [(params, config) for params, config in trials
+                   if not self.store.done(config_hash(config), args.retry)]
+        logging.info('Sweep: {} trials, {} finished before, {} workers x {} threads'.format(
+            len(trials), len(trials) - len(pending), workers, threads))
+        if not pending:
+            return
+
+        self.prepare(pending)
+        try:
+            with ThreadPoolExecutor(workers) as pool:
+                futures = [pool.submit(self.run_trial, params, config, threads)
+                           for params, config in pending]
+                try:
+                    for future in futures:
+                        future.result()
+                except KeyboardInterrupt:
+                    logging.warning('Stopping sweep, finished trials are kept')
+                    self.stopping = True
+                    for future in futures:
+                        future.cancel()
+                    for proc in list(self.procs.values()):
+                        stop(proc)
+                    raise
+        finally:
+            self.store.close()
+
+
+def main():
+    """Run every point of a parameter grid, skipping trials already stored."""
+
+    with open(args.config) as f:
+        base = json.load(f)
+    with open(args.grid) as f:
+        grid = json.load(f)
+
+    threads = max(1, args.threads)
+    workers = args.workers or max(1, (os.cpu_count() or 1) // threads)
+    trials = expand(base, grid)
+
+    halving = Halving(args.halving, args.eta, args.poll) if args.halving else None
+    sweep = Sweep(args.output, halving)
+    sweep.run(trials, workers, threads)
+
+    # Best trials first
+    results = [sweep.store.results[config_hash(config)] for _, config in trials
+               if config_hash(config) in sweep.store.results]
+    results.sort(key=lambda r: -(r['accuracy'] if r['accuracy'] is not None else -1))
+    lines = ['Sweep results ({}):'.format(os.path.join(sweep.output, 'results.jsonl'))]
+    for r in results:
+        lines.append('  {} {:<7} accuracy {:>7} best {:>7} T {:>8}  {}'.format(
+            r['hash'], r['status'],
+            'n/a' if r['accuracy'] is None else '{:.2f}%'.format(100 * r['accuracy']),
+            'n/a' if r['best_accuracy'] is None else '{:.2f}%'.format(100 * r['best_accuracy']),
+            'n/a' if r['time'] is None else '{:.1f}'.format(r['time']), r['params']))
+    logging.info('\n'.join(lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,9 @@ import time
 import torch
 
 from server import Server
-from network import Network
+from network import make_network
 from .record import Record, Profile
+from utils.spans import spans  # pylint: disable=no-name-in-module
 
 
 def _get(root, path, default=None):
@@ -23,6 +24,83 @@ def _get(root, path, default=None):
     return cur
 
 
+class UpdateBuffer(object):
+    """Staleness-weighted client updates waiting to be applied to the global model.
+
+    Updates are folded into one running set of tensors as they arrive and
+    their weights are dropped from the report, so memory stays at a single
+    model copy whatever the buffer size. With keep_weights (reports are
+    saved at flush) every buffered report holds on to its weights.
+    Modes:
+      - 'sequential': w <- (1 - alpha_t) * w + alpha_t * w_client per update,
+        same result as unbuffered async but applied once per flush
+      - 'mean': w <- w + mean(alpha_t * (w_client - w)) over the buffer
+    """
+
+    def __init__(self, size=1, deadline=None, mode='sequential', keep_weights=False):
+        assert mode in ('sequential', 'mean'), 'Unknown buffer mode: {}'.format(mode)
+        self.size = max(1, int(size or 1))
+        self.deadline = float(deadline) if deadline is not None else None
+        self.mode = mode
+        self.keep_weights = keep_weights
+        self.clear()
+
+    def __repr__(self):
+        return 'UpdateBuffer(size={}, deadline={}, mode={})'.format(
+            self.size, self.deadline, self.mode)
+
+    def __len__(self):
+        return len(self.reports)
+
+    def clear(self):
+        self.reports = []
+        self.baseline = None
+        self.weights = None
+        self.start_time = None
+
+    def add(self, report, baseline_weights, alpha_t, T):
+        if self.weights is None:
+            self.start_time = T
+            self.baseline = baseline_weights
+            if self.mode == 'sequential':
+                self.weights = [(name, weight.clone()) for name, weight in baseline_weights]
+            else:
+                self.weights = [(name, torch.zeros_like(weight)) for name, weight in baseline_weights]
+
+        for i, (name, weight) in enumerate(report.weights):
+            acc_name, acc = self.weights[i]
+            # Ensure correct weight is being updated
+            assert name == acc_name
+            weight = weight.to(acc.dtype)
+            if self.mode == 'sequential':
+                acc.mul_(1 - alpha_t).add_(weight, alpha=alpha_t)
+            else:
+                acc.add_(weight - self.baseline[i][1], alpha=alpha_t)
+
+        if not self.keep_weights:
+            report.weights = None
+        self.reports.append(report)
+
+    def due(self, T):
+        """Whether the buffer should be flushed at simulated time T."""
+        if len(self.reports) >= self.size:
+            return True
+        return self.deadline is not None and self.start_time is not None and \
+            T - self.start_time >= self.deadline
+
+    def flush(self):
+        """Return (updated_weights, reports) and empty the buffer."""
+        if self.mode == 'sequential':
+            updated_weights = self.weights
+        else:
+            n = len(self.reports)
+            updated_weights = [(name, weight + self.weights[i][1] / n)
+                               for i, (name, weight) in enumerate(self.baseline)]
+        reports = self.reports
+        self.clear()
+        return updated_weights, reports
+
+
 class AsyncServer(Server):
     """Asynchronous federated learning server."""
 
@@ -136,42 +214,43 @@ class AsyncServer(Server):
         self.async_save_model(self.model, model_path, 0.0)
 
         if self.config.paths.reports:
-            self.saved_reports = {}
+            self.open_reports()
             self.save_reports(0, [])  # initial snapshot
 
     def make_clients(self, num_clients):
         super().make_clients(num_clients)
 
         # Set link speed for clients
-        speed = []
-        for client in self.clients:
-            client.set_link(self.config)
-            speed.append(client.speed_mean)
-        logging.info('Speed distribution: {} Kbps'.format([s for s in speed]))
+        if self.config.clients.lazy:  # Drawn at once, clients pick them up later
+            self.client_table.set_links(self.config, self.client_rng)
+        else:
+            for client in self.clients:
+                client.set_link(self.config)
+        speed = self.client_table.speed_mean
+        logging.info('Speed distribution: {} Kbps'.format(
+            speed.tolist() if len(speed) <= 1000 else
+            'min {:.1f}, mean {:.1f}, max {:.1f}'.format(speed.min(), speed.mean(), speed.max())))
 
         # Initiate client profile of loss and delay
-        self.profile = Profile(num_clients)
+        profile = self.config.profile
+        self.profile = Profile(num_clients, profile.store, profile.sketch_dim, profile.path)
         if _get(self.config, ['data', 'IID'], True) is False:
-            self.profile.set_primary_label([client.pref for client in self.clients])
+            self.profile.set_primary_label(self.client_table.pref_labels())
 
     def run(self):
         rounds = _get(self.config, ['fl', 'rounds'], _get(self.config, ['federated_learning', 'rounds'], 1))
         target_accuracy = _get(self.config, ['fl', 'target_accuracy'],
                                _get(self.config, ['federated_learning', 'target_accuracy'], None))
-        reports_path = self.config.paths.reports
 
-        # Init async/staleness parameters (support "sync" or "async" naming)
-        sync_cfg = _get(self.config, ['sync'], None) or _get(self.config, ['async'], None)
-        self.alpha = getattr(sync_cfg, 'alpha', _get(sync_cfg, ['alpha'], 0.9))
-        self.staleness_func = getattr(sync_cfg, 'staleness_func', _get(sync_cfg, ['staleness_func'], 'polynomial'))
+        self.setup_aggregation()
 
         # Resolve DP config once at startup
         self._dp_cfg = self._get_dp_cfg()
 
-        network = Network(self.config)
+        network = self.network = make_network(self.config)
         logging.info(f"[DP] server-level cfg: {self._dp_cfg}")
 
-        self.records = Record()
+        self.records = Record(self.config.paths.records)
 
         if target_accuracy:
             logging.info('Training: {} rounds or {}% accuracy\n'.format(rounds, 100 * target_accuracy))
@@ -183,37 +262,47 @@ class AsyncServer(Server):
         time.sleep(1)
         network.connect()
 
-        f = open("dropout.txt", "a")
-
         for rnd in range(1, rounds + 1):
             logging.info('**** Round {}/{} ****'.format(rnd, rounds))
-            f.write('**** Round {}/{} ****\n'.format(rnd, rounds)); f.flush()
 
             self.rm_old_models(self.config.paths.model, T_old)
-            accuracy, T_new = self.async_round(rnd, T_old, network, f)
+            spans.begin_round(rnd)
+            accuracy, T_new = self.async_round(rnd, T_old, network)
+            self.end_round(rnd, T_old, T_new)
 
             T_old = T_new
 
-            if target_accuracy and (accuracy >= target_accuracy):
+            if target_accuracy and self.target_reached(accuracy, target_accuracy):
                 logging.info('Target accuracy reached.')
                 break
 
-        if reports_path:
-            with open(reports_path, 'wb') as f_out:
-                pickle.dump(self.saved_reports, f_out)
-            logging.info('Saved reports: {}'.format(reports_path))
+        self.finish()
 
         network.disconnect()
-        f.close()
 
-    def async_round(self, round_idx, T_old, network, f):
+    def setup_aggregation(self):
+        # Init async/staleness parameters (support "sync" or "async" naming)
+        sync_cfg = _get(self.config, ['sync'], None) or _get(self.config, ['async'], None)
+        self.alpha = getattr(sync_cfg, 'alpha', _get(sync_cfg, ['alpha'], 0.9))
+        self.staleness_func = getattr(sync_cfg, 'staleness_func', _get(sync_cfg, ['staleness_func'], 'polynomial'))
+        self.buffer = UpdateBuffer(
+            getattr(sync_cfg, 'buffer_size', _get(sync_cfg, ['buffer_size'], 1)),
+            getattr(sync_cfg, 'buffer_deadline', _get(sync_cfg, ['buffer_deadline'], None)),
+            getattr(sync_cfg, 'buffer_mode', _get(sync_cfg, ['buffer_mode'], 'sequential')),
+            keep_weights=bool(self.config.paths.reports))  # Saved with the flushed reports
+        logging.info('Update buffer: {}'.format(self.buffer))
+
+    def async_round(self, round_idx, T_old, network):
         import fl_model  # pylint: disable=import-error
         target_accuracy = _get(self.config, ['fl', 'target_accuracy'],
                                _get(self.config, ['federated_learning', 'target_accuracy'], None))
 
         # Select clients
-        sample_clients = self.selection()
+        with spans.span('selection'):
+            sample_clients = self.selection()
         parsed_clients = network.parse_clients(sample_clients)
+        self.mark_base(T_old)
+        network.set_model_bytes(self.upload_bytes())
 
         id_to_client = {c.client_id: (c, T_old) for c in sample_clients}
         client_finished = {c.client_id: False for c in sample_clients}
@@ -230,40 +319,53 @@ class AsyncServer(Server):
 
         def _apply_update(select_client, T_client):
             nonlocal T_new
-            self.async_configuration([select_client], T_client)
+            with spans.span('configuration', client=select_client.client_id):
+                self.async_configuration([select_client], T_client)
             select_client.run(reg=True)
             T_cur = T_client + select_client.delay
             T_new = T_cur
+            spans.sim('client', T_client, T_cur, client=select_client.client_id)
 
             logging.info('Training finished on clients {} at time {} s'.format(select_client, T_cur))
 
             reports = self.reporting([select_client])
+            self.trace_reports(reports, T_cur)
 
             self.update_profile(reports)
-            logging.info('Aggregating updates from clients {}'.format(select_client))
+            logging.info('Buffering updates from clients {}'.format(select_client))
             staleness = select_client.delay
-            updated_weights = self.aggregation(reports, staleness)
+            with spans.span('aggregation.buffer', client=select_client.client_id):
+                self.buffer_update(reports, staleness, T_cur)
+
+            # Aggregate, snapshot and evaluate only once the buffer is due
+            if not self.buffer.due(T_cur):
+                return False
+            _flush(T_cur)
+            return True
 
-            fl_model.load_weights(self.model, updated_weights)
+        def _flush(T_cur):
+            logging.info('Aggregating {} buffered updates'.format(len(self.buffer)))
+            with spans.span('aggregation'):
+                updated_weights, reports = self.buffer.flush()
+
+                fl_model.load_weights(self.model, updated_weights)
 
             if self.config.paths.reports:
                 self.save_reports(round_idx, reports)
             self.async_save_model(self.model, self.config.paths.model, T_cur)
 
-            if _get(self.config, ['clients', 'do_test'], False):
-                acc = self.accuracy_averaging(reports)
-            else:
-                testset = self.loader.get_testset()
-                batch_size = _get(self.config, ['fl', 'batch_size'],
-                                  _get(self.config, ['federated_learning', 'batch_size'], 32))
-                testloader = fl_model.get_testloader(testset, batch_size)
-                acc = fl_model.test(self.model, testloader)
-
             # throughput accounting (avg of delivered so far)
             self.throughput = (sum(throughputs) / len(throughputs)) if throughputs else 0.0
-            logging.info('Average accuracy: {:.2f}%\n'.format(100 * acc))
-            self.records.async_time_graphs(T_cur, acc, self.throughput)
-            return acc
+            throughput = self.throughput
+
+            def record(acc):
+                logging.info('Average accuracy: {:.2f}%\n'.format(100 * acc))
+                self.records.async_time_graphs(T_cur, acc, throughput)
+
+            if _get(self.config, ['clients', 'do_test'], False):
+                record(self.accuracy_averaging(reports))
+            else:
+                self.evaluate(T_cur, record)
 
         # ---------- SYNC FALLBACK ----------
         if not use_async:
@@ -278,19 +380,18 @@ class AsyncServer(Server):
                     continue
                 select_client, T_client = handled
                 client_finished[cid] = True
-                acc = _apply_update(select_client, T_client)
-                if target_accuracy and (self.records.get_latest_acc() >= target_accuracy):
+                flushed = _apply_update(select_client, T_client)
+                if flushed and target_accuracy and self.target_reached(None, target_accuracy):
                     logging.info('Target accuracy reached.')
                     break
 
+            if len(self.buffer):
+                _flush(T_new)
             logging.info('Round lasts {} secs, avg throughput {} kB/s'.format(T_new, self.throughput))
-            # count unfinished
-            cnt = sum(0 if client_finished[c] else 1 for c in client_finished)
-            for c in client_finished:
-                if not client_finished[c]:
-                    f.write(str(c) + '\n'); f.flush()
-            self.records.async_round_graphs(round_idx, cnt)
-            return self.records.get_latest_acc(), self.records.get_latest_t()
+            # Record unfinished clients
+            unfinished = [c for c in client_finished if not client_finished[c]]
+            self.records.async_round_graphs(round_idx, len(unfinished), unfinished)
+            return self.records.get_latest_acc(), T_new
 
         # ---------- TRUE ASYNC ----------
         while True:
@@ -307,49 +408,34 @@ class AsyncServer(Server):
                     continue
                 select_client, T_client = handled
                 client_finished[cid] = True
-                acc = _apply_update(select_client, T_client)
-                if target_accuracy and (self.records.get_latest_acc() >= target_accuracy):
+                flushed = _apply_update(select_client, T_client)
+                if flushed and target_accuracy and self.target_reached(None, target_accuracy):
                     logging.info('Target accuracy reached.')
                     break
 
+        if len(self.buffer):
+            _flush(T_new)
         logging.info('Round lasts {} secs, avg throughput {} kB/s'.format(T_new, self.throughput))
-        cnt = sum(0 if client_finished[c] else 1 for c in client_finished)
-        for c in client_finished:
-            if not client_finished[c]:
-                f.write(str(c) + '\n'); f.flush()
-        self.records.async_round_graphs(round_idx, cnt)
-        return self.records.get_latest_acc(), self.records.get_latest_t()
+        unfinished = [c for c in client_finished if not client_finished[c]]
+        self.records.async_round_graphs(round_idx, len(unfinished), unfinished)
+        return self.records.get_latest_acc(), T_new
 
     # ---------- selection / configuration ----------
+    def target_reached(self, accuracy, target_accuracy):
+        # Decide on the smoothed accuracy curve in the records
+        if self.eval_worker:
+            self.eval_worker.wait(self.evaluator.lag)
+        if not len(self.records):
+            return False
+        return self.evaluator.reached(self.model, self.records.get_latest_acc(), target_accuracy)
+
     def selection(self):
         clients_per_round = self.config.clients.per_round
         select_type = self.config.clients.selection
 
-        if select_type == 'random':
-            sample_clients = [client for client in random.sample(self.clients, clients_per_round)]
-
-        elif select_type == 'short_latency_first':
-            sample_clients = sorted(self.clients, key=lambda c: c.est_delay)[:clients_per_round]
-            print(sample_clients)
-
-        elif select_type == 'short_latency_high_loss_first':
-            losses = [c.loss for c in self.clients]
-            losses_norm = [l / max(losses) for l in losses]
-            delays = [c.est_delay for c in self.clients]
-            delays_norm = [d / max(losses) for d in delays]
-            gamma = 0.2
-            sorted_idx = sorted(
-                range(len(self.clients)),
-                key=lambda i: losses_norm[i] - gamma * delays_norm[i],
-                reverse=True
-            )
-            print([losses[i] for i in sorted_idx])
-            print([delays[i] for i in sorted_idx])
-            sample_clients = [self.clients[i] for i in sorted_idx][:clients_per_round]
-            print(sample_clients)
-        else:
-            sample_clients = [client for client in random.sample(self.clients, clients_per_round)]
-        return sample_clients
+        # Score all clients at once from the client table
+        index = self.client_table.select(select_type, clients_per_round)
+        return [self.clients[i] for i in index]
 
     def async_configuration(self, sample_clients, download_time):
         loader_type = _get(self.config, ['loader'], None)
@@ -364,6 +450,7 @@ class AsyncServer(Server):
 
             # Pass the already-resolved DP config to each client
             client.dp = self._dp_cfg
+            client.compressor = self.compressor
             logging.info(f"[DP] cfg for client {client.client_id}: {client.dp}")
 
             # Continue configuration on client
@@ -373,6 +460,17 @@ class AsyncServer(Server):
     def aggregation(self, reports, staleness=None):
         return self.federated_async(reports, staleness)
 
+    def buffer_update(self, reports, staleness, T):
+        import fl_model  # pylint: disable=import-error
+
+        alpha_t = self.alpha * self.staleness(staleness)
+        logging.info('{} staleness: {} alpha_t: {}'.format(self.staleness_func, staleness, alpha_t))
+
+        # The global model is untouched until the next flush
+        baseline_weights = fl_model.extract_weights(self.model) if not len(self.buffer) else None
+        for report in reports:
+            self.buffer.add(report, baseline_weights, alpha_t, T)
+
     def extract_client_weights(self, reports):
         return [report.weights for report in reports]
 
@@ -414,7 +512,8 @@ class AsyncServer(Server):
     # ---------- model snapshots / housekeeping ----------
     def async_save_model(self, model, path, download_time):
         path += '/global_' + '{}'.format(download_time)
-        torch.save(model.state_dict(), path)
+        with spans.span('save_model'):
+            torch.save(model.state_dict(), path)
         logging.info('Saved global model: {}'.format(path))
 
     def rm_old_models(self, path, cur_time):
@@ -429,9 +528,12 @@ class AsyncServer(Server):
                 continue
 
     def update_profile(self, reports):
-        for report in reports:
-            self.profile.update(report.client_id, report.loss, report.delay,
-                                self.flatten_weights(report.weights))
+        if not reports:
+            return
+        self.profile.update_many([report.client_id for report in reports],
+                                 [report.loss for report in reports],
+                                 [report.delay for report in reports],
+                                 [self.flatten_weights(report.weights) for report in reports])
 
 
 # # flsim/server/asyncServer.py
@@ -1,7 +1,9 @@
 import logging
+from client import top_k
 from server import Server
 import numpy as np
 from threading import Thread
+from utils.sketch import CountSketch  # pylint: disable=no-name-in-module
 
 
 class DirectedServer(Server):
@@ -21,45 +23,59 @@ class DirectedServer(Server):
 
         clients = self.clients
         clients_per_round = self.config.clients.per_round
-        profiles = self.profiles
         w_previous = self.w_previous
 
-        # Extract directors from profiles
-        directors = [d for _, d in profiles]
-
         # Extract most recent model weights
         w_current = self.flatten_weights(fl_model.extract_weights(self.model))
-        model_direction = w_current - w_previous
-        # Normalize model direction
-        model_direction = model_direction / \
-            np.sqrt(np.dot(model_direction, model_direction))
+        model_direction = self.normalize(self.project(w_current - w_previous))
 
         # Update previous model weights
         self.w_previous = w_current
 
         # Generate client director scores (closer direction is better)
-        scores = [np.dot(director, model_direction) for director in directors]
-        # Apply punishment for repeatedly selected clients
-        p = self.punishment
-        scores = [x * (0.9)**p[i] for i, x in enumerate(scores)]
+        scores = self.directors.dot(model_direction)
+        # Apply punishment for repeatedly selected clients, which are
+        # only those of the previous round
+        punished = self.punished
+        scores[punished] *= 0.9 ** self.punishment[punished]
 
         # Select clients with highest scores
-        sample_clients_index = []
-        for _ in range(clients_per_round):
-            top_score_index = scores.index(max(scores))
-            sample_clients_index.append(top_score_index)
-            # Overwrite to avoid reselection
-            scores[top_score_index] = min(scores) - 1
+        sample_clients_index = top_k(scores, clients_per_round)
 
         # Extract selected sample clients
         sample_clients = [clients[i] for i in sample_clients_index]
 
         # Update punishment factors
-        self.punishment = [
-            p[i] + 1 if i in sample_clients_index else 0 for i in range(len(clients))]
+        punishment = self.punishment[sample_clients_index] + 1
+        self.punishment[punished] = 0
+        self.punishment[sample_clients_index] = punishment
+        self.punished = sample_clients_index
 
         return sample_clients
 
+    def aggregation(self, reports):
+        # Refresh the directors of this round's clients from their updates
+        if getattr(self, 'directors', None) is not None and reports:
+            self.refresh_directors(reports)
+        return super().aggregation(reports)
+
+    def refresh_directors(self, reports):
+        # Client updates relative to the global model they trained from
+        rows = [report.client_id for report in reports]
+        updates = [self.flatten_weights(report.weights) - self.w_previous
+                   for report in reports]
+        self.directors[rows] = self.normalize(self.project(np.stack(updates)))
+
+    def project(self, vectors):
+        # Sketch vectors like the directors, if they are sketched
+        return self.sketch.transform(vectors) if self.sketch is not None else vectors
+
+    @staticmethod
+    def normalize(vectors):
+        # Scale to unit length, leaving zero vectors as they are
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
     def profiling(self):
         import fl_model  # pylint: disable=import-error
 
@@ -95,15 +111,20 @@ class DirectedServer(Server):
         # Load updated weights
         fl_model.load_weights(self.model, updated_weights)
 
-        # Calculate direction vectors (directors)
-        directors = [(w - w0) for w in weights]
+        # Calculate direction vectors (directors), as one matrix that is
+        # sketched with a random projection when the profile store is
+        self.sketch = None
+        if self.config.profile.store == 'sketch':
+            self.sketch = CountSketch(len(w0), self.config.profile.sketch_dim)
+        directors = self.project(np.stack(weights) - w0)
         # Normalize directors to unit length
-        directors = [d / np.sqrt(np.dot(d, d)) for d in directors]
+        self.directors = self.normalize(directors).astype(np.float32)
 
         # Initialize punishment factors
-        self.punishment = [0 for _ in range(len(clients))]
+        self.punishment = np.zeros(len(clients), dtype=np.int64)
+        self.punished = np.empty(0, dtype=np.int64)
 
         # Use directors for client profiles
-        self.profiles = [(client, directors[i])
+        self.profiles = [(client, self.directors[i])
                          for i, client in enumerate(clients)]
         return self.profiles
@@ -0,0 +1,289 @@
+from collections import OrderedDict
+import copy
+import logging
+import queue
+from statistics import NormalDist
+import sys
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from utils.profiling import profiler  # pylint: disable=no-name-in-module
+
+
+class Evaluator(object):
+    """Server-side test set evaluation.
+
+    The test set is stacked once into a single pre-normalized tensor and the
+    global model is evaluated in a few large, unshuffled batches. Evaluation
+    can be thinned out to every N model updates or every interval of
+    simulated time, and can run on a stratified subsample whose confidence
+    interval drives the target accuracy check.
+    """
+
+    def __init__(self, config, testset):
+        self.testset = testset
+
+        evaluation = getattr(config, 'evaluation', None)
+        self.every = getattr(evaluation, 'every', 1)
+        self.interval = getattr(evaluation, 'interval', None)
+        self.batch_size = getattr(evaluation, 'batch_size', 1024)
+        self.subsample = getattr(evaluation, 'subsample', None)
+        self.confidence = getattr(evaluation, 'confidence', 0.95)
+        self.seed = getattr(evaluation, 'seed', 0)
+        self.lag = getattr(evaluation, 'lag', 1)
+
+        self.images, self.labels = None, None
+        self.sample = None
+        self.accuracy = None  # Latest evaluated accuracy
+        self.ci = None  # Confidence interval of the latest subsample estimate
+        self.state = None  # Model state the confidence interval was computed from
+        self.last_T = None
+        self.pending = 0  # Model updates since the latest evaluation
+        self.count = 0  # Evaluations started so far
+
+    # Test set caching
+    def stack(self):
+        import fl_model  # pylint: disable=import-error
+
+        device = getattr(fl_model, 'device', torch.device('cpu'))
+
+        # Run the dataset transforms once and keep the result
+        loader = torch.utils.data.DataLoader(
+            self.testset, batch_size=self.batch_size, shuffle=False)
+        images, labels = [], []
+        for image, label in loader:
+            images.append(image)
+            labels.append(label)
+        self.images = torch.cat(images).to(device)
+        self.labels = torch.cat(labels).to(device)
+
+        if self.subsample:
+            self.sample = self.stratify(self.labels.cpu().numpy())
+
+        logging.info('Evaluator: cached {} test samples{}'.format(
+            len(self.labels), ', {} in subsample'.format(
+                len(self.sample[0])) if self.sample else ''))
+
+    def stratify(self, labels):
+        # Draw the same share of samples from every label
+        rng = np.random.RandomState(self.seed)
+        classes, counts = np.unique(labels, return_counts=True)
+
+        fraction = self.subsample if self.subsample <= 1 else \
+            min(1.0, self.subsample / len(labels))
+
+        index, strata = [], []
+        for label, count in zip(classes, counts):
+            n = max(1, int(round(fraction * count)))
+            members = np.flatnonzero(labels == label)
+            index.append(rng.choice(members, n, replace=False))
+            strata.append((count / len(labels), n, count))
+
+        index = torch.from_numpy(np.concatenate(index)).to(self.labels.device)
+        return index, strata
+
+    # Evaluation cadence
+    def due(self, T=None):
+        self.pending += 1
+
+        if not self.count:  # Always evaluate the first model
+            return True
+        if self.every and self.pending >= self.every:
+            return True
+        if self.interval is not None and T is not None and \
+                self.last_T is not None and T - self.last_T >= self.interval:
+            return True
+        return False
+
+    def mark(self, T=None):
+        # Restart the cadence at an evaluation
+        self.last_T = T
+        self.pending = 0
+        self.count += 1
+
+    # Evaluation
+    def predict(self, model, images, labels):
+        import fl_model  # pylint: disable=import-error
+
+        device = getattr(fl_model, 'device', torch.device('cpu'))
+        inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+        model.to(device)
+        model.eval()
+        correct = torch.zeros(len(labels), dtype=torch.bool, device=labels.device)
+        with inference_mode():
+            for start in range(0, len(labels), self.batch_size):
+                stop = start + self.batch_size
+                output = model(images[start:stop])
+                correct[start:stop] = output.argmax(dim=1) == labels[start:stop]
+
+        return correct
+
+    def evaluate(self, model, T=None):
+        if self.images is None:
+            self.stack()
+
+        with profiler.capture('test'):
+            if self.sample:
+                accuracy = self.evaluate_subsample(model)
+            else:
+                accuracy = self.evaluate_full(model)
+
+        self.accuracy = accuracy
+        self.mark(T)
+        return accuracy
+
+    def evaluate_full(self, model):
+        if self.images is None:
+            self.stack()
+
+        correct = self.predict(model, self.images, self.labels)
+        self.ci = None
+        self.state = None
+        return correct.float().mean().item()
+
+    def evaluate_subsample(self, model):
+        index, strata = self.sample
+        correct = self.predict(model, self.images[index], self.labels[index])
+        correct = correct.cpu().numpy()
+        self.state = snapshot(model)
+
+        # Stratified estimate with finite population correction
+        accuracy, variance, offset = 0., 0., 0
+        for weight, n, count in strata:
+            p = correct[offset:offset + n].mean()
+            accuracy += weight * p
+            if n > 1:
+                variance += weight**2 * p * (1 - p) / (n - 1) * (1 - n / count)
+            offset += n
+
+        z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+        margin = z * np.sqrt(variance)
+        self.ci = (float(accuracy - margin), float(accuracy + margin))
+
+        logging.info('Subsample accuracy: {:.2f}% ({:.0f}% CI {:.2f}%-{:.2f}%)'.format(
+            100 * accuracy, 100 * self.confidence, 100 * self.ci[0], 100 * self.ci[1]))
+        return float(accuracy)
+
+    def reached(self, model, accuracy, target):
+        """Decide whether the target accuracy is met."""
+        if self.ci is None:
+            return accuracy >= target
+
+        lower, upper = self.ci
+        if lower >= target:
+            return True
+        if upper < target:
+            return False
+
+        # Interval straddles the target: settle it on the full test set,
+        # with the model the interval belongs to rather than the live one
+        logging.info('Target within confidence interval, testing full set')
+        if self.state is not None:
+            model = copy.deepcopy(model)
+            model.load_state_dict(self.state)
+        return self.evaluate_full(model) >= target
+
+
+def snapshot(model):
+    # CPU copy of the model state
+    return {name: tensor.detach().cpu().clone() for name, tensor in model.state_dict().items()}
+
+
+class EvaluationWorker(object):
+    """Evaluate global model snapshots in a separate process.
+
+    Snapshots are queued with a version and their simulated time, and
+    results are handed back in order through per-snapshot callbacks. Jobs
+    without a snapshot carry the previous accuracy forward, which keeps the
+    results in submission order when the cadence skips an update.
+    """
+
+    def __init__(self, evaluator, model_path):
+        if evaluator.images is None:
+            evaluator.stack()
+        self.evaluator = evaluator
+
+        context = mp.get_context('spawn')
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        # Ship the evaluator without its raw dataset, the stacked tensors suffice
+        testset, evaluator.testset = evaluator.testset, None
+        self.process = context.Process(
+            target=evaluation_worker, args=(evaluator, model_path, self.jobs, self.results),
+            daemon=True)
+        self.process.start()
+        evaluator.testset = testset
+
+        self.version = 0
+        self.pending = OrderedDict()  # Version -> (callback, snapshot)
+        logging.info('Evaluation worker started (pid {})'.format(self.process.pid))
+
+    def submit(self, model, T=None, callback=None):
+        """Queue a snapshot of model (or a carry-forward job if model is None)."""
+        self.version += 1
+        state = snapshot(model) if model is not None else None
+        # Subsample results keep their snapshot for a full check of the target
+        self.pending[self.version] = (callback, state if self.evaluator.sample else None)
+        self.jobs.put((self.version, T, state))
+        self.poll()
+        return self.version
+
+    def deliver(self, result):
+        version, T, accuracy, ci = result
+        callback, state = self.pending.pop(version)
+
+        # Mirror the result on the local evaluator for the target check
+        self.evaluator.accuracy = accuracy
+        self.evaluator.ci = ci
+        if state is not None:  # Carry-forward jobs keep the previous snapshot
+            self.evaluator.state = state
+
+        logging.info('Evaluated snapshot {} (time {}): {:.2f}%'.format(
+            version, T, 100 * accuracy))
+        if callback is not None:
+            callback(accuracy)
+
+    def poll(self):
+        # Deliver every result that has already arrived
+        while self.pending:
+            try:
+                self.deliver(self.results.get_nowait())
+            except queue.Empty:
+                break
+
+    def wait(self, lag=0):
+        """Block until at most lag snapshots are still being evaluated."""
+        self.poll()
+        while len(self.pending) > lag:
+            if not self.process.is_alive():
+                raise RuntimeError('Evaluation worker exited unexpectedly')
+            try:
+                self.deliver(self.results.get(timeout=1))
+            except queue.Empty:
+                continue
+
+    def close(self):
+        self.wait(0)
+        self.jobs.put(None)
+        self.process.join()
+
+
+def evaluation_worker(evaluator, model_path, jobs, results):
+    # Evaluation process entry point
+    sys.path.append(model_path)
+    import fl_model  # pylint: disable=import-error
+
+    model = fl_model.Net()
+    accuracy, ci = None, None
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        version, T, state = job
+        if state is not None:
+            model.load_state_dict(state)
+            accuracy = evaluator.evaluate(model, T)
+            ci = evaluator.ci
+        results.put((version, T, accuracy, ci))
@@ -1,8 +1,10 @@
 import logging
 import random
 from server import Server
+import numpy as np
 from threading import Thread
 from utils.kcenter import GreedyKCenter  # pylint: disable=no-name-in-module
+from utils.sketch import CountSketch  # pylint: disable=no-name-in-module
 
 
 class KCenterServer(Server):
@@ -36,7 +38,7 @@ class KCenterServer(Server):
         random.shuffle(profiles)
 
         # Cluster clients based on profile weights
-        weights = [weight for _, weight in profiles]
+        weights = self.profile_weights[[row for _, row in profiles]]
         KCenter = GreedyKCenter()
         KCenter.fit(weights, k)
 
@@ -70,11 +72,14 @@ class KCenterServer(Server):
         # Recieve client reports
         reports = self.reporting(clients)
 
-        # Extract weights from reports
-        weights = [report.weights for report in reports]
-        weights = [self.flatten_weights(weight) for weight in weights]
+        # Extract weights from reports, sketched once with a random
+        # projection when the profile store is
+        weights = [self.flatten_weights(report.weights) for report in reports]
+        if self.config.profile.store == 'sketch':
+            sketch = CountSketch(len(weights[0]), self.config.profile.sketch_dim)
+            weights = sketch.transform(weights)
+        self.profile_weights = np.asarray(weights, dtype=np.float32)
 
-        # Use weights for client profiles
-        self.profiles = [(client, weights[i])
-                         for i, client in enumerate(clients)]
+        # Use weights for client profiles, as rows of profile_weights
+        self.profiles = [(client, i) for i, client in enumerate(clients)]
         return self.profiles
@@ -1,9 +1,18 @@
+import hashlib
+import json
 import logging
+import os
 import random
+from collections import Counter
+import numpy as np
 from server import Server
-from sklearn.cluster import KMeans
+from sklearn.cluster import MiniBatchKMeans
 from threading import Thread
 import utils.dists as dists  # pylint: disable=no-name-in-module
+from utils.sketch import CountSketch  # pylint: disable=no-name-in-module
+
+# Seed of the count sketch of client weights, part of the cache key
+SKETCH_SEED = 0
 
 
 class KMeansServer(Server):
@@ -49,7 +58,7 @@ class KMeansServer(Server):
         self.configuration(clients)
 
         # Train on local data for profiling purposes
-        threads = [Thread(target=client.train) for client in self.clients]
+        threads = [Thread(target=client.train) for client in clients]
         [t.start() for t in threads]
         [t.join() for t in threads]
 
@@ -61,22 +70,89 @@ class KMeansServer(Server):
 
         return [self.flatten_weights(weight) for weight in weights]
 
+    def sketch_weights(self, clients):
+        # Train clients per_round at a time, keeping only a random
+        # projection of their weights
+        batch_size = self.config.clients.per_round
+        sketch_dim = self.config.profile.sketch_dim
+
+        sketch, sketches = None, np.zeros((len(clients), sketch_dim), dtype=np.float32)
+        for start in range(0, len(clients), batch_size):
+            batch = clients[start:start + batch_size]
+            weights = self.model_weights(batch)
+            if sketch is None:
+                sketch = CountSketch(len(weights[0]), sketch_dim, SKETCH_SEED)
+            sketches[start:start + len(batch)] = sketch.transform(weights)
+
+            # Drop the trained models until the clients are selected
+            for client in batch:
+                client.model = client.optimizer = client.report = None
+
+        return sketches
+
     def prefs_to_weights(self):
         prefs = [client.pref for client in self.clients]
         return list(zip(prefs, self.model_weights(self.clients)))
 
+    @staticmethod
+    def partition_layout(clients):
+        # Size and label counts of each client's partition, None until data is sent
+        layout = []
+        for client in clients:
+            data = getattr(client, 'data', None)
+            if data is None:
+                return None
+            labels = Counter(str(int(label)) for _, label in data)
+            layout.append([len(data), sorted(labels.items())])
+        return layout
+
+    def profile_cache(self, clients):
+        # Cluster assignment file, keyed by what shapes the client updates
+        import fl_model  # pylint: disable=import-error
+
+        cache_dir = self.config.profile.cache
+        if not cache_dir:
+            return None
+
+        # Partitions drawn at configuration differ from run to run
+        layout = self.partition_layout(clients)
+        if layout is None:
+            logging.info('KMeans: no cluster cache, client data is loaded dynamically')
+            return None
+
+        numel = sum(weight.numel() for _, weight in fl_model.extract_weights(self.model))
+        setup = json.dumps([self.config.paths.data, self.config.model, self.config.data,
+                            self.config.fl.epochs, self.config.fl.batch_size,
+                            self.config.clients.total, self.config.clients.seed,
+                            self.config.clients.lazy,
+                            [numel, self.config.profile.sketch_dim, SKETCH_SEED],
+                            [client.pref for client in clients], layout], default=str)
+        key = hashlib.sha1(setup.encode()).hexdigest()[:16]
+        os.makedirs(cache_dir, exist_ok=True)
+        return os.path.join(cache_dir, 'kmeans_{}.npy'.format(key))
+
     def profiling(self, clients):
-        # Perform clustering
+        # Reuse the assignment of an earlier run with the same setup
+        cache = self.profile_cache(clients)
+        if cache and os.path.exists(cache):
+            logging.info('KMeans: cluster assignment from {}'.format(cache))
+            return np.load(cache)
 
-        weight_vecs = self.model_weights(clients)
+        # Perform clustering
+        sketches = self.sketch_weights(clients)
 
         # Use the number of clusters as there are labels
         n_clusters = len(self.loader.labels)
 
         logging.info('KMeans: {} clients, {} clusters'.format(
-            len(weight_vecs), n_clusters))
-        kmeans = KMeans(  # Use KMeans clustering algorithm
-            n_clusters=n_clusters).fit(weight_vecs)
+            len(sketches), n_clusters))
+        kmeans = MiniBatchKMeans(  # Use mini-batch KMeans clustering algorithm
+            n_clusters=n_clusters, random_state=self.config.clients.seed,
+            n_init=3).fit(sketches)
+
+        if cache:
+            np.save(cache, kmeans.labels_)
+            logging.info('KMeans: saved cluster assignment {}'.format(cache))
 
         return kmeans.labels_
 
@@ -0,0 +1,237 @@
+import glob
+import logging
+import os
+import resource
+import sys
+import time
+import types
+from collections import OrderedDict
+import numpy as np
+import torch
+from utils.spans import spans  # pylint: disable=no-name-in-module
+
+_SKIP = (types.ModuleType, type, types.FunctionType, types.BuiltinFunctionType,
+         types.MethodType)
+
+
+def sizeof(obj, seen=None):
+    """Approximate (resident, mapped) bytes held by obj.
+
+    Resident bytes are the storage of its tensors and arrays plus the
+    Python objects around them. Memory-mapped arrays (np.memmap, such as
+    the profile WeightStore) are backed by their file and only partly in
+    RSS, so their bytes are mapped instead. Every object and every tensor
+    storage is counted once per seen set, so sizing several owners with
+    one set attributes shared memory to the first owner reached.
+    """
+    seen = set() if seen is None else seen
+    total, mapped, stack = 0, 0, [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SKIP):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o, 0)
+
+        if torch.is_tensor(o):
+            storage = o.untyped_storage()
+            key = ('storage', storage.data_ptr())
+            if key not in seen:
+                seen.add(key)
+                total += storage.nbytes()
+        elif isinstance(o, np.ndarray):
+            if isinstance(o.base, np.ndarray):  # View, count the base
+                stack.append(o.base)
+            elif isinstance(o, np.memmap):
+                mapped += o.nbytes
+            else:
+                total += o.nbytes
+        elif isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif isinstance(o, (str, bytes, int, float, bool)) or o is None:
+            pass
+        else:
+            if hasattr(o, '__dict__'):
+                stack.append(vars(o))
+            for slot in getattr(type(o), '__slots__', ()):
+                if hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return total, mapped
+
+
+def _field(obj, name):
+    # Dotted attribute, None where missing
+    for part in name.split('.'):
+        obj = getattr(obj, part, None)
+    return obj
+
+
+def rss_bytes():
+    # Current resident set size, or the peak where /proc is unavailable
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryAccounting(object):
+    """Bytes held by the parts of a server that grow with a run.
+
+    Categories:
+      - client_data: data, trainset and testset of resident clients
+      - client_models: model, optimizer and base weights kept by clients
+      - client_reports: reports clients still hold
+      - global_model, profile, buffer, evaluator, loader: server state
+      - snapshots: async global_<T> model files on disk
+    sample() sizes them (at most once every interval seconds) and keeps
+    the peak of each in the round; end_round() logs the peaks and
+    publishes them as memory.* metrics, memory-mapped bytes apart as
+    memory.mapped.*. The datasets of the loader and the evaluator do not
+    change once built, so they are sized only when they are replaced and
+    own the samples client partitions share with them. When the RSS of
+    the process crosses rss_threshold (MB), the top owners are logged
+    once, until the RSS falls back below it.
+    """
+
+    CLIENT = OrderedDict([
+        ('client_data', ('data', 'trainset', 'testset')),
+        ('client_models', ('model', 'optimizer', 'base_weights')),
+        ('client_reports', ('report',)),
+    ])
+    SERVER = OrderedDict([
+        ('global_model', ('model', 'base_weights')),
+        ('profile', ('profile',)),
+        ('buffer', ('buffer',)),
+        ('evaluator', ('evaluator',)),
+    ])
+    # Sized when replaced only, ahead of the owners above
+    STATIC = OrderedDict([
+        ('loader', ('loader',)),
+        ('evaluator', ('evaluator.testset', 'evaluator.images', 'evaluator.labels')),
+    ])
+
+    def __init__(self, server, interval=1.0, rss_threshold=None, top=20):
+        self.server = server
+        self.interval = interval
+        self.rss_threshold = rss_threshold
+        self.top = top
+        self.last_sample = None
+        self.peaks = OrderedDict()
+        self.mapped_peaks = OrderedDict()
+        self.peak_rss = 0
+        self.above = False  # RSS over the threshold since the last dump
+        self.static_key = None
+        self.static_seen, self.static_owners = set(), []
+
+    def clients(self):
+        # Resident clients only, a lazy population is not built up
+        clients = self.server.clients
+        return list(getattr(clients, 'clients', {}).values()) \
+            if hasattr(clients, 'materialize') else list(clients)
+
+    def static(self):
+        """Seen set and owners of the static datasets, sized again when replaced."""
+        fields = [(category, field, _field(self.server, field))
+                  for category, names in self.STATIC.items() for field in names]
+        key = tuple(id(obj) for _, _, obj in fields)
+        if key != self.static_key:
+            self.static_key = key
+            self.static_seen, self.static_owners = set(), []
+            for category, field, obj in fields:
+                size, mapped = sizeof(obj, self.static_seen)
+                if size or mapped:
+                    self.static_owners.append((category, 'server.' + field, size, mapped))
+        return set(self.static_seen), list(self.static_owners)
+
+    def measure(self):
+        """Resident and mapped bytes per category and per owner, each storage
+        counted once."""
+        seen, owners = self.static()
+        for client in self.clients():
+            for category, fields in self.CLIENT.items():
+                sizes = [sizeof(getattr(client, field, None), seen) for field in fields]
+                size, mapped = sum(s for s, _ in sizes), sum(m for _, m in sizes)
+                if size or mapped:
+                    owners.append((category, '{!r} {}'.format(client, category[7:]), size, mapped))
+
+        for category, fields in self.SERVER.items():
+            for field in fields:
+                size, mapped = sizeof(getattr(self.server, field, None), seen)
+                if size or mapped:
+                    owners.append((category, 'server.' + field, size, mapped))
+
+        model_path = getattr(self.server.config.paths, 'model', None)
+        for path in glob.glob(os.path.join(model_path, 'global_*')) if model_path else []:
+            try:
+                owners.append(('snapshots', os.path.basename(path), os.path.getsize(path), 0))
+            except OSError:  # Removed meanwhile
+                pass
+
+        categories = list(OrderedDict.fromkeys(
+            list(self.CLIENT) + list(self.SERVER) + list(self.STATIC) + ['snapshots']))
+        totals = OrderedDict((category, 0) for category in categories)
+        mapped_totals = OrderedDict()
+        for category, _, size, mapped in owners:
+            totals[category] += size
+            if mapped:
+                mapped_totals[category] = mapped_totals.get(category, 0) + mapped
+        return totals, mapped_totals, owners
+
+    def sample(self, force=False):
+        rss = rss_bytes()
+        self.peak_rss = max(self.peak_rss, rss)
+        crossed = self.rss_threshold is not None and rss > self.rss_threshold * 2**20
+        if not crossed:
+            self.above = False
+
+        now = time.time()
+        due = force or self.last_sample is None or now - self.last_sample >= self.interval
+        if not due and not (crossed and not self.above):
+            return
+        self.last_sample = now
+
+        totals, mapped_totals, owners = self.measure()
+        for category, size in totals.items():
+            self.peaks[category] = max(self.peaks.get(category, 0), size)
+        for category, size in mapped_totals.items():
+            self.mapped_peaks[category] = max(self.mapped_peaks.get(category, 0), size)
+
+        if crossed and not self.above:
+            self.above = True
+            self.dump(rss, totals, mapped_totals, owners)
+
+    def dump(self, rss, totals, mapped_totals, owners):
+        lines = ['RSS {:.1f} MB crossed {} MB, top {} owners:'.format(
+            rss / 2**20, self.rss_threshold, self.top)]
+        for category, owner, size, mapped in sorted(owners, key=lambda o: -o[2])[:self.top]:
+            lines.append('  {:>10.2f} MB  {:<15} {}{}'.format(
+                size / 2**20, category, owner,
+                ' (+{:.2f} MB mapped)'.format(mapped / 2**20) if mapped else ''))
+        lines.append('  by category: ' + ', '.join(
+            '{} {:.1f} MB'.format(category, size / 2**20) for category, size in totals.items()))
+        if mapped_totals:
+            lines.append('  mapped: ' + ', '.join(
+                '{} {:.1f} MB'.format(category, size / 2**20)
+                for category, size in mapped_totals.items()))
+        logging.warning('\n'.join(lines))
+
+    def end_round(self, round):
+        self.sample(force=True)
+        logging.info('Round {} memory peaks: RSS {:.1f} MB, {}{}'.format(
+            round, self.peak_rss / 2**20, ', '.join(
+                '{} {:.1f} MB'.format(category, size / 2**20)
+                for category, size in self.peaks.items()), ''.join(
+                ', {} {:.1f} MB mapped'.format(category, size / 2**20)
+                for category, size in self.mapped_peaks.items())))
+        for category, size in self.peaks.items():
+            spans.metric('memory.' + category, size)
+        for category, size in self.mapped_peaks.items():
+            spans.metric('memory.mapped.' + category, size)
+        spans.metric('memory.rss', self.peak_rss)
+        self.peaks = OrderedDict()
+        self.mapped_peaks = OrderedDict()
+        self.peak_rss = 0
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.spans import spans  # pylint: disable=no-name-in-module
+from .memory import rss_bytes
+
+
+class Histogram(object):
+    """Cumulative-bucket histogram in the Prometheus sense.
+
+    Observations only increment counters, so the training loop never
+    waits on a scrape; a scrape may see a bucket one observation ahead
+    of the sum, which Prometheus tolerates.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+
+    def lines(self, name):
+        lines, total = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), list(self.counts)):
+            total += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, total))
+        lines.append('{}_sum {}'.format(name, self.sum))
+        lines.append('{}_count {}'.format(name, total))
+        return lines
+
+
+class MetricsEndpoint(object):
+    """Prometheus text endpoint for a running server, on localhost.
+
+    Values are read from the live server and its Record at scrape time
+    and durations are collected through span observers, so nothing is
+    locked or copied on the training side. Served from a daemon thread
+    at http://<host>:<port>/metrics.
+    """
+
+    def __init__(self, server, host='127.0.0.1', port=9100):
+        self.server = server
+        self.started = time.time()
+        # Span or metric observed -> histogram
+        self.histograms = [
+            ('aggregation', 'flsim_aggregation_seconds',
+             'Wall time of aggregations into the global model.', Histogram()),
+            ('aggregation.buffer', 'flsim_aggregation_buffer_seconds',
+             'Wall time of folding one client update into the async buffer.', Histogram()),
+            ('ns3.wall', 'flsim_ns3_run_seconds', 'Wall time of ns-3 runs.', Histogram()),
+        ]
+        for name, _, _, histogram in self.histograms:
+            spans.observe(name, histogram.observe)
+
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = endpoint.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('Metrics: ' + format, *args)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info('Serving metrics: http://{}:{}/metrics'.format(*self.httpd.server_address[:2]))
+
+    def close(self):
+        for name, _, _, histogram in self.histograms:
+            spans.unobserve(name, histogram.observe)
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def render(self):
+        server = self.server
+        records = getattr(server, 'records', None)
+        network = getattr(server, 'network', None)
+        trained = getattr(server, 'clients_trained', 0)
+        elapsed = time.time() - self.started
+
+        lines = []
+
+        def add(name, kind, help, value):
+            if value is None:
+                return
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            lines.append('{} {}'.format(name, float(value)))
+
+        add('flsim_rounds_total', 'counter', 'Rounds completed.',
+            getattr(server, 'rounds_completed', None))
+        add('flsim_clients_trained_total', 'counter', 'Client updates received.', trained)
+        add('flsim_clients_trained_per_second', 'gauge',
+            'Client updates received per wall second.', trained / elapsed if elapsed else None)
+        if records is not None:
+            add('flsim_simulated_time_seconds', 'gauge', 'Simulated time T of the latest record.',
+                records.get_latest_t())
+            add('flsim_accuracy', 'gauge', 'Latest recorded global accuracy.',
+                records.get_latest_acc())
+            add('flsim_throughput_kbps', 'gauge', 'Latest recorded throughput (kB/s).',
+                records.last_throughput)
+            add('flsim_dropouts', 'gauge', 'Clients dropped in the latest round.',
+                records.last_dropout)
+            add('flsim_dropouts_total', 'counter', 'Clients dropped over all rounds.',
+                records.dropouts)
+        if network is not None:
+            add('flsim_ns3_runs_total', 'counter', 'ns-3 runs finished.',
+                network.run_totals['runs'])
+            add('flsim_ns3_timeouts_total', 'counter', 'ns-3 runs cut off by the timeout.',
+                network.run_totals['timeouts'])
+        add('process_resident_memory_bytes', 'gauge', 'Resident memory of the server process.',
+            rss_bytes())
+
+        for _, metric, help, histogram in self.histograms:
+            lines.append('# HELP {} {}'.format(metric, help))
+            lines.append('# TYPE {} histogram'.format(metric))
+            lines.extend(histogram.lines(metric))
+        return '\n'.join(lines) + '\n'
@@ -1,122 +1,222 @@
 import numpy as np
 import csv
+import os
+import shutil
+import tempfile
+import time
+import logging
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+from utils.pca import StreamingPCA  # pylint: disable=no-name-in-module
+from utils.sketch import CountSketch  # pylint: disable=no-name-in-module
 
 class Record(object):
-    """Accuracy records."""
-    def __init__(self):
-        self.t = []
-        self.acc = []
-        self.throughput = []
-        self.dropout = []
-        self.round = []
+    """Accuracy records, streamed to CSV files as they are appended.
+
+    Time rows (time, acc, throughput) go to path and round rows (rounds,
+    dropouts, clients that did not finish) to path + '_dropouts.csv'.
+    Writes are buffered and synced to disk every fsync_interval seconds,
+    so an interrupted run keeps its records and the files can be tailed
+    live. Only the latest values are kept in memory. Without a path the
+    files go to a temporary directory, removed with the Record.
+    """
+    def __init__(self, path=None, fsync_interval=5.0):
+        self.tmpdir = None
+        if path is None:
+            self.tmpdir = tempfile.TemporaryDirectory(prefix='record_')
+            path = os.path.join(self.tmpdir.name, 'record.csv')
+        self.path = path
+        self.rounds_path = path + '_dropouts.csv'
+        self.fsync_interval = fsync_interval
+        self.last_sync = time.time()
+
+        self.files = [open(self.path, 'w', newline=''),
+                      open(self.rounds_path, 'w', newline='')]
+        self.time_writer, self.round_writer = [csv.writer(f) for f in self.files]
+        self.time_writer.writerow(['time', 'acc', 'throughput'])
+        self.round_writer.writerow(['rounds', 'dropouts', 'clients'])
+        logging.info('Recording accuracy: {}'.format(self.path))
+
+        self.count = 0
+        self.last_t = None
         self.alpha = 0.1
         self.last_acc = 0
+        self.last_throughput = None
+
+        self.rounds = 0
+        self.last_dropout = None
+        self.dropouts = 0
+
+    def __len__(self):
+        # Number of accuracy records
+        return self.count
+
+    def write(self, writer, row):
+        writer.writerow(row)
+        if time.time() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        for f in self.files:
+            if not f.closed:
+                f.flush()
+                os.fsync(f.fileno())
+        self.last_sync = time.time()
+
+    def close(self):
+        # Files stay readable, e.g. by save_record and plot_record
+        self.sync()
+        for f in self.files:
+            f.close()
 
-    def append_record(self, t, acc, throughput, dropout, round_num):
-        self.t.append(t)
-        self.throughput.append(throughput)
-        self.dropout.append(dropout)
-        self.round.append(round_num)
-        self.acc.append(acc)
+    def append_record(self, t, acc, throughput, dropout, round_num, clients=()):
+        self.write(self.time_writer, [t, acc, throughput])
+        self.async_round_graphs(round_num, dropout, clients)
         #if len(self.acc) == 0:
         #    self.acc.append(acc)
         #else:
         #    self.acc.append((1 - self.alpha) * self.last_acc + \
         #                    self.alpha * acc)
-        self.last_acc = self.acc[-1]
+        self.count += 1
+        self.last_t = t
+        self.last_acc = acc
+        self.last_throughput = throughput
 
     def async_time_graphs(self, t, acc, throughput):
-        self.t.append(t)
-        self.throughput.append(throughput)
-        if len(self.acc) == 0:
-            self.acc.append(acc)
-        else:
-            self.acc.append((1 - self.alpha) * self.last_acc + \
-                    self.alpha * acc)
-        self.last_acc = self.acc[-1]
-
-    def async_round_graphs(self, round_num, dropout):
-        self.round.append(round_num)
-        self.dropout.append(dropout)
+        if self.count:
+            acc = (1 - self.alpha) * self.last_acc + self.alpha * acc
+        self.write(self.time_writer, [t, acc, throughput])
+        self.count += 1
+        self.last_t = t
+        self.last_acc = acc
+        self.last_throughput = throughput
+
+    def async_round_graphs(self, round_num, dropout, clients=()):
+        self.write(self.round_writer, [round_num, dropout, ' '.join(map(str, clients))])
+        self.rounds += 1
+        self.last_dropout = dropout
+        self.dropouts += dropout
 
     def get_latest_t(self):
-        return self.t[-1]
+        return self.last_t
 
     def get_latest_acc(self):
-        return self.acc[-1]
+        # Accuracy may still be pending in the background evaluator
+        return self.last_acc if self.count else None
+
+    def read(self):
+        """Columns of both record files, read back from disk."""
+        self.sync()
+        columns = {}
+        for path in [self.path, self.rounds_path]:
+            with open(path, newline='') as f:
+                rows = list(csv.reader(f))
+            for i, field in enumerate(rows[0]):
+                values = [row[i] for row in rows[1:]]
+                columns[field] = values if field == 'clients' else \
+                    np.array(values, dtype=np.float64)
+        return columns
 
     def save_record(self, filename):
-        assert (len(self.t) == len(self.acc)), \
-            "Length of time and acc records do not match! t {} acc {}".format(
-                len(self.t), len(self.acc)
-            )
-        assert (len(self.t) == len(self.throughput)), \
-            "Length of time and throughput records do not match! t {} throughput {}".format(
-                len(self.t), len(self.throughput)
-            )
-        assert (len(self.dropout) == len(self.round)), \
-            "Length of dropouts and rounds records do not match! t {} acc {}".format(
-                len(self.dropout), len(self.round)
-            )
-        rounds = np.expand_dims(np.array(self.round), axis=1)
-        t = np.expand_dims(np.array(self.t), axis=1)
-        acc = np.expand_dims(np.array(self.acc), axis=1)
-        throughput = np.expand_dims(np.array(self.throughput), axis=1)
-        dropouts = np.expand_dims(np.array(self.dropout), axis=1)
-
-        rows = np.concatenate((t, acc, throughput), axis=1).tolist()
-
-        fields = ['time', 'acc', 'throughput']
-        with open(filename, 'w') as f:
-            write = csv.writer(f)
-            write.writerow(fields)
-            for row in rows:
-                write.writerow(row)
-
-        rows2 = np.concatenate((rounds, dropouts), axis=1).tolist()
-        fields2 = ['rounds', 'dropouts']
-        filename2 = filename + "_dropouts.csv"
-        with open(filename2, 'w') as f:
-            write = csv.writer(f)
-            write.writerow(fields2)
-            for row in rows2:
-                write.writerow(row)
+        self.sync()
+        if os.path.abspath(filename) != os.path.abspath(self.path):
+            shutil.copyfile(self.path, filename)
+            shutil.copyfile(self.rounds_path, filename + "_dropouts.csv")
 
     def plot_record(self, figname):
-        assert (len(self.t) == len(self.acc)), \
-            "Length of time and acc records do not match!"
+        columns = self.read()
 
         fig = plt.figure(figsize=(8, 10))
         plt.subplot(311)
-        plt.plot(self.t, self.acc, label='global acc')
+        plt.plot(columns['time'], columns['acc'], label='global acc')
         plt.xlabel('Time (s)')
         plt.ylabel('Accuracy (%)')
         plt.legend()
 
         plt.subplot(312)
-        plt.plot(self.t, self.throughput, label='throughput')
+        plt.plot(columns['time'], columns['throughput'], label='throughput')
         plt.xlabel('Time (s)')
         plt.ylabel('Throughput (kB/s)')
         plt.legend()
 
         plt.subplot(313)
-        plt.bar(self.round, self.dropout)
+        plt.bar(columns['rounds'], columns['dropouts'])
         plt.xlabel('Round')
         plt.ylabel('Client drop out')
         plt.savefig(figname)
         plt.close(fig)
 
+
+class WeightStore(object):
+    """Latest flattened weights of each client in a memory-mapped array.
+
+    Rows hold float32 or float16 copies, or a count sketch of sketch_dim
+    entries ('sketch'). The row width is fixed by the first write, so the
+    store takes num_clients rows of it on disk and only touched pages in
+    memory. Without a path it lives in an anonymous temporary file.
+    """
+    def __init__(self, num_clients, store='float32', sketch_dim=256, path=None):
+        self.num_clients = num_clients
+        self.store = store
+        self.sketch_dim = sketch_dim
+        self.path = path
+        self.filled = np.zeros(num_clients, dtype=bool)
+        self.array = None
+        self.sketch = None
+
+    def __len__(self):
+        return self.num_clients
+
+    def __getitem__(self, client_idx):
+        # Empty until the client reports, as the former list of weights
+        if not self.filled[client_idx]:
+            return np.empty(0, dtype=np.float32)
+        return np.asarray(self.array[client_idx], dtype=np.float32)
+
+    def open(self, dim):
+        width, dtype = dim, np.float32
+        if self.store == 'sketch':
+            self.sketch = CountSketch(dim, self.sketch_dim)
+            width = self.sketch_dim
+        elif self.store == 'float16':
+            dtype = np.float16
+
+        self.array = np.memmap(self.path or tempfile.TemporaryFile(), dtype=dtype,
+                               mode='w+', shape=(self.num_clients, width))
+
+    def write(self, client_idx, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.array is None:
+            self.open(vectors.shape[1])
+        if self.sketch is not None:
+            vectors = self.sketch.transform(vectors)
+
+        self.array[client_idx] = vectors
+        self.filled[client_idx] = True
+        return vectors
+
+    def rows(self, client_idx=None):
+        """Indices and weights of the given, or all reported, clients."""
+        if client_idx is None:
+            client_idx = np.flatnonzero(self.filled)
+        if self.array is None:
+            return client_idx, np.empty((0, 0), dtype=np.float32)
+        return client_idx, np.asarray(self.array[client_idx], dtype=np.float32)
+
+
 class Profile(object):
     """Clients' loss and delay profile"""
-    def __init__(self, num_clients):
+    def __init__(self, num_clients, store='float32', sketch_dim=256, path=None):
         self.loss = np.repeat(-1., num_clients)
         self.delay = np.repeat(-1., num_clients)
         self.primary_label = np.repeat(-1., num_clients)
         self.alpha = 0.1
-        self.weights = [[]] * num_clients
+        self.weights = WeightStore(num_clients, store, sketch_dim, path)
+
+        # PCA basis fitted as profiles arrive, frozen at the first plot,
+        # and the 2D projection of every profile since its last update
+        self.pca = StreamingPCA(n_components=2)
+        self.projected = np.zeros((num_clients, 2))
+        self.stale = np.zeros(num_clients, dtype=bool)
 
     def set_primary_label(self, pref_str):
         """
@@ -127,14 +227,40 @@ class Profile(object):
         self.primary_label = np.array(pref_str)
 
     def update(self, client_idx, loss, delay, flatten_weights):
-        if self.loss[client_idx] > 0:
-            # Not the first profile
-            self.delay[client_idx] = (1 - self.alpha) * self.delay[client_idx] + \
-                self.alpha * delay
-        else:
-            self.delay[client_idx] = delay
+        self.update_many([client_idx], [loss], [delay], [flatten_weights])
+
+    def update_many(self, client_idx, loss, delay, flatten_weights):
+        """Update the profiles of several clients at once."""
+        client_idx = np.asarray(client_idx, dtype=np.int64)
+        delay = np.asarray(delay, dtype=np.float64)
+
+        # EMA of the delay, except for a client's first profile
+        profiled = self.loss[client_idx] > 0
+        self.delay[client_idx] = np.where(
+            profiled, (1 - self.alpha) * self.delay[client_idx] + self.alpha * delay, delay)
         self.loss[client_idx] = loss
-        self.weights[client_idx] = flatten_weights
+        stored = self.weights.write(client_idx, np.stack(flatten_weights))
+
+        self.pca.partial_fit(stored)
+        self.stale[client_idx] = True
+
+    def project(self, path):
+        """2D PCA coordinates of all profiled clients."""
+        if not self.pca.frozen:
+            self.pca.flush()
+            if not self.pca.fitted:
+                return None, None
+            self.pca.freeze()
+            self.pca.save(path + '/pca_basis.pkl')
+
+        # Only transform profiles updated since the last projection
+        update_idx = np.flatnonzero(self.stale)
+        if len(update_idx):
+            self.projected[update_idx] = self.pca.transform(self.weights.rows(update_idx)[1])
+            self.stale[update_idx] = False
+
+        client_idx = np.flatnonzero(self.weights.filled)
+        return client_idx, self.projected[client_idx]
 
     def plot(self, T, path):
         """
@@ -164,16 +290,13 @@ class Profile(object):
         plt.savefig(path + '/ld_{}.png'.format(T))
         plt.close(fig)
 
-        w_array, l_list = [], []
-        for i in range(len(self.weights)):
-            if len(self.weights[i]) > 0:  # weight is not empty
-                w_array.append(self.weights[i])
-                l_list.append(self.primary_label[i])
-        w_array, l_array = np.array(w_array), np.array(l_list)
-        w_array = StandardScaler().fit_transform(w_array)
-
-        pca = PCA(n_components=2)
-        pc = pca.fit_transform(w_array)
+        # Clients with a weights profile
+        client_idx, pc = self.project(path)
+        if client_idx is None:
+            logging.info('Too few weight profiles for PCA')
+            return
+        l_array = self.primary_label[client_idx]
+        l_list = l_array.tolist()
 
         fig = plt.figure()
         cmap = get_cmap(len(list(set(l_list))))
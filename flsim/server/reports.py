@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import pickle
+import numpy as np
+import torch
+from .trace import flatten
+
+
+class ReportWriter(object):
+    """Append-only store of per-round client and global weights.
+
+    Every save_reports call writes one segment, an .npy array that is
+    filled through a memory map: row 0 holds the global weights after
+    the round, the other rows the weights reported by its clients. With
+    delta encoding, client rows are stored relative to the global weights
+    of the previous segment. A JSON line per segment in index.jsonl is
+    written once the segment is complete, so an interrupted run keeps all
+    earlier rounds. Files in the report directory:
+      - layout.json: weight names, shapes, dtype and encoding
+      - index.jsonl: round, client ids and file of each segment
+      - segment_<n>.npy: the weights of one segment
+    """
+
+    def __init__(self, path, weights, dtype='float32', delta=False):
+        if os.path.isfile(path):
+            raise ValueError('Report store {} is a file, likely a pickle of an older '
+                             'run; set paths.reports to a directory'.format(path))
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.delta = delta
+
+        layout = {
+            'names': [name for name, _ in weights],
+            'shapes': [list(weight.shape) for _, weight in weights],
+            'dtype': self.dtype.name,
+            'delta': delta,
+        }
+        with open(os.path.join(path, 'layout.json'), 'w') as f:
+            json.dump(layout, f)
+
+        self.index = open(os.path.join(path, 'index.jsonl'), 'w')
+        self.segments = 0
+        self.previous = None  # Global weights of the previous segment
+
+        logging.info('Saving reports: {}'.format(path))
+
+    def append(self, round, reports, weights):
+        # One segment of the global weights and the client reports
+        w_global = flatten(weights)
+        rows = [flatten(report.weights) for report in reports]
+        if self.delta and self.previous is not None:
+            rows = [row - self.previous for row in rows]
+
+        filename = 'segment_{}.npy'.format(self.segments)
+        segment = np.lib.format.open_memmap(
+            os.path.join(self.path, filename), mode='w+', dtype=self.dtype,
+            shape=(1 + len(rows), len(w_global)))
+        segment[0] = w_global
+        for i, row in enumerate(rows):
+            segment[1 + i] = row
+        segment.flush()
+        del segment
+
+        entry = {
+            'segment': self.segments,
+            'round': self.segments if round is None else round,
+            'clients': [report.client_id for report in reports],
+            'file': filename,
+            'delta': bool(self.delta and self.previous is not None),
+        }
+        self.index.write(json.dumps(entry) + '\n')
+        self.index.flush()
+
+        self.segments += 1
+        # As stored, so deltas decode against exactly what readers see
+        self.previous = w_global.astype(self.dtype).astype(np.float32)
+
+    def close(self):
+        self.index.close()
+        logging.info('Saved reports: {} ({} segments)'.format(self.path, self.segments))
+
+
+class ReportReader(object):
+    """Random access to a report store by (round, client_id)."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'layout.json')) as f:
+            self.layout = json.load(f)
+
+        # Complete segments only, in order
+        self.entries = []
+        with open(os.path.join(path, 'index.jsonl')) as f:
+            for line in f:
+                if line.endswith('\n'):
+                    self.entries.append(json.loads(line))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def segment(self, i):
+        return np.load(os.path.join(self.path, self.entries[i]['file']), mmap_mode='r')
+
+    def rounds(self):
+        """Round of each segment, in order."""
+        return [entry['round'] for entry in self.entries]
+
+    def clients(self, round):
+        return [client_id for entry in self.entries if entry['round'] == round
+                for client_id in entry['clients']]
+
+    def global_weights(self, round):
+        """Global weights after the last segment of a round."""
+        i = max(i for i, entry in enumerate(self.entries) if entry['round'] == round)
+        return np.array(self.segment(i)[0], dtype=np.float32)
+
+    def __getitem__(self, key):
+        """Weights reported by client_id in the last segment of round."""
+        round, client_id = key
+        for i in reversed(range(len(self.entries))):
+            entry = self.entries[i]
+            if entry['round'] == round and client_id in entry['clients']:
+                row = np.array(self.segment(i)[1 + entry['clients'].index(client_id)],
+                                 dtype=np.float32)
+                if entry['delta']:
+                    row = row + np.asarray(self.segment(i - 1)[0], dtype=np.float32)
+                return row
+        raise KeyError(key)
+
+    def unflatten(self, vector):
+        # Split a flat vector back into (name, tensor) weights
+        weights, offset = [], 0
+        vector = torch.from_numpy(np.asarray(vector, dtype=np.float32))
+        for name, shape in zip(self.layout['names'], self.layout['shapes']):
+            size = int(np.prod(shape))
+            weights.append((name, vector[offset:offset + size].reshape(shape).clone()))
+            offset += size
+        return weights
+
+
+def load_reports(path):
+    """ReportReader of a report store, or the pickled reports of older runs."""
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    return ReportReader(path)
@@ -8,6 +8,14 @@ import sys
 from threading import Thread
 import torch
 import utils.dists as dists  # pylint: disable=no-name-in-module
+from utils.compression import get_compressor  # pylint: disable=no-name-in-module
+from utils.profiling import profiler  # pylint: disable=no-name-in-module
+from utils.spans import spans  # pylint: disable=no-name-in-module
+from .evaluator import Evaluator, EvaluationWorker
+from .memory import MemoryAccounting
+from .metrics import MetricsEndpoint
+from .reports import ReportWriter
+from .trace import TraceWriter
 
 
 class Server(object):
@@ -26,10 +34,28 @@ class Server(object):
         # Add fl_model to import path
         sys.path.append(model_path)
 
+        if self.config.paths.spans:
+            spans.open(self.config.paths.spans)
+        if self.config.profiler.path:
+            profiler.configure(**self.config.profiler._asdict())
+
+        # Progress counters, served by the metrics endpoint if enabled
+        self.rounds_completed = 0
+        self.clients_trained = 0
+        self.metrics = None
+        if self.config.metrics.port is not None:
+            self.metrics = MetricsEndpoint(self, self.config.metrics.host, self.config.metrics.port)
+        memory = self.config.memory
+        self.memory = None
+        if memory.track or memory.rss_threshold is not None:
+            self.memory = MemoryAccounting(self, memory.interval, memory.rss_threshold, memory.top)
+
         # Set up simulated server
         self.load_data()
         self.load_model()
         self.make_clients(total_clients)
+        self.load_compressor()
+        self.open_trace()
 
     def load_data(self):
         import fl_model  # pylint: disable=import-error
@@ -60,6 +86,12 @@ class Server(object):
         logging.info('Loader: {}, IID: {}'.format(
             self.config.loader, self.config.data.IID))
 
+        # Set up server-side evaluation on the testset
+        self.evaluator = Evaluator(config, self.loader.get_testset())
+        self.eval_worker = None
+        if getattr(config.evaluation, 'background', False) and not config.clients.do_test:
+            self.eval_worker = EvaluationWorker(self.evaluator, config.paths.model)
+
     def load_model(self):
         import fl_model  # pylint: disable=import-error
 
@@ -74,10 +106,13 @@ class Server(object):
 
         # Extract flattened weights (if applicable)
         if self.config.paths.reports:
-            self.saved_reports = {}
+            self.open_reports()
             self.save_reports(0, [])  # Save initial model
 
     def make_clients(self, num_clients):
+        if self.config.clients.lazy:
+            return self.make_lazy_clients(num_clients)
+
         IID = self.config.data.IID
         labels = self.loader.labels
         loader = self.config.loader
@@ -90,12 +125,15 @@ class Server(object):
             }[self.config.clients.label_distribution]
             random.shuffle(dist)  # Shuffle distribution
 
-        # Make simulated clients
+        # Make simulated clients, their scalars kept in one table
+        self.client_table = client.ClientTable(
+            num_clients, labels, explore=self.config.clients.explore,
+            epsilon=self.config.clients.epsilon, choices=self.config.clients.choices)
         clients = []
         for client_id in range(num_clients):
 
             # Create new client
-            new_client = client.Client(client_id)
+            new_client = client.Client(client_id, self.client_table)
 
             if not IID:  # Configure clients for non-IID data
                 if self.config.data.bias:
@@ -130,11 +168,54 @@ class Server(object):
 
         self.clients = clients
 
+    def make_lazy_clients(self, num_clients):
+        # Population defined by a seed, clients built when first selected
+        labels = self.loader.labels
+        per_round = self.config.clients.per_round
+        self.client_rng = np.random.default_rng(self.config.clients.seed)
+        self.client_table = client.ClientTable(
+            num_clients, labels, explore=self.config.clients.explore,
+            epsilon=self.config.clients.epsilon, choices=self.config.clients.choices)
+
+        if not self.config.data.IID:
+            if self.config.loader != 'bias':
+                raise ValueError('Lazy clients need the basic or bias loader')
+
+            # Draw label preferences for the whole population at once, from
+            # the population seed only
+            label_dist = {
+                "uniform": dists.uniform,
+                "normal": dists.normal
+            }[self.config.clients.label_distribution]
+            dist = np.array(label_dist(num_clients, len(labels), self.client_rng),
+                            dtype=np.float64)
+            dist = self.client_rng.permutation(dist)
+            self.client_table.pref[:] = self.client_rng.choice(
+                len(labels), num_clients, p=dist / dist.sum())
+
+        resident = max(self.config.clients.resident or per_round, per_round)
+        self.clients = client.ClientPopulation(
+            self.client_table, self.materialize_client, resident)
+
+        logging.info('Total clients: {} (lazy, {} resident)'.format(
+            num_clients, resident))
+
+    def materialize_client(self, new_client):
+        # Derive a lazy client deterministically from the population seed
+        rng = random.Random('{}-{}'.format(
+            self.config.clients.seed, new_client.client_id))
+
+        if self.config.data.bias:
+            new_client.set_bias(new_client.pref, self.config.data.bias)
+        if not np.isnan(new_client.speed_mean):
+            new_client.set_link(self.config)
+        if self.config.data.loading == 'static':
+            self.set_client_data(new_client, rng)
+
     # Run federated learning
     def run(self):
         rounds = self.config.fl.rounds
         target_accuracy = self.config.fl.target_accuracy
-        reports_path = self.config.paths.reports
 
         if target_accuracy:
             logging.info('Training: {} rounds or {}% accuracy\n'.format(
@@ -147,26 +228,35 @@ class Server(object):
             logging.info('**** Round {}/{} ****'.format(round, rounds))
 
             # Run the federated learning round
+            spans.begin_round(round)
             accuracy = self.round()
+            self.end_round(round)
 
             # Break loop when target accuracy is met
-            if target_accuracy and (accuracy >= target_accuracy):
+            if target_accuracy and self.target_reached(accuracy, target_accuracy):
                 logging.info('Target accuracy reached.')
                 break
 
-        if reports_path:
-            with open(reports_path, 'wb') as f:
-                pickle.dump(self.saved_reports, f)
-            logging.info('Saved reports: {}'.format(reports_path))
+        self.finish()
+
+    def end_round(self, round, T_old=None, T_new=None):
+        # Per-round span breakdown and memory peaks
+        if self.memory:
+            self.memory.end_round(round)
+        spans.end_round(T_old, T_new)
+        self.rounds_completed += 1
 
     def round(self):
         import fl_model  # pylint: disable=import-error
 
         # Select clients to participate in the round
-        sample_clients = self.selection()
+        with spans.span('selection'):
+            sample_clients = self.selection()
+        self.mark_base()
 
         # Configure sample clients
-        self.configuration(sample_clients)
+        with spans.span('configuration'):
+            self.configuration(sample_clients)
 
         # Run clients using multithreading for better parallelism
         threads = [Thread(target=client.run) for client in sample_clients]
@@ -175,17 +265,20 @@ class Server(object):
 
         # Recieve client updates
         reports = self.reporting(sample_clients)
+        self.trace_reports(reports)
 
         # Perform weight aggregation
         logging.info('Aggregating updates')
-        updated_weights = self.aggregation(reports)
+        with spans.span('aggregation'):
+            updated_weights = self.aggregation(reports)
 
-        # Load updated weights
-        fl_model.load_weights(self.model, updated_weights)
+            # Load updated weights
+            fl_model.load_weights(self.model, updated_weights)
 
-        # Extract flattened weights (if applicable)
+        # Save client and global weights (if applicable), numbering the
+        # segments by call order
         if self.config.paths.reports:
-            self.save_reports(round, reports)
+            self.save_reports(None, reports)
 
         # Save updated global model
         self.save_model(self.model, self.config.paths.model)
@@ -194,12 +287,10 @@ class Server(object):
         if self.config.clients.do_test:  # Get average accuracy from client reports
             accuracy = self.accuracy_averaging(reports)
         else:  # Test updated model on server
-            testset = self.loader.get_testset()
-            batch_size = self.config.fl.batch_size
-            testloader = fl_model.get_testloader(testset, batch_size)
-            accuracy = fl_model.test(self.model, testloader)
+            accuracy = self.evaluate()
 
-        logging.info('Average accuracy: {:.2f}%\n'.format(100 * accuracy))
+        if accuracy is not None:  # Not evaluated in the background
+            logging.info('Average accuracy: {:.2f}%\n'.format(100 * accuracy))
         return accuracy
 
     # Federated learning phases
@@ -209,8 +300,8 @@ class Server(object):
         clients_per_round = self.config.clients.per_round
 
         # Select clients randomly
-        sample_clients = [client for client in random.sample(
-            self.clients, clients_per_round)]
+        sample_clients = [self.clients[i] for i in
+                          self.client_table.select('random', clients_per_round)]
 
         return sample_clients
 
@@ -232,14 +323,28 @@ class Server(object):
             config = self.config
 
             # Continue configuraion on client
+            client.compressor = self.compressor
             client.configure(config)
 
     def reporting(self, sample_clients):
+        import fl_model  # pylint: disable=import-error
+
         # Recieve reports from sample clients
         reports = [client.get_report() for client in sample_clients]
 
         logging.info('Reports recieved: {}'.format(len(reports)))
         assert len(reports) == len(sample_clients)
+        self.clients_trained += len(reports)
+        if self.memory:
+            self.memory.sample()
+
+        # Decode compressed updates against the weights clients trained from
+        if self.compressor:
+            base_weights = getattr(self, 'base_weights', None) or \
+                fl_model.extract_weights(self.model)
+            for report in reports:
+                report.weights = self.compressor.decompress(report.update, base_weights)
+                report.update = None
 
         return reports
 
@@ -301,6 +406,60 @@ class Server(object):
 
         return updated_weights
 
+    def evaluate(self, T=None, callback=None):
+        """Test the global model at simulated time T.
+
+        The accuracy is passed to callback once known and returned, or None
+        is returned while the background worker evaluates the snapshot.
+        """
+        with spans.span('evaluation'):
+            due = self.evaluator.due(T)
+
+            if self.eval_worker:  # Hand the snapshot off to the evaluation process
+                self.eval_worker.submit(self.model if due else None, T, callback)
+                if due:
+                    self.evaluator.mark(T)
+                return None
+
+            if due:
+                accuracy = self.evaluator.evaluate(self.model, T)
+            else:  # Keep the latest accuracy
+                logging.info('Evaluation skipped, latest accuracy carried forward')
+                accuracy = self.evaluator.accuracy
+
+            if callback is not None:
+                callback(accuracy)
+            return accuracy
+
+    def target_reached(self, accuracy, target_accuracy):
+        # With background evaluation decide on the newest result, waiting
+        # only when results fall too far behind
+        if self.eval_worker:
+            self.eval_worker.wait(self.evaluator.lag)
+            accuracy = self.evaluator.accuracy
+
+        if accuracy is None:
+            return False
+        return self.evaluator.reached(self.model, accuracy, target_accuracy)
+
+    def finish(self):
+        # Collect outstanding background evaluations, close the trace and records
+        if self.eval_worker:
+            self.eval_worker.close()
+            self.eval_worker = None
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+        if getattr(self, 'report_store', None):
+            self.report_store.close()
+            self.report_store = None
+        if getattr(self, 'records', None):
+            self.records.close()
+        spans.close()
+        if getattr(self, 'metrics', None):
+            self.metrics.close()
+            self.metrics = None
+
     def accuracy_averaging(self, reports):
         # Get total number of samples
         total_samples = sum([report.num_samples for report in reports])
@@ -316,13 +475,10 @@ class Server(object):
     @staticmethod
     def flatten_weights(weights):
         # Flatten weights into vectors
-        weight_vecs = []
-        for _, weight in weights:
-            weight_vecs.extend(weight.flatten().tolist())
-
-        return np.array(weight_vecs)
+        return np.concatenate([weight.detach().cpu().numpy().ravel()
+                               for _, weight in weights])
 
-    def set_client_data(self, client):
+    def set_client_data(self, client, rng=None):
         loader = self.config.loader
 
         # Get data partition size
@@ -331,13 +487,14 @@ class Server(object):
                 partition_size = self.config.data.partition.get('size')
             elif self.config.data.partition.get('range'):
                 start, stop = self.config.data.partition.get('range')
-                partition_size = random.randint(start, stop)
+                partition_size = (rng or random).randint(start, stop)
 
-        # Extract data partition for client
+        # Extract data partition for client, sampled without using it up
+        # when rng seeds a lazy client
         if loader == 'basic':
-            data = self.loader.get_partition(partition_size)
+            data = self.loader.get_partition(partition_size, rng)
         elif loader == 'bias':
-            data = self.loader.get_partition(partition_size, client.pref)
+            data = self.loader.get_partition(partition_size, client.pref, rng)
         elif loader == 'shard':
             data = self.loader.get_partition()
         else:
@@ -346,18 +503,62 @@ class Server(object):
         # Send data to client
         client.set_data(data, self.config)
 
+    def load_compressor(self):
+        import fl_model  # pylint: disable=import-error
+
+        # Set up client update compression (if applicable)
+        self.compressor = get_compressor(self.config)
+        if self.compressor:
+            numel = sum(weight.numel() for _, weight in fl_model.extract_weights(self.model))
+            self.compressor.estimate(numel)
+            logging.info('Update compression: {}'.format(self.compressor))
+
+    def upload_bytes(self):
+        # Bytes each client uploads, scaled down by update compression
+        model_bytes = self.config.model.size
+        if self.compressor:
+            model_bytes = int(round(model_bytes * self.compressor.ratio))
+        return model_bytes
+
+    def open_trace(self):
+        import fl_model  # pylint: disable=import-error
+
+        # Record client updates for aggregation-only replay (if applicable)
+        self.trace = None
+        trace = getattr(self.config, 'trace', None)
+        if trace and trace.path:
+            self.trace = TraceWriter(
+                trace.path, fl_model.extract_weights(self.model), trace.dtype)
+
+    def mark_base(self, version=None):
+        import fl_model  # pylint: disable=import-error
+
+        # Keep the global weights this round's clients train from
+        if self.compressor or self.trace:
+            self.base_weights = fl_model.extract_weights(self.model)
+        if self.trace:
+            self.trace.set_base(self.base_weights, version)
+
+    def trace_reports(self, reports, T=None):
+        if self.trace:
+            self.trace.record(reports, T)
+
     def save_model(self, model, path):
         path += '/global'
-        torch.save(model.state_dict(), path)
+        with spans.span('save_model'):
+            torch.save(model.state_dict(), path)
         logging.info('Saved global model: {}'.format(path))
 
-    def save_reports(self, round, reports):
+    def open_reports(self):
         import fl_model  # pylint: disable=import-error
 
-        if reports:
-            self.saved_reports['round{}'.format(round)] = [(report.client_id, self.flatten_weights(
-                report.weights)) for report in reports]
+        # Set up the on-disk report store at paths.reports
+        self.report_store = ReportWriter(
+            self.config.paths.reports, fl_model.extract_weights(self.model),
+            self.config.reports.dtype, self.config.reports.delta)
+
+    def save_reports(self, round, reports):
+        import fl_model  # pylint: disable=import-error
 
-        # Extract global weights
-        self.saved_reports['w{}'.format(round)] = self.flatten_weights(
-            fl_model.extract_weights(self.model))
+        # Append client weights and the global weights as one segment
+        self.report_store.append(round, reports, fl_model.extract_weights(self.model))
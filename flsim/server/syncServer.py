@@ -5,8 +5,9 @@ import math
 import time
 from threading import Thread
 from server import Server
-from network import Network
+from network import make_network
 from .record import Record, Profile
+from utils.spans import spans  # pylint: disable=no-name-in-module
 from ctypes import *
 
 
@@ -56,30 +57,34 @@ class SyncServer(Server):
         super().make_clients(num_clients)
 
         # Set link speed for clients
-        speed = []
-        for client in self.clients:
-            client.set_link(self.config)
-            speed.append(client.speed_mean)
+        if self.config.clients.lazy:  # Drawn at once, clients pick them up later
+            self.client_table.set_links(self.config, self.client_rng)
+        else:
+            for client in self.clients:
+                client.set_link(self.config)
+        speed = self.client_table.speed_mean
 
-        logging.info('Speed distribution: {} Kbps'.format([s for s in speed]))
+        logging.info('Speed distribution: {} Kbps'.format(
+            speed.tolist() if len(speed) <= 1000 else
+            'min {:.1f}, mean {:.1f}, max {:.1f}'.format(speed.min(), speed.mean(), speed.max())))
 
         # Initiate client profile of loss and delay
-        self.profile = Profile(num_clients)
+        profile = self.config.profile
+        self.profile = Profile(num_clients, profile.store, profile.sketch_dim, profile.path)
         if self.config.data.IID == False:
             print("Non IID")
-            self.profile.set_primary_label([client.pref for client in self.clients])
+            self.profile.set_primary_label(self.client_table.pref_labels())
 
     # Run synchronous federated learning
     def run(self):
         rounds = self.config.fl.rounds
         target_accuracy = self.config.fl.target_accuracy
-        reports_path = self.config.paths.reports
 
-        network = Network(self.config)  # create ns3 network/start ns3 program
+        network = self.network = make_network(self.config)  # create ns3 network/start ns3 program
         # dummy call to access
 
         # Init self accuracy records
-        self.records = Record()
+        self.records = Record(self.config.paths.records)
 
         if target_accuracy:
             logging.info('Training: {} rounds or {}% accuracy\n'.format(
@@ -95,21 +100,20 @@ class SyncServer(Server):
             logging.info('**** Round {}/{} ****'.format(round, rounds))
 
             # Run the sync federated learning round
+            spans.begin_round(round)
             accuracy, T_new = self.sync_round(round, T_old, network)
+            self.end_round(round, T_old, T_new)
             logging.info('Round finished at time {} s\n'.format(T_new))
 
             # Update time
             T_old = T_new
 
             # Break loop when target accuracy is met
-            if target_accuracy and (accuracy >= target_accuracy):
+            if target_accuracy and self.target_reached(accuracy, target_accuracy):
                 logging.info('Target accuracy reached.')
                 break
 
-        if reports_path:
-            with open(reports_path, 'wb') as f:
-                pickle.dump(self.saved_reports, f)
-            logging.info('Saved reports: {}'.format(reports_path))
+        self.finish()
 
         network.disconnect()
 
@@ -117,17 +121,20 @@ class SyncServer(Server):
         import fl_model  # pylint: disable=import-error
 
         # Select clients to participate in the round
-        sample_groups = self.selection(network)
+        with spans.span('selection'):
+            sample_groups = self.selection(network)
+        self.mark_base(T_old)
+        network.set_model_bytes(self.upload_bytes())
         sample_clients, throughput = [], []
         delays = []
-        dropouts = 0
+        dropped = []
         for group in sample_groups:
             parsed_clients = network.parse_clients(group.clients)
             simdata = network.sendRequest(requestType=1, array=parsed_clients)
             for client in group.clients:
                 if simdata[client.client_id]["roundTime"] < 0:
                     client.delay = 0
-                    dropouts = dropouts + 1
+                    dropped.append(client.client_id)
                     print("skip " + str(client.client_id))
                     print("roundTime" + str(simdata[client.client_id]["roundTime"]))
                     continue
@@ -143,12 +150,14 @@ class SyncServer(Server):
             self.throughput = sum([t for t in throughput]) / len(throughput)
         print("throughputs")
         print(throughput)
+        dropouts = len(dropped)
         print("dropouts: " + str(dropouts))
 
         logging.info('Avg throughput {} kB/s'.format(self.throughput))
 
         # Configure sample clients
-        self.configuration(sample_clients)
+        with spans.span('configuration'):
+            self.configuration(sample_clients)
 
         # Use the max delay in all sample clients as the delay in sync round
         # delays = network.access_network(sample_clients)
@@ -161,9 +170,12 @@ class SyncServer(Server):
         [t.start() for t in threads]
         [t.join() for t in threads]
         T_cur = T_old + max_delay  # Update current time
+        for client in sample_clients:
+            spans.sim('client', T_old, T_old + client.delay, client=client.client_id)
 
         # Receive client updates
         reports = self.reporting(sample_clients)
+        self.trace_reports(reports, T_cur)
 
         # Update profile and plot
         self.update_profile(reports)
@@ -174,10 +186,11 @@ class SyncServer(Server):
 
         # Perform weight aggregation
         logging.info('Aggregating updates')
-        updated_weights = self.aggregation(reports)
+        with spans.span('aggregation'):
+            updated_weights = self.aggregation(reports)
 
-        # Load updated weights
-        fl_model.load_weights(self.model, updated_weights)
+            # Load updated weights
+            fl_model.load_weights(self.model, updated_weights)
 
         # Extract flattened weights (if applicable)
         if self.config.paths.reports:
@@ -186,66 +199,42 @@ class SyncServer(Server):
         # Save updated global model
         self.save_model(self.model, self.config.paths.model)
 
+        # Record accuracy at this round's time, possibly after evaluating
+        # in the background
+        throughput = self.throughput
+
+        def record(accuracy):
+            logging.info('Average accuracy: {:.2f}%'.format(100 * accuracy))
+            self.records.append_record(T_cur, accuracy, throughput, dropouts, round, dropped)
+
         # Test global model accuracy
         if self.config.clients.do_test:  # Get average accuracy from client reports
             accuracy = self.accuracy_averaging(reports)
+            record(accuracy)
         else:  # Test updated model on server
-            testset = self.loader.get_testset()
-            batch_size = self.config.fl.batch_size
-            testloader = fl_model.get_testloader(testset, batch_size)
-            accuracy = fl_model.test(self.model, testloader)
+            accuracy = self.evaluate(T_cur, record)
 
-        logging.info('Average accuracy: {:.2f}%'.format(100 * accuracy))
-        self.records.append_record(T_cur, accuracy, self.throughput, dropouts, round)
-        return self.records.get_latest_acc(), self.records.get_latest_t()
+        return accuracy, T_cur
 
     def selection(self, network):
         # Select devices to participate in round
         clients_per_round = self.config.clients.per_round
         select_type = self.config.clients.selection
 
-        if select_type == 'random':
-        # Select clients randomly
-            sample_clients = [client for client in random.sample(
-                self.clients, clients_per_round)]
-            print("random")
-
-        elif select_type == 'short_latency_first':
-            # Select the clients with short latencies and random loss
-            sample_clients = sorted(self.clients, key=lambda c:c.est_delay)
-            sample_clients = sample_clients[:clients_per_round]
-            print(select_type)
-
-        elif select_type == 'high_loss_first':
-            # Select the clients with random latencies and high loss
-            sample_clients = sorted(self.clients, key=lambda c:c.loss, reverse = True)
-            sample_clients = sample_clients[:clients_per_round]
-            print(select_type)
-
-        elif select_type == 'short_latency_high_loss_first':
-            # Get the non-negative losses and delays
-            losses = [c.loss for c in self.clients]
-            losses_norm = [l/max(losses) for l in losses]
-            delays = [c.est_delay for c in self.clients]
-            delays_norm = [d/max(losses) for d in delays]
-
-            # Sort the clients by jointly consider latency and loss
-            gamma = 0.2
-            #0.2 for mnist
-            sorted_idx = sorted(range(len(self.clients)),
-                                key=lambda i: losses_norm[i] - gamma * delays_norm[i],
-                                reverse=True)
-            print([losses[i] for i in sorted_idx])
-            print([delays[i] for i in sorted_idx])
-            sample_clients = [self.clients[i] for i in sorted_idx]
-            sample_clients = sample_clients[:clients_per_round]
-            print(select_type)
+        # Score all clients at once from the client table
+        index = self.client_table.select(select_type, clients_per_round)
+        sample_clients = [self.clients[i] for i in index]
+        print(select_type)
+
         # In sync case, create one group of all selected clients
         sample_groups = [Group([client for client in sample_clients])]
 
         return sample_groups
 
     def update_profile(self, reports):
-        for report in reports:
-            self.profile.update(report.client_id, report.loss, report.delay,
-                                self.flatten_weights(report.weights))
+        if not reports:
+            return
+        self.profile.update_many([report.client_id for report in reports],
+                                 [report.loss for report in reports],
+                                 [report.delay for report in reports],
+                                 [self.flatten_weights(report.weights) for report in reports])
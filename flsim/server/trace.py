@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import numpy as np
+import torch
+
+
+# Per-update metadata rows
+META = np.dtype([
+    ('client_id', '<i8'),
+    ('version', '<f8'),  # Simulated time (or round) of the base snapshot
+    ('delay', '<f8'),
+    ('num_samples', '<i8'),
+    ('loss', '<f8'),
+    ('accuracy', '<f8'),  # NaN unless clients test locally
+    ('round', '<i8'),
+    ('time', '<f8'),  # Simulated time the update reached the server
+])
+
+
+def flatten(weights):
+    # Flatten (name, tensor) weights into one float32 vector
+    return torch.cat([weight.detach().cpu().reshape(-1).float()
+                      for _, weight in weights]).numpy()
+
+
+class TraceWriter(object):
+    """Append-only trace of client updates.
+
+    Each update is stored as the flattened difference between the client's
+    weights and the snapshot it trained from, so the trace can be replayed
+    against any global model. Files in the trace directory:
+      - layout.json: weight names, shapes and the update dtype
+      - initial.npy: initial global weights
+      - updates.bin: one update vector per row
+      - meta.bin: one META row per update
+    """
+
+    def __init__(self, path, weights, dtype='float32'):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+
+        layout = {
+            'names': [name for name, _ in weights],
+            'shapes': [list(weight.shape) for _, weight in weights],
+            'dtype': self.dtype.name,
+        }
+        with open(os.path.join(path, 'layout.json'), 'w') as f:
+            json.dump(layout, f)
+        np.save(os.path.join(path, 'initial.npy'), flatten(weights))
+
+        self.updates = open(os.path.join(path, 'updates.bin'), 'wb')
+        self.meta = open(os.path.join(path, 'meta.bin'), 'wb')
+        self.base, self.version = None, None
+        self.round = 0
+        self.count = 0
+
+        logging.info('Recording update trace: {}'.format(path))
+
+    def set_base(self, weights, version=None):
+        # Global weights the next round's updates are trained from
+        self.round += 1
+        self.version = self.round - 1 if version is None else version
+        self.base = flatten(weights)
+
+        # Keep completed rounds on disk
+        self.updates.flush()
+        self.meta.flush()
+
+    def record(self, reports, T=None):
+        for report in reports:
+            update = (flatten(report.weights) - self.base).astype(self.dtype)
+            self.updates.write(update.tobytes())
+
+            row = np.array([(report.client_id, self.version,
+                             getattr(report, 'delay', 0.),
+                             report.num_samples, getattr(report, 'loss', np.nan),
+                             getattr(report, 'accuracy', np.nan), self.round,
+                             np.nan if T is None else T)],
+                           dtype=META)
+            self.meta.write(row.tobytes())
+            self.count += 1
+
+    def close(self):
+        self.updates.close()
+        self.meta.close()
+        logging.info('Saved {} updates to trace: {}'.format(self.count, self.path))
+
+
+class TraceReader(object):
+    """Memory-mapped view of a recorded update trace."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'layout.json')) as f:
+            layout = json.load(f)
+        self.names = layout['names']
+        self.shapes = [tuple(shape) for shape in layout['shapes']]
+        self.dtype = np.dtype(layout['dtype'])
+
+        self.initial = np.load(os.path.join(path, 'initial.npy'))
+        self.meta = np.fromfile(os.path.join(path, 'meta.bin'), dtype=META)
+        self.updates = np.memmap(os.path.join(path, 'updates.bin'), dtype=self.dtype,
+                                 mode='r', shape=(len(self.meta), self.initial.size)) \
+            if len(self.meta) else np.zeros((0, self.initial.size), dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.meta)
+
+    def __getitem__(self, i):
+        return self.meta[i], self.updates[i]
+
+    def rounds(self):
+        # Group update indices by round, in recorded order
+        rounds = {}
+        for i, round in enumerate(self.meta['round']):
+            rounds.setdefault(int(round), []).append(i)
+        return rounds
+
+    def unflatten(self, vector):
+        # Split a flat vector back into (name, tensor) weights
+        weights, offset = [], 0
+        vector = torch.from_numpy(np.array(vector, dtype=np.float32))  # Rows are read-only
+        for name, shape in zip(self.names, self.shapes):
+            size = int(np.prod(shape))
+            weights.append((name, vector[offset:offset + size].reshape(shape).clone()))
+            offset += size
+        return weights
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules import each other from the repository root, as run.py does
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,64 @@
+import random
+import types
+
+import numpy as np
+
+from client import Client, ClientPopulation, ClientTable
+
+
+def test_new_clients_start_with_a_large_loss():
+    assert Client(0).loss == 10.0
+    assert Client(3, ClientTable(5)).loss == 10.0
+
+
+def test_rebuilt_client_keeps_its_row():
+    table = ClientTable(10)
+    built = []
+
+    def materialize(client):
+        built.append(client.client_id)
+
+    population = ClientPopulation(table, materialize, resident=2)
+    population[0].loss = 0.5
+    population[0].participation = 3
+    table.dirty.clear()
+
+    # Evict client 0, then build it again
+    population[1], population[2]
+    assert 0 not in population.clients
+    client = population[0]
+
+    assert built == [0, 1, 2, 0]
+    assert client.loss == 0.5 and table.loss[0] == 0.5
+    assert client.participation == 3
+    assert 0 not in table.dirty
+
+
+def test_resident_clients_are_reused():
+    population = ClientPopulation(ClientTable(4), lambda client: None, resident=4)
+    assert population[1] is population[1]
+    assert len(list(population)) == 4
+
+
+def lazy_table(label_distribution, seed, num_clients=103):
+    # Lazy population of a server with just the fields it is built from
+    from server.server import Server
+    clients = types.SimpleNamespace(
+        per_round=5, seed=seed, explore=None, epsilon=0.1, choices=None,
+        label_distribution=label_distribution, resident=None)
+    fake = types.SimpleNamespace(
+        loader=types.SimpleNamespace(labels=list(range(10))),
+        config=types.SimpleNamespace(clients=clients, data=types.SimpleNamespace(IID=False),
+                                     loader='bias'),
+        materialize_client=lambda client: None)
+    Server.make_lazy_clients(fake, num_clients)
+    return fake.client_table
+
+
+def test_lazy_preferences_follow_the_seed():
+    for label_distribution in ['uniform', 'normal']:
+        random.seed(1)
+        first = lazy_table(label_distribution, seed=7).pref
+        random.seed(2)  # Nothing in a run seeds the global random
+        assert np.array_equal(lazy_table(label_distribution, seed=7).pref, first)
+        assert not np.array_equal(lazy_table(label_distribution, seed=8).pref, first)
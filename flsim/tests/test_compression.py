@@ -0,0 +1,58 @@
+import types
+
+import pytest
+import torch
+
+from utils.compression import get_compressor
+
+
+METHODS = ['float32', 'fp16', 'int8', 'topk', 'random']
+
+
+def make_config(method, error_feedback=True, ratio=0.1):
+    compression = types.SimpleNamespace(method=method, ratio=ratio,
+                                        error_feedback=error_feedback, block=64)
+    return types.SimpleNamespace(compression=compression)
+
+
+def weights(vector):
+    return [('w', vector[:60].view(6, 10)), ('b', vector[60:])]
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_roundtrip_shapes(method):
+    compressor = get_compressor(make_config(method))
+    base = weights(torch.zeros(100))
+    client = types.SimpleNamespace(base_weights=base)
+    update = compressor.compress(client, weights(torch.randn(100)))
+    decompressed = compressor.decompress(update, base)
+    assert [name for name, _ in decompressed] == ['w', 'b']
+    assert decompressed[0][1].shape == (6, 10)
+    assert update.nbytes <= 4 * 100 + 8
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_error_feedback_residual_stays_bounded(method):
+    torch.manual_seed(0)
+    compressor = get_compressor(make_config(method))
+    client = types.SimpleNamespace(base_weights=weights(torch.zeros(100)))
+
+    norms = []
+    for _ in range(30):
+        compressor.compress(client, weights(torch.randn(100)))
+        norms.append(client.residual.norm().item())
+    # One round's update has norm about 10
+    assert max(norms) < 100
+
+
+def test_random_mask_is_unbiased_without_error_feedback():
+    torch.manual_seed(0)
+    compressor = get_compressor(make_config('random', error_feedback=False, ratio=0.5))
+    delta = torch.arange(1., 101.)
+    mean = torch.stack([compressor.decode(compressor.encode(delta)[0], 100)
+                        for _ in range(2000)]).mean(dim=0)
+    assert torch.allclose(mean, delta, rtol=0.15)
+
+
+def test_none_is_uncompressed():
+    assert get_compressor(make_config('none')) is None
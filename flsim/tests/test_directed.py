@@ -0,0 +1,92 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+import torch
+
+from server import DirectedServer, Server
+from utils.sketch import CountSketch
+
+
+@pytest.fixture(autouse=True)
+def fl_model(monkeypatch):
+    # The global model is a flat vector kept on the fake server
+    module = types.ModuleType('fl_model')
+    module.extract_weights = lambda model: [('w', torch.from_numpy(model['w']))]
+    monkeypatch.setitem(sys.modules, 'fl_model', module)
+
+
+def make_server(directors, w0, per_round):
+    server = DirectedServer.__new__(DirectedServer)
+    server.config = types.SimpleNamespace(clients=types.SimpleNamespace(per_round=per_round))
+    server.clients = list(range(len(directors)))
+    server.model = {'w': w0.copy()}
+    server.w_previous = w0.copy()
+    server.directors = directors.copy()
+    server.sketch = None
+    server.punishment = np.zeros(len(directors), dtype=np.int64)
+    server.punished = np.empty(0, dtype=np.int64)
+    return server
+
+
+def loop_selection(directors, direction, punishment, k):
+    # Selection as done client by client before the director matrix
+    scores = [np.dot(director, direction) for director in directors]
+    scores = [x * (0.9)**punishment[i] for i, x in enumerate(scores)]
+    selected = []
+    for _ in range(k):
+        top = scores.index(max(scores))
+        selected.append(top)
+        scores[top] = min(scores) - 1
+    punishment = [punishment[i] + 1 if i in selected else 0 for i in range(len(scores))]
+    return selected, punishment
+
+
+def test_selection_matches_the_loop():
+    rng = np.random.default_rng(0)
+    directors = rng.standard_normal((40, 6))
+    directors[20:] = directors[:20]  # Every score tied with another client
+    directors = DirectedServer.normalize(directors).astype(np.float32)
+    w0 = rng.standard_normal(6)
+    server = make_server(directors, w0, per_round=5)
+
+    w_previous, punishment = w0.copy(), [0] * len(directors)
+    for _ in range(8):
+        # Small moves keep the same clients on top, so punishment builds up
+        server.model['w'] = server.model['w'] + 0.01 * rng.standard_normal(6) + 0.1
+        direction = server.model['w'] - w_previous
+        direction /= np.sqrt(np.dot(direction, direction))
+        w_previous = server.model['w']
+
+        expected, punishment = loop_selection(directors, direction, punishment, 5)
+        assert server.selection() == expected
+        assert server.punishment.tolist() == punishment
+    assert max(punishment) > 1
+
+
+@pytest.mark.parametrize('store', ['float32', 'sketch'])
+def test_aggregation_refreshes_reporting_rows(monkeypatch, store):
+    monkeypatch.setattr(Server, 'aggregation', lambda self, reports: 'aggregated')
+    rng = np.random.default_rng(1)
+    w0 = rng.standard_normal(50).astype(np.float32)
+    sketch = CountSketch(50, 8) if store == 'sketch' else None
+    width = 8 if sketch else 50
+    directors = DirectedServer.normalize(rng.standard_normal((6, width))).astype(np.float32)
+    server = make_server(directors, w0, per_round=2)
+    server.sketch = sketch
+
+    updates = {1: rng.standard_normal(50), 4: rng.standard_normal(50)}
+    reports = [types.SimpleNamespace(client_id=i, weights=[('w', torch.from_numpy(w0 + u))])
+               for i, u in updates.items()]
+    assert server.aggregation(reports) == 'aggregated'
+
+    for i in range(6):
+        if i not in updates:
+            np.testing.assert_array_equal(server.directors[i], directors[i])
+            continue
+        update = (w0 + updates[i]) - w0
+        expected = sketch.transform(update) if sketch else update
+        np.testing.assert_allclose(server.directors[i], expected / np.linalg.norm(expected),
+                                   rtol=1e-5, atol=1e-6)
+        assert np.linalg.norm(server.directors[i]) == pytest.approx(1, abs=1e-5)
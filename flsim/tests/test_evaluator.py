@@ -0,0 +1,110 @@
+import types
+from collections import namedtuple
+
+import pytest
+import torch
+
+from server.evaluator import EvaluationWorker, Evaluator
+
+
+@pytest.fixture(autouse=True)
+def fl_model(monkeypatch):
+    # Evaluator only looks up the device of the model module
+    module = types.ModuleType('fl_model')
+    module.device = torch.device('cpu')
+    monkeypatch.setitem(__import__('sys').modules, 'fl_model', module)
+
+
+def make_testset(n=100, wrong=30):
+    # One-hot inputs of the true class, the first `wrong` labels flipped
+    samples = []
+    for i in range(n):
+        c = i % 2
+        label = 1 - c if i < wrong else c
+        samples.append((torch.eye(2)[c], label))
+    return samples
+
+
+def identity(sign=1):
+    model = torch.nn.Linear(2, 2, bias=False)
+    with torch.no_grad():
+        model.weight.copy_(sign * torch.eye(2))
+    return model
+
+
+def config(**evaluation):
+    fields = ['every', 'interval', 'batch_size', 'subsample', 'confidence', 'seed', 'lag']
+    values = dict(every=1, interval=None, batch_size=16, subsample=None,
+                  confidence=0.95, seed=0, lag=1)
+    values.update(evaluation)
+    return types.SimpleNamespace(evaluation=namedtuple('evaluation', fields)(**values))
+
+
+def test_full_accuracy():
+    evaluator = Evaluator(config(), make_testset())
+    assert evaluator.evaluate(identity()) == pytest.approx(0.7)
+    assert evaluator.ci is None
+
+
+def test_cadence():
+    evaluator = Evaluator(config(every=3), make_testset())
+    assert evaluator.due()  # First model
+    evaluator.mark()
+    assert not evaluator.due() and not evaluator.due()
+    assert evaluator.due()
+
+
+def test_straddling_target_is_settled_on_the_evaluated_model():
+    evaluator = Evaluator(config(subsample=10), make_testset())
+    model = identity()
+    evaluator.evaluate(model)
+    lower, upper = evaluator.ci
+    assert lower < 0.6 <= upper
+
+    # The live model moves on before the target check
+    with torch.no_grad():
+        model.weight.mul_(-1)
+    assert evaluator.reached(model, evaluator.accuracy, 0.6)
+
+
+# Model module of the evaluation process, found on model_path
+STUB = """
+import torch
+device = torch.device('cpu')
+
+def Net():
+    return torch.nn.Linear(2, 2, bias=False)
+"""
+
+
+@pytest.fixture
+def worker(tmp_path):
+    (tmp_path / 'fl_model.py').write_text(STUB)
+    worker = EvaluationWorker(Evaluator(config(), make_testset()), str(tmp_path))
+    yield worker
+    if worker.process.is_alive():
+        worker.close()
+
+
+def test_worker_delivers_in_submission_order(worker):
+    delivered = []
+    models = [identity(), None, identity(-1), None, identity()]
+    for model in models:
+        worker.submit(model, callback=delivered.append)
+    worker.wait(len(models) - 1)
+    assert len(worker.pending) <= len(models) - 1
+
+    worker.wait(0)  # Blocks until every job is back
+    assert not worker.pending
+    # Carry-forward jobs repeat the accuracy of the snapshot before them
+    assert delivered == pytest.approx([0.7, 0.7, 0.3, 0.3, 0.7])
+    assert worker.evaluator.accuracy == pytest.approx(0.7)
+
+
+def test_wait_raises_when_the_worker_died(worker):
+    worker.wait(0)
+    worker.process.kill()
+    worker.process.join()
+    worker.submit(identity())
+    with pytest.raises(RuntimeError):
+        worker.wait(0)
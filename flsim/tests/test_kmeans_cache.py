@@ -0,0 +1,45 @@
+import types
+
+import pytest
+import torch
+
+from server.kmeans import KMeansServer
+
+
+@pytest.fixture(autouse=True)
+def fl_model(monkeypatch):
+    module = types.ModuleType('fl_model')
+    module.extract_weights = lambda model: list(model.named_parameters())
+    monkeypatch.setitem(__import__('sys').modules, 'fl_model', module)
+
+
+def make_server(tmp_path, seed=0, sketch_dim=16):
+    ns = types.SimpleNamespace
+    fl_server = KMeansServer.__new__(KMeansServer)
+    fl_server.config = ns(
+        paths=ns(data='./data'), model=ns(name='MNIST'), data=ns(IID=False),
+        fl=ns(epochs=1, batch_size=32),
+        clients=ns(total=2, seed=seed, lazy=False),
+        profile=ns(cache=str(tmp_path), sketch_dim=sketch_dim))
+    fl_server.model = torch.nn.Linear(4, 2)
+    return fl_server
+
+
+def make_clients(*partitions):
+    return [types.SimpleNamespace(pref='0', data=[(None, label) for label in labels])
+            for labels in partitions]
+
+
+def test_key_covers_the_data_layout(tmp_path):
+    fl_server = make_server(tmp_path)
+    key = fl_server.profile_cache(make_clients([0, 1], [1, 1]))
+    assert key == fl_server.profile_cache(make_clients([1, 0], [1, 1]))
+    assert key != fl_server.profile_cache(make_clients([0, 0], [1, 1]))
+    assert key != fl_server.profile_cache(make_clients([0, 1], [1, 1, 1]))
+    assert key != make_server(tmp_path, seed=1).profile_cache(make_clients([0, 1], [1, 1]))
+    assert key != make_server(tmp_path, sketch_dim=8).profile_cache(make_clients([0, 1], [1, 1]))
+
+
+def test_no_cache_for_dynamic_loading(tmp_path):
+    clients = [types.SimpleNamespace(pref='0')]
+    assert make_server(tmp_path).profile_cache(clients) is None
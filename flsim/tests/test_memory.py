@@ -0,0 +1,50 @@
+import types
+
+import numpy as np
+
+import server.memory as memory
+from server.memory import MemoryAccounting, sizeof
+
+
+def make_server(tmp_path, profile, testset):
+    paths = types.SimpleNamespace(model=str(tmp_path))
+    evaluator = types.SimpleNamespace(testset=testset, state=np.zeros(8))
+    return types.SimpleNamespace(
+        config=types.SimpleNamespace(paths=paths), clients=[],
+        model=None, base_weights=None, profile=profile, buffer=None,
+        evaluator=evaluator, loader=types.SimpleNamespace(trainset=testset))
+
+
+def test_memmaps_are_mapped_not_resident(tmp_path):
+    store = np.memmap(str(tmp_path / 'profile.dat'), dtype=np.float32,
+                      mode='w+', shape=(256, 64))
+    size, mapped = sizeof({'store': store, 'row': store[3]})
+    assert mapped == store.nbytes
+    assert size < store.nbytes
+
+    size, mapped = sizeof(np.zeros((256, 64), dtype=np.float32))
+    assert mapped == 0 and size >= 256 * 64 * 4
+
+
+def test_static_owners_are_sized_once(tmp_path, monkeypatch):
+    store = np.memmap(str(tmp_path / 'profile.dat'), dtype=np.float32,
+                      mode='w+', shape=(16, 4))
+    server = make_server(tmp_path, store, [np.zeros(100) for _ in range(10)])
+    accounting = MemoryAccounting(server)
+
+    totals, mapped, _ = accounting.measure()
+    assert totals['loader'] >= 10 * 800
+    assert totals['profile'] < store.nbytes and mapped == {'profile': store.nbytes}
+    # The evaluator's test set is the loader's, counted once
+    assert totals['evaluator'] < 800
+
+    walked = []
+    monkeypatch.setattr(memory, 'sizeof', lambda obj, seen=None: (
+        walked.append(id(obj)), sizeof(obj, seen))[1])
+    accounting.sample(force=True)
+    assert id(server.loader) not in walked and id(server.evaluator.testset) not in walked
+    assert accounting.peaks['loader'] == totals['loader']
+
+    server.loader = types.SimpleNamespace(trainset=[np.zeros(10)])
+    accounting.measure()
+    assert id(server.loader) in walked
@@ -0,0 +1,29 @@
+import types
+import urllib.request
+
+from server.metrics import Histogram, MetricsEndpoint
+from utils.spans import spans  # pylint: disable=no-name-in-module
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(1, 10))
+    for value in [0.5, 2, 3, 50]:
+        histogram.observe(value)
+    lines = histogram.lines('x')
+    assert lines[:3] == ['x_bucket{le="1"} 1', 'x_bucket{le="10"} 3', 'x_bucket{le="+Inf"} 4']
+    assert lines[-1] == 'x_count 4'
+
+
+def test_buffering_and_aggregation_are_separate_series():
+    endpoint = MetricsEndpoint(types.SimpleNamespace(), port=0)
+    try:
+        spans.add('aggregation.buffer', 0.0, 0.002)
+        spans.add('aggregation.buffer', 0.0, 0.002)
+        spans.add('aggregation', 0.0, 2.0)
+
+        url = 'http://{}:{}/metrics'.format(*endpoint.httpd.server_address[:2])
+        text = urllib.request.urlopen(url).read().decode()
+    finally:
+        endpoint.close()
+    assert 'flsim_aggregation_seconds_count 1' in text
+    assert 'flsim_aggregation_buffer_seconds_count 2' in text
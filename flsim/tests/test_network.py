@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+from network import Network, StubNetwork, make_network
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STANDIN = [sys.executable, os.path.join(ROOT, 'scripts', 'ns3_standin.py'),
+           '--seed=0', '--rateMbps=1e6']
+
+
+def make_config(network, total=10):
+    return {'clients': {'total': total}, 'model': {'size': 1600}, 'network': network}
+
+
+def standin(*flags, timeout=None):
+    return Network(make_config({'type': 'thz', 'ns3': {
+        'command': STANDIN + list(flags), 'timeout': timeout}}))
+
+
+def test_sync_run():
+    network = standin('--wallTime=0.2')
+    results = network.sendRequest(requestType=1, array=[2, 5, 7])
+    assert sorted(results) == [2, 5, 7]
+    assert all(result['roundTime'] > 0 for result in results.values())
+
+    run = network.last_run
+    assert run['clients'] == 3 and run['returncode'] == 0 and not run['timeout']
+    assert run['cpu'] > 0 and run['peak_rss_mb'] > 0
+    assert network.run_totals['runs'] == 1
+
+
+def test_async_run():
+    network = standin()
+    network.sendAsyncRequest(requestType=1, array=[1, 3])
+    responses = []
+    while True:
+        response = network.readAsyncResponse()
+        if response == 'end':
+            break
+        responses.extend(response)
+    assert sorted(responses) == [1, 3]
+    assert network.last_run['cpu'] > 0
+
+
+def test_timeout_drops_clients():
+    network = standin('--hang', '--ignoreTerm', timeout=0.5)
+    results = network.sendRequest(requestType=1, array=[0, 1])
+    assert all(result['roundTime'] == -1.0 for result in results.values())
+    assert network.last_run['timeout']
+
+
+def test_failed_run_raises():
+    with pytest.raises(RuntimeError):
+        standin('--exitCode=3').sendRequest(requestType=1, array=[0])
+
+
+def test_stub_network():
+    network = make_network(make_config({'type': 'stub', 'stub': {'dropout': 0.0}}))
+    assert isinstance(network, StubNetwork)
+    results = network.sendRequest(requestType=1, array=[0, 4])
+    assert sorted(results) == [0, 4]
+
+
+def test_peak_rss_is_per_run():
+    # A large run first: a process-wide high-water mark would carry over
+    large = standin('--allocMb=200')
+    large.sendRequest(requestType=1, array=[0])
+    small = standin()
+    small.sendRequest(requestType=1, array=[0])
+    assert large.last_run['peak_rss_mb'] > 200
+    assert small.last_run['peak_rss_mb'] < large.last_run['peak_rss_mb'] - 150
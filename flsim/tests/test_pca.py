@@ -0,0 +1,26 @@
+import numpy as np
+
+from utils.pca import StreamingPCA
+
+
+def test_batches_and_frozen_basis(tmp_path):
+    rng = np.random.default_rng(0)
+    # Variance mostly along the first axis
+    vectors = rng.standard_normal((100, 8)) * np.array([10.] + [1.] * 7)
+
+    pca = StreamingPCA(n_components=2, batch_size=32)
+    pca.partial_fit(vectors[:20])
+    assert not pca.fitted and len(pca.pending) == 20
+    pca.partial_fit(vectors[20:40])
+    assert pca.fitted and not pca.pending
+
+    pca.freeze()
+    before = pca.transform(vectors)
+    pca.partial_fit(vectors[40:])  # Ignored once frozen
+    np.testing.assert_allclose(pca.transform(vectors), before)
+    assert pca.transform(np.zeros((0, 8))).shape == (0, 2)
+
+    path = str(tmp_path / 'pca.pkl')
+    pca.save(path)
+    np.testing.assert_allclose(StreamingPCA.load_or_create(path).transform(vectors), before)
+    assert not StreamingPCA.load_or_create(str(tmp_path / 'missing.pkl')).fitted
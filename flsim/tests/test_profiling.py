@@ -0,0 +1,45 @@
+import os
+import threading
+
+import torch
+
+from utils.profiling import OpProfiler
+from utils.spans import spans
+
+
+def make_profiler(tmp_path, monkeypatch):
+    monkeypatch.setattr(spans, 'round', 3)
+    profiler = OpProfiler()
+    profiler.configure(str(tmp_path), with_stack=False, row_limit=5)
+    return profiler
+
+
+def test_single_threaded_capture(tmp_path, monkeypatch):
+    profiler = make_profiler(tmp_path, monkeypatch)
+    with profiler.capture('train', 1):
+        torch.ones(8).sum()
+    assert os.listdir(str(tmp_path)) == ['round3_client1_train']
+    assert profiler.active == 0
+
+
+def test_concurrent_phases_label_the_capture(tmp_path, monkeypatch):
+    profiler = make_profiler(tmp_path, monkeypatch)
+    started, done = threading.Event(), threading.Event()
+
+    def first():
+        with profiler.capture('train', 1):
+            started.set()
+            done.wait(10)
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    started.wait(10)
+    with profiler.capture('train', 2):  # Not profiled, but in client 1's trace
+        torch.ones(8).sum()
+    done.set()
+    thread.join()
+
+    assert os.listdir(str(tmp_path)) == ['round3_client1_train_process']
+    with open(os.path.join(str(tmp_path), 'round3_client1_train_process', 'ops.txt')) as f:
+        assert f.readline().startswith('# Process-wide')
+    assert profiler.active == 0 and not profiler.capturing
@@ -0,0 +1,46 @@
+import gc
+import os
+
+import numpy as np
+
+from server.record import Record
+
+
+def test_records_stream_to_disk(tmp_path):
+    path = str(tmp_path / 'record.csv')
+    records = Record(path, fsync_interval=0)
+    records.append_record(1.0, 0.5, 10.0, dropout=1, round_num=1, clients=[3])
+    records.async_time_graphs(2.0, 0.7, 20.0)
+
+    with open(path) as f:  # Readable while the run goes on
+        assert len(f.readlines()) == 3
+    assert len(records) == 2 and records.get_latest_t() == 2.0
+    assert records.dropouts == 1
+
+    columns = records.read()
+    np.testing.assert_allclose(columns['time'], [1.0, 2.0])
+    assert columns['clients'] == ['3']
+
+
+def test_closed_records_stay_readable(tmp_path):
+    records = Record(str(tmp_path / 'record.csv'))
+    records.append_record(1.0, 0.5, 10.0, dropout=0, round_num=1)
+    records.close()
+    records.close()
+    assert all(f.closed for f in records.files)
+
+    copy = str(tmp_path / 'copy.csv')
+    records.save_record(copy)
+    assert os.path.exists(copy) and os.path.exists(copy + '_dropouts.csv')
+
+
+def test_temporary_records_are_removed():
+    records = Record()
+    records.append_record(1.0, 0.5, 10.0, dropout=0, round_num=1)
+    records.close()
+    directory = os.path.dirname(records.path)
+    assert records.read()['acc'][0] == 0.5
+
+    del records
+    gc.collect()
+    assert not os.path.exists(directory)
@@ -0,0 +1,56 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from server.reports import ReportReader, ReportWriter, load_reports
+
+
+class Report(object):
+    def __init__(self, client_id, weights):
+        self.client_id = client_id
+        self.weights = weights
+
+
+def weights(value):
+    return [('w', torch.full((2, 3), float(value))), ('b', torch.full((3,), float(value)))]
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_roundtrip(tmp_path, delta):
+    path = str(tmp_path / 'reports')
+    writer = ReportWriter(path, weights(0), delta=delta)
+    writer.append(1, [Report(3, weights(1)), Report(5, weights(2))], weights(1.5))
+    writer.append(2, [Report(5, weights(4))], weights(3))
+    writer.close()
+
+    reader = load_reports(path)
+    assert isinstance(reader, ReportReader)
+    assert reader.rounds() == [1, 2]
+    assert reader.clients(1) == [3, 5]
+    np.testing.assert_allclose(reader[1, 5], np.full(9, 2.0))
+    np.testing.assert_allclose(reader[2, 5], np.full(9, 4.0))
+    np.testing.assert_allclose(reader.global_weights(2), np.full(9, 3.0))
+    name, tensor = reader.unflatten(reader[1, 3])[0]
+    assert name == 'w' and tensor.shape == (2, 3)
+    with pytest.raises(KeyError):
+        reader[2, 3]
+
+
+def test_incomplete_segment_is_ignored(tmp_path):
+    path = str(tmp_path / 'reports')
+    writer = ReportWriter(path, weights(0))
+    writer.append(1, [Report(0, weights(1))], weights(1))
+    writer.index.write('{"segment": 1')  # Interrupted mid-line
+    writer.close()
+    assert len(ReportReader(path)) == 1
+
+
+def test_pickled_reports_of_older_runs(tmp_path):
+    path = tmp_path / 'reports.pkl'
+    with open(path, 'wb') as f:
+        pickle.dump({1: ['report']}, f)
+    assert load_reports(str(path)) == {1: ['report']}
+    with pytest.raises(ValueError):
+        ReportWriter(str(path), weights(0))
@@ -0,0 +1,60 @@
+import random
+
+import numpy as np
+
+from client import ClientTable, top_k
+from utils.selection import UtilityIndex
+
+
+def sorted_top(utility, k):
+    # Reference order: descending, ties to the lower index
+    return sorted(range(len(utility)), key=lambda i: (-utility[i], i))[:k]
+
+
+def test_top_k_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    for n in [1, 5, 33, 100]:
+        utility = rng.integers(0, 10, n).astype(float)  # Many ties
+        index = UtilityIndex(utility)
+        for k in [1, 3, n]:
+            assert index.top_k(k) == sorted_top(utility, k)
+            assert top_k(utility, k).tolist() == sorted_top(utility, k)
+
+
+def test_updates_and_exclusions():
+    utility = [3., 1., 4., 1., 5.]
+    index = UtilityIndex(utility)
+    index.update(1, 9.)
+    utility[1] = 9.
+    assert index.value(1) == 9.
+    assert index.top_k(3) == sorted_top(utility, 3) == [1, 4, 2]
+    assert index.top_k(2, exclude={1}) == [4, 2]
+
+
+def test_sample_draws_distinct_clients_by_utility():
+    random.seed(0)
+    index = UtilityIndex([0., 0., 1., 3.])
+    counts = np.zeros(4)
+    for _ in range(2000):
+        counts[index.sample(1)] += 1
+    assert counts[0] == counts[1] == 0
+    assert 2 < counts[3] / counts[2] < 4
+
+    chosen = index.sample(4)  # Mass runs out, the rest come uniformly
+    assert sorted(chosen) == [0, 1, 2, 3]
+    assert index.top_k(4) == [3, 2, 0, 1]  # Weights restored after the draw
+
+
+def test_table_refreshes_changed_rows():
+    random.seed(0)
+    table = ClientTable(6)
+    table.loss[:] = [1., 2., 3., 4., 5., 6.]
+    assert table.select('high_loss_first', 2).tolist() == [5, 4]
+
+    table.set('loss', 0, 10.)
+    assert table.select('high_loss_first', 2).tolist() == [0, 5]
+    assert table.participation.tolist() == [1, 0, 0, 0, 1, 2]
+    assert table.last_round[0] == 2 and table.round == 2
+
+    table.est_delay[:] = [6., 5., 4., 3., 2., 1.]
+    assert table.select('short_latency_first', 1).tolist() == [5]
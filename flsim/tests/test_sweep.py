@@ -0,0 +1,88 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def sweep():
+    # The script parses its arguments on import
+    argv, sys.argv = sys.argv, ['sweep.py', '-c', 'config.json', '-g', 'grid.json']
+    try:
+        spec = importlib.util.spec_from_file_location(
+            'sweep', os.path.join(ROOT, 'scripts', 'sweep.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
+
+
+def test_expand_covers_the_grid(sweep):
+    base = {'async': {'alpha': 0.9}, 'clients': {'total': 10}}
+    trials = sweep.expand(base, {'async.alpha': [0.5, 0.9], 'clients.per_round': [2, 4]})
+    assert len(trials) == 4
+    assert {(c['async']['alpha'], c['clients']['per_round']) for _, c in trials} == \
+        {(0.5, 2), (0.5, 4), (0.9, 2), (0.9, 4)}
+    assert base == {'async': {'alpha': 0.9}, 'clients': {'total': 10}}
+    assert len({sweep.config_hash(c) for _, c in trials}) == 4
+
+
+def test_read_curve_skips_a_partial_row(sweep, tmp_path):
+    path = str(tmp_path / 'record.csv')
+    with open(path, 'w') as f:
+        f.write('time,acc,throughput\n1.0,0.2,5\n2.0,0.4,5\n3.0')
+    assert sweep.read_curve(path) == ([1.0, 2.0], [0.2, 0.4])
+    assert sweep.read_curve(str(tmp_path / 'missing.csv')) == ([], [])
+
+
+def test_halving_stops_below_the_cutoff(sweep):
+    halving = sweep.Halving(min_time=10, eta=2, poll=0)
+    good, bad = {}, {}
+    assert list(halving.climb(good, [5, 12, 25], [0.5, 0.8, 0.9])) == [(0, True), (1, True)]
+    assert good == {0: 0.8, 1: 0.9}
+    assert list(halving.climb(bad, [12], [0.1])) == [(0, False)]
+    assert list(halving.climb(bad, [12], [0.1])) == []  # Rung 0 is scored once
+
+    resumed = sweep.Halving(min_time=10, eta=2, poll=0)
+    resumed.restore([{'rungs': {'0': 0.8, '1': 0.9}}, {'rungs': {'0': 0.1}}])
+    assert resumed.scores[0] == [0.8, 0.1]
+
+
+def test_result_store_resumes(sweep, tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    store = sweep.ResultStore(path)
+    store.add({'hash': 'a', 'status': 'failed'})
+    store.add({'hash': 'b', 'status': 'stopped'})
+    store.close()
+    with open(path, 'a') as f:
+        f.write('{"hash": "c", "sta')  # Cut off by a crash
+
+    store = sweep.ResultStore(path)
+    assert sorted(store.results) == ['a', 'b']
+    assert store.done('b', retry=True) and store.done('a')
+    assert not store.done('a', retry=True) and not store.done('c')
+    store.close()
+
+
+def test_trial_outputs_stay_in_the_trial(sweep, tmp_path):
+    runner = sweep.Sweep(str(tmp_path / 'sweep'))
+    path = str(tmp_path / 'trial')
+    os.makedirs(path)
+    base = {'model': {'name': 'Synthetic'}, 'network': {'type': 'stub'},
+            'paths': {'records': 'out/records.csv', 'plot': './plots',
+                      'reports': '/shared/reports', 'spans': './spans.jsonl'}}
+    config = runner.trial_config(base, path)
+    runner.store.close()
+
+    paths = config['paths']
+    assert paths['records'] == 'record.csv'
+    assert paths['reports'] == 'reports' and paths['spans'] == 'spans.jsonl'
+    assert os.path.isdir(os.path.join(path, paths['plot']))
+    assert os.path.exists(os.path.join(path, 'models', 'Synthetic', 'fl_model.py'))
+    assert base['paths']['records'] == 'out/records.csv'
+    json.dumps(config)
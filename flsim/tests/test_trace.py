@@ -0,0 +1,49 @@
+import types
+
+import numpy as np
+import torch
+
+from server.trace import TraceReader, TraceWriter
+
+
+def weights(value):
+    return [('fc.weight', torch.full((2, 3), float(value))), ('fc.bias', torch.full((2,), float(value)))]
+
+
+def report(client_id, value, **fields):
+    return types.SimpleNamespace(client_id=client_id, weights=weights(value), num_samples=10, **fields)
+
+
+def test_trace_round_trip(tmp_path):
+    path = str(tmp_path / 'trace')
+    writer = TraceWriter(path, weights(0))
+    writer.set_base(weights(1))
+    writer.record([report(3, 2, delay=1.5, loss=0.4), report(4, 0)])
+    writer.set_base(weights(2), version=7.5)
+    writer.record([report(3, 5)], T=9.0)
+    writer.close()
+
+    trace = TraceReader(path)
+    assert len(trace) == 3
+    np.testing.assert_array_equal(trace.initial, np.zeros(8))
+    assert trace.rounds() == {1: [0, 1], 2: [2]}
+
+    meta, update = trace[0]
+    assert meta['client_id'] == 3 and meta['delay'] == 1.5 and meta['version'] == 0
+    assert np.isnan(meta['accuracy']) and np.isnan(meta['time'])
+    np.testing.assert_array_equal(update, np.ones(8))  # Relative to the base
+    np.testing.assert_array_equal(trace[1][1], -np.ones(8))
+
+    meta, update = trace[2]
+    assert meta['version'] == 7.5 and meta['time'] == 9.0 and meta['round'] == 2
+    (name, weight), (_, bias) = trace.unflatten(update)
+    assert name == 'fc.weight' and weight.shape == (2, 3)
+    assert torch.equal(bias, torch.full((2,), 3.))
+
+
+def test_empty_trace(tmp_path):
+    path = str(tmp_path / 'trace')
+    TraceWriter(path, weights(0), dtype='float16').close()
+    trace = TraceReader(path)
+    assert len(trace) == 0 and trace.updates.shape == (0, 8)
+    assert trace.dtype == np.float16
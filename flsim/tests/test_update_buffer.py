@@ -0,0 +1,52 @@
+import torch
+
+from server.asyncServer import UpdateBuffer
+
+
+class Report(object):
+    def __init__(self, weights):
+        self.weights = weights
+
+
+def weights(value):
+    return [('w', torch.full((3,), float(value))), ('b', torch.full((1,), float(value)))]
+
+
+def test_sequential_matches_unbuffered():
+    buffer = UpdateBuffer(size=2)
+    buffer.add(Report(weights(1)), weights(0), 0.5, T=0)
+    assert not buffer.due(0)
+    buffer.add(Report(weights(1)), None, 0.5, T=1)
+    assert buffer.due(1)
+
+    updated, reports = buffer.flush()
+    # 0 -> 0.5 -> 0.75
+    assert torch.allclose(updated[0][1], torch.full((3,), 0.75))
+    assert len(reports) == 2 and len(buffer) == 0
+
+
+def test_mean_mode():
+    buffer = UpdateBuffer(size=2, mode='mean')
+    buffer.add(Report(weights(1)), weights(0), 0.5, T=0)
+    buffer.add(Report(weights(3)), None, 1.0, T=0)
+    updated, _ = buffer.flush()
+    assert torch.allclose(updated[1][1], torch.full((1,), (0.5 + 3.0) / 2))
+
+
+def test_deadline():
+    buffer = UpdateBuffer(size=10, deadline=5)
+    buffer.add(Report(weights(1)), weights(0), 0.5, T=2)
+    assert not buffer.due(6)
+    assert buffer.due(7)
+
+
+def test_folded_weights_are_dropped():
+    buffer = UpdateBuffer(size=3)
+    report = Report(weights(1))
+    buffer.add(report, weights(0), 0.5, T=0)
+    assert report.weights is None
+
+    kept = Report(weights(1))
+    buffer = UpdateBuffer(size=3, keep_weights=True)
+    buffer.add(kept, weights(0), 0.5, T=0)
+    assert kept.weights is not None
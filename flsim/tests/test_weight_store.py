@@ -0,0 +1,46 @@
+import numpy as np
+
+from server.record import WeightStore
+from utils.sketch import CountSketch
+
+
+def test_sketch_is_linear_and_keeps_distances():
+    rng = np.random.default_rng(0)
+    sketch = CountSketch(4096, 512, seed=1)
+    x, y = rng.standard_normal((2, 4096)).astype(np.float32)
+    np.testing.assert_allclose(sketch.transform(x + y), sketch.transform(x) + sketch.transform(y),
+                               atol=1e-4)
+    np.testing.assert_allclose(sketch.transform(np.stack([x, y]))[1], sketch.transform(y))
+    assert sketch.transform(np.zeros((0, 4096))).shape == (0, 512)
+
+    exact = np.linalg.norm(x - y)
+    sketched = np.linalg.norm(sketch.transform(x) - sketch.transform(y))
+    assert abs(sketched / exact - 1) < 0.2
+    assert np.array_equal(CountSketch(4096, 512, seed=1).bucket, sketch.bucket)
+
+
+def test_rows_of_reported_clients(tmp_path):
+    store = WeightStore(5, path=str(tmp_path / 'profile.dat'))
+    assert store[2].size == 0
+    assert store.rows()[1].shape == (0, 0)
+
+    store.write([1, 3], np.arange(12, dtype=np.float32).reshape(2, 6))
+    index, rows = store.rows()
+    assert index.tolist() == [1, 3] and rows.shape == (2, 6)
+    np.testing.assert_array_equal(store[3], np.arange(6, 12))
+    assert store[0].size == 0 and isinstance(store.array, np.memmap)
+
+
+def test_compact_stores(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((2, 1000)).astype(np.float32)
+
+    half = WeightStore(3, store='float16')
+    half.write([0, 2], vectors)
+    assert half.array.dtype == np.float16
+    np.testing.assert_allclose(half[2], vectors[1], atol=1e-2)
+
+    sketched = WeightStore(3, store='sketch', sketch_dim=64)
+    written = sketched.write([0, 2], vectors)
+    assert sketched.array.shape == (3, 64)
+    np.testing.assert_allclose(sketched[0], written[0])
+    np.testing.assert_allclose(written, sketched.sketch.transform(vectors))
@@ -0,0 +1,180 @@
+import math
+import random
+import torch
+
+
+def flatten(weights):
+    # Flatten (name, tensor) weights into one float32 vector
+    return torch.cat([weight.detach().cpu().reshape(-1).float() for _, weight in weights])
+
+
+def unflatten(vector, like):
+    # Split a flat vector into (name, tensor) weights shaped like 'like'
+    weights, offset = [], 0
+    for name, weight in like:
+        size = weight.numel()
+        weights.append((name, vector[offset:offset + size].view_as(weight).to(weight.dtype)))
+        offset += size
+    return weights
+
+
+class CompressedUpdate(object):
+    """Encoded client update as uploaded to the server."""
+
+    def __init__(self, payload, numel, nbytes):
+        self.payload = payload
+        self.numel = numel
+        self.nbytes = nbytes
+
+
+class Compressor(object):
+    """Uncompressed float32 updates, base class for update compression.
+
+    Clients compress the difference between their trained weights and the
+    global weights they downloaded. With error feedback, what compression
+    dropped is kept on the client and added to its next update.
+    """
+
+    def __init__(self, config):
+        compression = getattr(config, 'compression', None)
+        self.error_feedback = getattr(compression, 'error_feedback', False)
+        # Size of encoded updates relative to float32 weights
+        self.ratio = 1.0
+
+    def __repr__(self):
+        return '{}(ratio={:.4f}, error_feedback={})'.format(
+            type(self).__name__, self.ratio, self.error_feedback)
+
+    def estimate(self, numel):
+        # Size ratio before any update is compressed
+        _, nbytes = self.encode(torch.zeros(numel))
+        self.ratio = nbytes / (4. * numel)
+        return self.ratio
+
+    # Encoding of flat update vectors
+    def encode(self, delta):
+        return delta.clone(), 4 * delta.numel()
+
+    def decode(self, payload, numel):
+        return payload
+
+    # Client side
+    def compress(self, client, weights):
+        delta = flatten(weights) - flatten(client.base_weights)
+
+        residual = getattr(client, 'residual', None)
+        if self.error_feedback and residual is not None:
+            delta += residual
+
+        payload, nbytes = self.encode(delta)
+        if self.error_feedback:
+            client.residual = delta - self.decode(payload, delta.numel())
+
+        self.ratio = nbytes / (4. * delta.numel())
+        return CompressedUpdate(payload, delta.numel(), nbytes)
+
+    # Server side
+    def decompress(self, update, base_weights):
+        delta = self.decode(update.payload, update.numel)
+        return [(name, base + weight) for (name, base), (_, weight)
+                in zip(base_weights, unflatten(delta, base_weights))]
+
+
+class HalfCompressor(Compressor):
+    """float16 quantization."""
+
+    def encode(self, delta):
+        return delta.half(), 2 * delta.numel()
+
+    def decode(self, payload, numel):
+        return payload.float()
+
+
+class Int8Compressor(Compressor):
+    """Blockwise absmax int8 quantization."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.block = getattr(config.compression, 'block', 2048)
+
+    def encode(self, delta):
+        blocks = math.ceil(delta.numel() / self.block)
+        padded = torch.zeros(blocks * self.block)
+        padded[:delta.numel()] = delta
+        padded = padded.view(blocks, self.block)
+
+        scales = padded.abs().max(dim=1, keepdim=True).values / 127.
+        scales[scales == 0] = 1.
+        quantized = torch.round(padded / scales).to(torch.int8)
+        return (quantized, scales.squeeze(1)), delta.numel() + 4 * blocks
+
+    def decode(self, payload, numel):
+        quantized, scales = payload
+        return (quantized.float() * scales.unsqueeze(1)).view(-1)[:numel]
+
+
+class TopKCompressor(Compressor):
+    """Top-k magnitude sparsification, sending (index, value) pairs."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.fraction = getattr(config.compression, 'ratio', 0.01)
+
+    def encode(self, delta):
+        k = max(1, int(self.fraction * delta.numel()))
+        _, index = delta.abs().topk(k, sorted=False)
+        return (index.to(torch.int32), delta[index]), 8 * k
+
+    def decode(self, payload, numel):
+        index, values = payload
+        delta = torch.zeros(numel)
+        delta[index.long()] = values
+        return delta
+
+
+class RandomMaskCompressor(Compressor):
+    """Random subsampling with a seeded mask, sending the seed and values.
+
+    Without error feedback, kept values are scaled by 1 / fraction so the
+    update stays unbiased. With error feedback they are sent as they are:
+    the dropped coordinates carry over in the residual, while a scaled
+    value would leave delta * (1 - 1 / fraction) behind and the residual
+    would grow round after round.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.fraction = getattr(config.compression, 'ratio', 0.01)
+        self.scale = 1. if self.error_feedback else 1. / self.fraction
+
+    def mask(self, seed, numel):
+        k = max(1, int(self.fraction * numel))
+        generator = torch.Generator().manual_seed(seed)
+        return torch.randperm(numel, generator=generator)[:k]
+
+    def encode(self, delta):
+        seed = random.getrandbits(63)
+        index = self.mask(seed, delta.numel())
+        return (seed, delta[index] * self.scale), 4 * len(index) + 8
+
+    def decode(self, payload, numel):
+        seed, values = payload
+        delta = torch.zeros(numel)
+        delta[self.mask(seed, numel)] = values
+        return delta
+
+
+def get_compressor(config):
+    """Build the configured update compressor, None when uncompressed."""
+    compression = getattr(config, 'compression', None)
+    method = getattr(compression, 'method', 'none')
+    if method in (None, 'none'):
+        return None
+
+    return {
+        'float32': Compressor,
+        'fp16': HalfCompressor,
+        'int8': Int8Compressor,
+        'topk': TopKCompressor,
+        'random': RandomMaskCompressor,
+    }[method](config)
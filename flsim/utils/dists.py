@@ -2,7 +2,7 @@ import numpy as np
 import random
 
 
-def uniform(N, k):
+def uniform(N, k, rng=None):
     """Uniform distribution of 'N' items into 'k' groups."""
     dist = []
     avg = N / k
@@ -10,11 +10,11 @@ def uniform(N, k):
     for i in range(k):
         dist.append(int((i + 1) * avg) - int(i * avg))
     # Return shuffled distribution
-    random.shuffle(dist)
+    (rng or random).shuffle(dist)
     return dist
 
 
-def normal(N, k):
+def normal(N, k, rng=None):
     """Normal distribution of 'N' items into 'k' groups."""
     dist = []
     # Make distribution
@@ -23,6 +23,6 @@ def normal(N, k):
         dist.append(int(N * (np.exp(-x) / (np.exp(-x) + 1)**2)))
     # Add remainders
     remainder = N - sum(dist)
-    dist = list(np.add(dist, uniform(remainder, k)))
+    dist = list(np.add(dist, uniform(remainder, k, rng)))
     # Return non-shuffled distribution
     return dist
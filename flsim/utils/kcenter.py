@@ -3,33 +3,37 @@ import numpy as np
 
 class GreedyKCenter(object):
     def fit(self, points, k):
-        centers = []
+        points = np.asarray(points)
+        if points.dtype != np.float32:  # Keep float32 profiles as they are
+            points = points.astype(np.float64)
         centers_index = []
         # Initialize distances
-        distances = [np.inf for u in points]
+        distances = np.full(len(points), np.inf)
         # Initialize cluster labels
-        labels = [np.inf for u in points]
+        labels = np.full(len(points), -1)
+
+        # Squared norms, for distances as |v|^2 - 2 u.v + |u|^2
+        norms = np.einsum('ij,ij->i', points, points, dtype=np.float64)
 
         for cluster in range(k):
             # Let u be the point of P such that d[u] is maximum
-            u_index = distances.index(max(distances))
+            u_index = int(np.argmax(distances))
             u = points[u_index]
             # u is the next cluster center
-            centers.append(u)
             centers_index.append(u_index)
 
-            # Update distance to nearest center
-            for i, v in enumerate(points):
-                distance_to_u = self.distance(u, v)  # Calculate from v to u
-                if distance_to_u < distances[i]:
-                    distances[i] = distance_to_u
-                    labels[i] = cluster
+            # Update distance to nearest center, one mat-vec for all points
+            distance_to_u = np.sqrt(np.maximum(norms - 2 * points.dot(u) + norms[u_index], 0))
+            distance_to_u[u_index] = 0
+            closer = distance_to_u < distances
+            distances[closer] = distance_to_u[closer]
+            labels[closer] = cluster
 
-            # Update the bottleneck distance
-            max_distance = max(distances)
+        # Update the bottleneck distance
+        max_distance = distances.max() if len(points) else 0
 
         # Return centers, labels, max delta, labels
-        self.centers = centers
+        self.centers = points[centers_index]
         self.centers_index = centers_index
         self.max_distance = max_distance
         self.labels = labels
@@ -0,0 +1,71 @@
+import logging
+import os
+import pickle
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+
+
+class StreamingPCA(object):
+    """Standardized PCA of weight vectors, fitted batch by batch.
+
+    Vectors are buffered until a batch of batch_size is ready, then the
+    scaler and an IncrementalPCA are partially fitted on it. Once frozen,
+    the basis no longer changes, so projections made earlier stay valid
+    and only new vectors need to be transformed.
+    """
+
+    def __init__(self, n_components=2, batch_size=32):
+        self.n_components = n_components
+        self.batch_size = max(batch_size, n_components)
+        self.scaler = StandardScaler()
+        self.pca = IncrementalPCA(n_components=n_components)
+        self.pending = []
+        self.fitted = False
+        self.frozen = False
+
+    def partial_fit(self, vectors):
+        if self.frozen:
+            return self
+        self.pending.extend(np.asarray(vectors, dtype=np.float32))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return self
+
+    def flush(self):
+        # Fit on the buffered vectors, if there are enough of them
+        if len(self.pending) < self.n_components:
+            return
+        batch, self.pending = np.stack(self.pending), []
+        self.scaler.partial_fit(batch)
+        self.pca.partial_fit(self.scaler.transform(batch))
+        self.fitted = True
+
+    def freeze(self):
+        self.flush()
+        self.pending = []
+        self.frozen = True
+
+    def transform(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return np.zeros((0, self.n_components))
+        return self.pca.transform(self.scaler.transform(vectors))
+
+    # Projection basis on disk
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+        logging.info('Saved PCA basis: {}'.format(path))
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def load_or_create(path, **kwargs):
+        if path and os.path.exists(path):
+            logging.info('Loaded PCA basis: {}'.format(path))
+            return StreamingPCA.load(path)
+        return StreamingPCA(**kwargs)
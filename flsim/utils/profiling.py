@@ -0,0 +1,114 @@
+import contextlib
+import logging
+import os
+import random
+import threading
+import torch
+from utils.spans import spans  # pylint: disable=no-name-in-module
+
+
+class OpProfiler(object):
+    """Operator-level torch.profiler captures for sampled clients and rounds.
+
+    A capture is taken when the current round is in rounds (all if None),
+    the client in clients (all if None; server-side work is always
+    eligible) and a seeded draw per (round, client) falls under
+    fraction. The torch profiler records every thread of the process, so
+    a capture only starts while no other phase is running; phases that
+    start during a capture are not profiled themselves but their ops land
+    in it, and such a capture is labelled process-wide (a _process suffix
+    and a note heading ops.txt). Each capture is exported to
+    <path>/round<r>_<client>_<phase>[_process]/ as operator tables
+    (ops.txt, and ops_by_stack.txt with with_stack), a Chrome trace
+    (trace.json) and, with with_stack, flamegraph stacks (stacks.txt).
+    """
+
+    def __init__(self):
+        self.path = None
+        self.lock = threading.Lock()
+        self.active = 0  # Phases running, profiled or not
+        self.capturing = False
+        self.overlapped = False  # Another phase ran during the capture
+
+    def configure(self, path, rounds=None, clients=None, fraction=1.0, seed=0,
+                  with_stack=True, row_limit=25):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.rounds = None if rounds is None else set(rounds)
+        self.clients = None if clients is None else set(clients)
+        self.fraction = fraction
+        self.seed = seed
+        self.with_stack = with_stack
+        self.row_limit = row_limit
+        logging.info('Profiling operators: {}'.format(path))
+
+    def sampled(self, round, client):
+        if self.path is None:
+            return False
+        if self.rounds is not None and round not in self.rounds:
+            return False
+        if client is not None and self.clients is not None and client not in self.clients:
+            return False
+        if self.fraction < 1:
+            draw = random.Random('{}-{}-{}'.format(self.seed, round, client)).random()
+            return draw < self.fraction
+        return True
+
+    @contextlib.contextmanager
+    def capture(self, phase, client=None):
+        round = spans.round
+        sampled = self.sampled(round, client)
+        with self.lock:
+            # Only start alone, other threads' ops would land in the trace
+            start = sampled and self.active == 0
+            if self.capturing:
+                self.overlapped = True
+            self.active += 1
+            if start:
+                self.capturing, self.overlapped = True, False
+
+        try:
+            if not start:
+                yield
+                return
+
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            try:
+                with torch.profiler.profile(activities=activities, record_shapes=True,
+                                            with_stack=self.with_stack) as prof:
+                    yield
+            finally:
+                with self.lock:
+                    self.capturing = False
+                    process_wide = self.overlapped
+            self.export(prof, phase, round, client, process_wide)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def export(self, prof, phase, round, client, process_wide=False):
+        owner = 'server' if client is None else 'client{}'.format(client)
+        path = os.path.join(self.path, 'round{}_{}_{}{}'.format(
+            round, owner, phase, '_process' if process_wide else ''))
+        os.makedirs(path, exist_ok=True)
+
+        sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+        with open(os.path.join(path, 'ops.txt'), 'w') as f:
+            if process_wide:
+                f.write('# Process-wide: other phases ran during this capture and '
+                        'their ops are included\n')
+            f.write(prof.key_averages().table(sort_by=sort_by, row_limit=self.row_limit))
+        prof.export_chrome_trace(os.path.join(path, 'trace.json'))
+        if self.with_stack:
+            with open(os.path.join(path, 'ops_by_stack.txt'), 'w') as f:
+                f.write(prof.key_averages(group_by_stack_n=5).table(
+                    sort_by=sort_by, row_limit=self.row_limit))
+            prof.export_stacks(os.path.join(path, 'stacks.txt'), 'self_cpu_time_total')
+        logging.info('Profiled {} of {} in round {}{}: {}'.format(
+            phase, owner, round, ' (process-wide)' if process_wide else '', path))
+
+
+# Shared by the server and its clients in this process
+profiler = OpProfiler()
@@ -0,0 +1,109 @@
+import heapq
+import random
+import numpy as np
+
+
+class UtilityIndex(object):
+    """Segment tree over client utilities for incremental selection.
+
+    Every node keeps the max utility of its subtree (with the leftmost
+    client holding it) and the sum of the positive utilities, so changing
+    one client is O(log n), the top k clients come out in O(k log n) and
+    a draw proportional to utility costs O(log n).
+    """
+
+    def __init__(self, utility):
+        utility = np.asarray(utility, dtype=np.float64)
+        self.n = len(utility)
+        self.size = 1 << max(0, (self.n - 1).bit_length())
+
+        self.max = np.full(2 * self.size, -np.inf)
+        self.arg = np.zeros(2 * self.size, dtype=np.int64)
+        self.sum = np.zeros(2 * self.size)
+
+        leaves = slice(self.size, self.size + self.n)
+        self.max[leaves] = utility
+        self.arg[self.size:] = np.arange(self.size)
+        self.sum[leaves] = np.maximum(utility, 0)
+
+        # Build internal nodes one tree level at a time, ties to the left
+        lo = self.size // 2
+        while lo >= 1:
+            nodes = np.arange(lo, 2 * lo)
+            left, right = 2 * nodes, 2 * nodes + 1
+            take_left = self.max[left] >= self.max[right]
+            self.max[nodes] = np.where(take_left, self.max[left], self.max[right])
+            self.arg[nodes] = np.where(take_left, self.arg[left], self.arg[right])
+            self.sum[nodes] = self.sum[left] + self.sum[right]
+            lo //= 2
+
+        # Single-node updates are faster on plain lists
+        self.max, self.arg, self.sum = \
+            self.max.tolist(), self.arg.tolist(), self.sum.tolist()
+
+    def __len__(self):
+        return self.n
+
+    def update(self, i, value, weight=None):
+        node = self.size + i
+        self.max[node] = value = float(value)
+        self.sum[node] = max(value, 0) if weight is None else weight
+        node //= 2
+        while node >= 1:
+            left, right = 2 * node, 2 * node + 1
+            if self.max[left] >= self.max[right]:
+                self.max[node], self.arg[node] = self.max[left], self.arg[left]
+            else:
+                self.max[node], self.arg[node] = self.max[right], self.arg[right]
+            self.sum[node] = self.sum[left] + self.sum[right]
+            node //= 2
+
+    def value(self, i):
+        return self.max[self.size + i]
+
+    def top_k(self, k, exclude=()):
+        """The k highest utilities, descending with ties to the lower index."""
+        selected = []
+        heap = [(-self.max[1], self.arg[1], 1)]
+        while heap and len(selected) < k:
+            _, i, node = heapq.heappop(heap)
+            if i >= self.n:  # Subtree of padding only
+                continue
+
+            # Walk down to the leaf holding the max, queueing the siblings
+            while node < self.size:
+                left, right = 2 * node, 2 * node + 1
+                node, other = (left, right) if self.arg[left] == i else (right, left)
+                heapq.heappush(heap, (-self.max[other], self.arg[other], other))
+
+            if i not in exclude:
+                selected.append(i)
+        return selected
+
+    def sample(self, k):
+        """Draw k distinct clients with probability proportional to utility."""
+        k = min(k, self.n)
+        selected = []
+        for _ in range(k):
+            total = self.sum[1]
+            if total <= 0:  # No positive utility left, draw uniformly
+                chosen = set(selected)
+                rest = [i for i in range(self.n) if i not in chosen]
+                selected.extend(random.sample(rest, k - len(selected)))
+                break
+
+            # Descend towards the leaf covering a uniform point of the mass
+            r, node = random.random() * total, 1
+            while node < self.size:
+                node *= 2
+                if r >= self.sum[node] and self.sum[node + 1] > 0:
+                    r -= self.sum[node]
+                    node += 1
+            i = node - self.size
+            selected.append(i)
+            # Without replacement: drop its mass until the draw is done
+            self.update(i, self.value(i), weight=0)
+
+        for i in selected:
+            self.update(i, self.value(i))
+        return selected
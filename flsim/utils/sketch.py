@@ -0,0 +1,29 @@
+import numpy as np
+
+
+class CountSketch(object):
+    """Sparse random projection of 'dim'-long vectors to 'width' entries.
+
+    Every coordinate is added with a random sign to one random bucket, so
+    inner products and distances are preserved in expectation (a sparse
+    Johnson-Lindenstrauss transform) at O(dim) cost per vector.
+    """
+
+    def __init__(self, dim, width, seed=0):
+        rng = np.random.default_rng(seed)
+        self.dim = dim
+        self.width = width
+        self.bucket = rng.integers(0, width, dim, dtype=np.int64)
+        self.sign = rng.choice(np.array([-1., 1.], dtype=np.float32), dim)
+
+    def transform(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            return self.transform(vectors[None])[0]
+        if not len(vectors):
+            return np.zeros((0, self.width), dtype=np.float32)
+
+        # Sum each row's signed coordinates per bucket
+        return np.stack([np.bincount(self.bucket, weights=row * self.sign,
+                                     minlength=self.width)
+                         for row in vectors]).astype(np.float32)
@@ -0,0 +1,231 @@
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Span(object):
+    __slots__ = ('spans', 'name', 'tags', 'outer', 'start')
+
+    def __init__(self, spans, name, tags):
+        self.spans = spans
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        # Spans opened inside this one, in this thread, inherit its tags
+        local = self.spans.local
+        self.outer = getattr(local, 'tags', {})
+        self.tags = local.tags = dict(self.outer, **self.tags)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.spans.local.tags = self.outer
+        self.spans.add(self.name, self.start, end, **self.tags)
+        return False
+
+
+class Spans(object):
+    """Wall-clock timers for the phases of a round.
+
+    Spans are tagged with the current round and, where given, a client
+    id, which nested spans in the same thread inherit. Until a trace is
+    opened or an observer registered, span() hands back a shared no-op
+    context, so instrumented code pays a single attribute check.
+    Observers are called with the duration (or value) of every span (or
+    metric) of their name as it finishes.
+
+    Once a trace is open, the spans of a round are kept until end_round(),
+    which logs a per-phase breakdown, appends it to <path>_spans.csv and
+    streams the round to a Chrome trace at path (chrome://tracing or
+    Perfetto), where wall time and simulated time show up as two
+    processes side by side. Metrics (plain values such as memory or CPU
+    time) are summarized per round next to the spans and drawn as
+    counters. An interrupted run leaves the trace array unterminated,
+    which both viewers accept.
+    """
+
+    WALL, SIM = 1, 2
+    NULL = _NullSpan()
+
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.observers = {}  # name -> [callback]
+        self.round = None
+        self.events = []  # (name, start, end, thread, tags), wall seconds
+        self.sim_events = []  # (name, start, end, tags), simulated seconds
+        self.metrics = []  # (name, time, value, tags)
+        self.local = threading.local()
+
+    def open(self, path):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.round_start = self.origin
+        self.trace = open(path, 'w')
+        self.trace.write('[')
+        self.first = True
+        for pid, name in [(self.WALL, 'wall time'), (self.SIM, 'simulated time')]:
+            self.emit({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                       'args': {'name': name}})
+
+        self.table = open(os.path.splitext(path)[0] + '_spans.csv', 'w', newline='')
+        self.table_writer = csv.writer(self.table)
+        self.table_writer.writerow(['round', 'span', 'count', 'total', 'mean'])
+        self.tracing = self.enabled = True
+        logging.info('Tracing spans: {}'.format(path))
+
+    def close(self):
+        if not self.tracing:
+            return
+        if self.events or self.sim_events or self.metrics:
+            self.end_round()
+        self.trace.write('\n]\n')
+        self.trace.close()
+        self.table.close()
+        self.tracing = False
+        self.enabled = bool(self.observers)
+
+    def observe(self, name, callback):
+        self.observers.setdefault(name, []).append(callback)
+        self.enabled = True
+
+    def unobserve(self, name, callback):
+        self.observers[name].remove(callback)
+        if not self.observers[name]:
+            del self.observers[name]
+        self.enabled = self.tracing or bool(self.observers)
+
+    # Recording
+    def span(self, name, **tags):
+        if not self.enabled:
+            return self.NULL
+        return _Span(self, name, tags)
+
+    def add(self, name, start, end, **tags):
+        """Record a span timed by the caller, in perf_counter seconds."""
+        if not self.enabled:
+            return
+        for callback in self.observers.get(name, ()):
+            callback(end - start)
+        if self.tracing:
+            tags = dict(getattr(self.local, 'tags', {}), **tags)
+            tags.setdefault('round', self.round)
+            self.events.append((name, start, end, threading.get_ident(), tags))
+
+    def sim(self, name, start, end, **tags):
+        """Record an interval of simulated time, in seconds."""
+        if self.tracing:
+            tags.setdefault('round', self.round)
+            self.sim_events.append((name, start, end, tags))
+
+    def metric(self, name, value, **tags):
+        """Record a value observed now, e.g. the peak memory of a process."""
+        if not self.enabled or value is None:
+            return
+        for callback in self.observers.get(name, ()):
+            callback(value)
+        if self.tracing:
+            tags.setdefault('round', self.round)
+            self.metrics.append((name, time.perf_counter(), value, tags))
+
+    def iterate(self, iterable, load, step, **tags):
+        """Yield from iterable, timing each fetch as load and the work done
+        on an item before the next fetch as step."""
+        if not self.enabled:
+            return iterable
+        return self._iterate(iterable, load, step, tags)
+
+    def _iterate(self, iterable, load, step, tags):
+        iterator = iter(iterable)
+        start = None
+        try:
+            while True:
+                fetch = time.perf_counter()
+                if start is not None:
+                    self.add(step, start, fetch, **tags)
+                    start = None
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                start = time.perf_counter()
+                self.add(load, fetch, start, **tags)
+                yield item
+        finally:  # Loop left early, close the last step
+            if start is not None:
+                self.add(step, start, time.perf_counter(), **tags)
+
+    # Output
+    def begin_round(self, round):
+        self.round = round
+        self.round_start = time.perf_counter()
+
+    def end_round(self, sim_start=None, sim_end=None):
+        if not self.tracing:
+            return
+        wall = time.perf_counter() - self.round_start
+        if sim_start is not None and sim_end is not None:
+            self.sim('round', sim_start, sim_end)
+        events, self.events = self.events, []
+        sim_events, self.sim_events = self.sim_events, []
+        metrics, self.metrics = self.metrics, []
+
+        # Per-phase totals; client spans overlap when clients run in threads
+        totals = OrderedDict()
+        for name, start, end, _, _ in sorted(events, key=lambda e: e[1]):
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + end - start)
+
+        lines = ['Round {} spans: wall {:.3f} s{}'.format(
+            self.round, wall, '' if sim_end is None else
+            ', simulated {:.3f} s'.format(sim_end - sim_start))]
+        for name, (count, total) in totals.items():
+            lines.append('  {:<24}{:>6}  {:>10.4f} s  {:>6.1f}%'.format(
+                name, count, total, 100 * total / wall if wall else 0))
+            self.table_writer.writerow([self.round, name, count, total, total / count])
+
+        values = OrderedDict()
+        for name, _, value, _ in metrics:
+            values.setdefault(name, []).append(value)
+        for name, observed in values.items():
+            lines.append('  {:<24}{:>6}  mean {:.4g}, max {:.4g}'.format(
+                name, len(observed), sum(observed) / len(observed), max(observed)))
+            self.table_writer.writerow([self.round, name, len(observed), sum(observed),
+                                        sum(observed) / len(observed)])
+        logging.info('\n'.join(lines))
+        self.table.flush()
+
+        for name, start, end, thread, tags in events:
+            self.emit({'name': name, 'cat': 'wall', 'ph': 'X', 'pid': self.WALL,
+                       'tid': thread, 'ts': 1e6 * (start - self.origin),
+                       'dur': 1e6 * (end - start), 'args': tags})
+        for name, start, end, tags in sim_events:
+            self.emit({'name': name, 'cat': 'sim', 'ph': 'X', 'pid': self.SIM,
+                       'tid': tags.get('client', -1), 'ts': 1e6 * start,
+                       'dur': 1e6 * (end - start), 'args': tags})
+        for name, at, value, tags in metrics:
+            self.emit({'name': name, 'cat': 'metric', 'ph': 'C', 'pid': self.WALL,
+                       'ts': 1e6 * (at - self.origin), 'args': {name: value}})
+        self.trace.flush()
+
+    def emit(self, event):
+        self.trace.write(('\n' if self.first else ',\n') + json.dumps(event))
+        self.first = False
+
+
+# Shared by the server, its clients and the network in this process
+spans = Spans()